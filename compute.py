@@ -2,15 +2,17 @@
 
 # Computes and assigns PageRank and HITS scores to indexed documents.
 
+import os
 import sys
 import time
 from lib.pagerank import page_rank
 from lib.hits import hits_algorithm
-from lib.reader import initialize, get_num_documents, get_document, initialize_doclinks
-from lib.writer import update_doc_pr_quality, update_doc_hits_quality
+from lib.document import Document
+from lib.reader import Index, initialize, get_num_documents, get_document, initialize_doclinks, get_champions, is_quality_ordered
+from lib.writer import update_doc_pr_quality, update_doc_hits_quality, write_champions, reorder_index, update_index_version, read_doclinks
 from lib.indexfiles import *
 
-USAGE_MSG = "usage: python compute.py"
+USAGE_MSG = "usage: python compute.py [--shards | -s]"
 
 def compute_scores():
     """Compute and update PageRank and HITS scores for all documents.
@@ -35,14 +37,86 @@ def compute_scores():
     hits_scores = {doc_id: (hub_scores.get(doc_id, 0), auth_scores.get(doc_id, 0)) for doc_id in hub_scores}  
     update_doc_hits_quality(DOCINFO_NAME, hits_scores)
 
+    # Restore the docid ordering (if any) since it is by static quality
+    if is_quality_ordered():
+        reorder_index(DOCINFO_NAME, DOCLINKS_NAME, MERGEINFO_NAME, BUCKETS_DIR, SUMMARY_NAME)
+
+    # Rebuild the high tier (if any) since it ranks by static quality
+    if get_champions():
+        write_champions(DOCINFO_NAME, BUCKETS_DIR, get_champions())
+
+    # The quality scores changed the index
+    update_index_version(MERGEINFO_NAME)
+
+def compute_shard_scores():
+    """Compute and update PageRank and HITS scores for the documents of
+    every shard (see makeindex.py --shards).
+
+    The scores are computed over the link structure of the whole collection,
+    in which document (d - 1) // n + 1 of shard s is document (d - 1) * n + s + 1
+    of n shards, so the documents of the shards get the scores they would
+    have in a single index.
+    """
+    shards = sorted(int(name) for name in os.listdir(SHARDS_DIR) if name.isdigit())
+    num_shards = len(shards)
+    assert shards == list(range(num_shards)), f"shards missing from {SHARDS_DIR}"
+
+    def global_docid(shard, docid):
+        return (docid - 1) * num_shards + shard + 1
+
+    # Gather the documents of every shard by their docids in the collection
+    indexes = [Index(shard_path(shard, DOCINFO_NAME), shard_path(shard, MERGEINFO_NAME),
+        shard_path(shard, BUCKETS_DIR), 0) for shard in shards]
+    shard_documents = {}
+    for shard, index in enumerate(indexes):
+        for document in index.docinfo:
+            shard_documents[global_docid(shard, document.docid)] = document
+    documents = []
+    for docid in range(1, max(shard_documents, default=0) + 1):
+        # sparse document ids (past the last document of a shard) are empty
+        document = shard_documents.get(docid)
+        if document is None or document.empty:
+            documents.append(Document(docid=docid, url='', total_tokens=0, empty=True))
+        else:
+            documents.append(Document(docid=docid, url=document.url, total_tokens=document.total_tokens))
+
+    # Link documents across shards by URL (like reader.initialize_doclinks)
+    links_index = {document.url: document.docid for document in documents if not document.empty}
+    doclinks = {document.docid: set() for document in documents}
+    for shard in shards:
+        for docid, urls in read_doclinks(shard_path(shard, DOCLINKS_NAME)).items():
+            doclinks[global_docid(shard, docid)] = {links_index[url] for url in urls if url in links_index}
+
+    pr_scores = page_rank(documents, links=doclinks.__getitem__)
+    hub_scores, auth_scores = hits_algorithm(documents, links=doclinks.__getitem__)
+
+    for shard, index in enumerate(indexes):
+        index.close()
+        docids = {docid: global_docid(shard, docid) for docid in range(1, index.last_docid + 1)}
+        docinfo_filename = shard_path(shard, DOCINFO_NAME)
+        update_doc_pr_quality(docinfo_filename, {docid: pr_scores[g] for docid, g in docids.items()})
+        update_doc_hits_quality(docinfo_filename, {docid: (hub_scores.get(g, 0), auth_scores.get(g, 0))
+            for docid, g in docids.items()})
+
+        # Rebuild the high tier (if any) since it ranks by static quality
+        if index.champions:
+            write_champions(docinfo_filename, shard_path(shard, BUCKETS_DIR), index.champions)
+
+        # The quality scores changed the shard
+        update_index_version(shard_path(shard, MERGEINFO_NAME))
+
 if __name__ == "__main__":
-    if len(sys.argv) != 1:
+    shards = sys.argv[1:] in (["--shards"], ["-s"])
+    if len(sys.argv) != 1 and not shards:
         print(USAGE_MSG)
         sys.exit(1)
 
     print("Computing scores...")
     start = time.time()
-    compute_scores()
+    if shards:
+        compute_shard_scores()
+    else:
+        compute_scores()
     print("Scores computed successfully.")
     end = time.time()
     print(f"Time taken: {end - start:.2f} seconds")
\ No newline at end of file
@@ -0,0 +1,173 @@
+# coordinator.py
+#
+# serves queries over the shards of the index
+# (see makeindex.py --shards and lib/coordinator.py)
+#
+# usage: python coordinator.py [--local] [--timeout s] [--threads n] [--queue n]
+#   [--host host] [--port port] [shard_url ...]
+
+import os
+import sys
+import time
+import atexit
+import subprocess
+import urllib.request
+from flask import Flask, request, jsonify
+from lib.coordinator import Coordinator
+from lib.asyncserver import AsyncServer
+from lib.indexfiles import *
+
+app = Flask(__name__)
+
+USAGE_MSG = "usage: python coordinator.py [--local] [--timeout s] [--threads n] [--queue n]" \
+    " [--host host] [--port port] [shard_url ...]"
+
+# default number of results per query and max number of results per query
+DEFAULT_API_K = 10
+MAX_API_K = 1000
+
+# default time (in seconds) a shard has to answer a request
+DEFAULT_TIMEOUT_SECS = 5.0
+
+# default number of query threads and max queued requests of the asyncio server
+DEFAULT_ASYNC_THREADS = 4
+DEFAULT_ASYNC_QUEUE = 64
+
+# default address of the coordinator (the shards started with --local
+# listen on the ports that follow it)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+
+# seconds to wait for the shards started with --local to load their index
+SHARD_STARTUP_SECS = 120
+
+coordinator = None
+server = None
+
+@app.route("/api/search", methods=["GET", "POST"])
+def api_search():
+    """Returns the results of the query "q" over every shard as JSON rows
+    (rank, shard, docid in the shard, url and score). "partial" is true
+    if a shard failed to answer (see lib/coordinator.py).
+    """
+    params = request.get_json(silent=True) or request.values
+    query = params.get("q")
+    try:
+        if not isinstance(query, str):
+            raise ValueError("missing query 'q'")
+        k = int(params.get("k", DEFAULT_API_K))
+        offset = int(params.get("offset", 0))
+        match = params.get("match", "all")
+        if not 0 < k <= MAX_API_K or offset < 0 or match not in ("all", "any"):
+            raise ValueError(f"k must be in 1..{MAX_API_K}, offset >= 0 and match 'all' or 'any'")
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+
+    start_time = time.time_ns()
+    try:
+        results, total_results, partial = coordinator.search(query, k, offset, disjunctive=(match == "any"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    query_time = (time.time_ns() - start_time) / 1_000_000
+    return jsonify(query=query, total=total_results, time_ms=query_time, partial=partial, results=[
+        {"rank": rank, "shard": result["shard"], "docid": result["docid"], "url": result["url"],
+            "score": result["score"]}
+        for rank, result in enumerate(results, offset + 1)
+    ])
+
+@app.route("/stats")
+def stats():
+    return jsonify(shards=coordinator.stats(), server=server.stats() if server else None)
+
+def start_local_shards(host, port):
+    """Starts a search process for each shard of the index (see search.py
+    --shard) on the ports that follow `port` and waits until they serve.
+    Returns their URLs. The processes are stopped when this process exits.
+    """
+    shards = sorted(int(name) for name in os.listdir(SHARDS_DIR) if name.isdigit())
+    assert shards, f"no shards in {SHARDS_DIR} (see makeindex.py --shards)"
+    urls = []
+    processes = []
+    for shard in shards:
+        shard_port = port + 1 + shard
+        processes.append(subprocess.Popen([sys.executable, "search.py", "--shard", str(shard), "--async",
+            "--host", host, "--port", str(shard_port)]))
+        urls.append(f"http://{host}:{shard_port}")
+
+    def _stop():
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    atexit.register(_stop)
+
+    deadline = time.monotonic() + SHARD_STARTUP_SECS
+    for shard, url, process in zip(shards, urls, processes):
+        while True:
+            assert process.poll() is None, f"shard {shard} exited"
+            try:
+                urllib.request.urlopen(f"{url}/stats", timeout=1).read()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, f"shard {shard} did not start"
+                time.sleep(0.2)
+    print(f"Started {len(shards)} shards on ports {port + 1}..{port + len(shards)}")
+    return urls
+
+if __name__ == "__main__":
+    local = False
+    timeout = DEFAULT_TIMEOUT_SECS
+    async_threads = DEFAULT_ASYNC_THREADS
+    async_queue = DEFAULT_ASYNC_QUEUE
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    shard_urls = []
+    try:
+        arg = 1
+        while arg < len(sys.argv):
+            if sys.argv[arg] == "--local":
+                # start a search process for each shard of the index
+                local = True
+                arg += 1
+            elif sys.argv[arg] == "--timeout":
+                # time a shard has to answer a request
+                timeout = float(sys.argv[arg + 1])
+                assert timeout > 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--threads":
+                # number of queries evaluated at once
+                async_threads = int(sys.argv[arg + 1])
+                assert async_threads > 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--queue":
+                # max number of requests waiting for a thread (more are rejected)
+                async_queue = int(sys.argv[arg + 1])
+                assert async_queue >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--host":
+                host = sys.argv[arg + 1]
+                arg += 2
+            elif sys.argv[arg] == "--port":
+                port = int(sys.argv[arg + 1])
+                assert 0 <= port < 65536, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg].startswith("http://"):
+                shard_urls.append(sys.argv[arg].rstrip("/"))
+                arg += 1
+            else:
+                raise ValueError(USAGE_MSG)
+        assert local != bool(shard_urls), USAGE_MSG
+    except Exception as e:
+        print(USAGE_MSG)
+        sys.exit(1)
+
+    if local:
+        try:
+            shard_urls = start_local_shards(host, port)
+        except (AssertionError, OSError) as e:
+            print(f"Failed to start the shards: {e}")
+            sys.exit(1)
+
+    coordinator = Coordinator(shard_urls, timeout, async_threads)
+    server = AsyncServer(app, host, port, async_threads, async_queue)
+    server.serve_forever()
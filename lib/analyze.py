@@ -0,0 +1,99 @@
+# lib/analyze.py
+#
+# content extraction of web pages
+#
+# shared by makeindex.py (which indexes a collection of pages) and the
+# ingestion of documents into a running search engine (see lib/segment.py)
+
+from bs4 import BeautifulSoup
+from collections import defaultdict
+from urllib.parse import urldefrag, urljoin
+
+from lib.tokenize import *
+from lib.word_count import word_count
+
+# tags of important text and their importance (see params.importance)
+#
+# titles, bold text, headings up to h4
+# (h4 is similar to bold)
+# and mark (highlighted) text
+#
+# tags ordered first are prioritized
+IMPORTANT_TAGS = [
+    ('title',1), ('h1',2), ('h2',3), ('h3',4),
+    ('h4',5), ('b',6), ('strong',7), ('mark',8),
+]
+
+
+def extract_page(content, url):
+    """Extracts the text of the HTML page at the (defragged) URL.
+    Returns its (unstemmed) tokens and n-grams (see tokenize), the set of
+    stemmed tokens of each important tag and the set of (defragged) URLs
+    it links to.
+    """
+    # soupify content
+    soup = BeautifulSoup(content, 'lxml')
+    important_tokens = defaultdict(set)
+
+    # extract regular text
+    text = soup.get_text()
+    tokens, ngrams_col = tokenize(text, n=1)
+    text = "" # possibly free up memory
+
+    # extract important text
+    for tag, _ in IMPORTANT_TAGS:
+        taglist = soup.find_all(tag)
+        for tag_soup in taglist:
+            tag_text = tag_soup.get_text()
+            tag_tokens, _ = tokenize(tag_text, n=1)
+            stem_tokens(tag_tokens) # match the stemmed tokens
+            important_tokens[tag].update(tag_tokens)
+            tag_text = "" # possibly free up memory
+            tag_soup.decompose() # free up memory from soup
+
+    # extract links
+    #
+    # store them as a list of adjacent edges
+    # these are storred as defragged URLs
+    #
+    # these are used to determine the static quality score (hits or pagerank)
+    doclinks = set()
+    for link in soup.find_all('a', href=True):
+        link = urljoin(url, link['href'])
+        defragged_link = urldefrag(link).url
+        doclinks.add(defragged_link)
+
+    # free up memory from soup
+    soup.decompose()
+
+    return tokens, ngrams_col, important_tokens, doclinks
+
+
+def page_terms(tokens, ngrams_col, important_tokens, biwords=False):
+    """Returns the terms of an extracted page (see extract_page) as a dict
+    of token -> (tf, important) and its total tokens (number of unique
+    tokens). The tokens are extended with the n-grams and stemmed in place.
+
+    If `biwords`, the biwords (pairs of adjacent terms) of the page are
+    returned as well, as a dict of biword -> tf; biwords are neither
+    important nor counted towards the total tokens.
+    """
+    # manipulate tokens
+    extend_tokens_from_ngrams(tokens, ngrams_col)
+    stem_tokens(tokens)
+
+    token_counts = word_count(tokens)
+    total_tokens = len(token_counts.items())
+
+    terms = {}
+    for token, count in token_counts.items():
+        # determine whether token is important
+        important = 0
+        for tag, val in IMPORTANT_TAGS:
+            if token in important_tokens[tag]:
+                important = val
+                break
+        terms[token] = (count, important)
+
+    biword_counts = word_count(biwords_of(tokens)) if biwords else {}
+    return terms, total_tokens, biword_counts
@@ -0,0 +1,265 @@
+# lib/asyncserver.py
+#
+# asyncio HTTP server with bounded concurrency
+#
+# connections are handled by an event loop, which parses the requests
+# and runs the WSGI app (query evaluation and rendering) on a thread pool
+# of `concurrency` threads; requests that find every thread busy wait in a
+# queue for a free thread, and requests that arrive while `concurrency +
+# max_queue` requests are already admitted are rejected at once with a 503
+# (so latency stays bounded under load instead of growing with the backlog)
+#
+# only the subset of HTTP/1.1 the search engine needs is supported:
+# keep-alive connections and request bodies with a Content-Length
+# (no chunked requests, no pipelining beyond reading requests in order)
+
+import io
+import sys
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote_to_bytes
+
+# max size of the request line and headers (and of a request body)
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = 15.0
+
+# number of most recent queue wait times kept for the percentiles
+WAIT_WINDOW = 1024
+
+# seconds a client is asked to wait before retrying a rejected request
+RETRY_AFTER_SECS = 1
+
+
+class _BadRequest(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class AsyncServer:
+    """HTTP server that runs a WSGI app with at most `concurrency` requests
+    evaluated at once and at most `max_queue` requests waiting.
+    """
+    def __init__(self, app, host, port, concurrency, max_queue):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="query")
+        self._slots = None # asyncio.Semaphore (created in the event loop)
+
+        # the stats are only updated by the event loop
+        self.in_flight = 0
+        self.queued = 0
+        self.max_in_flight = 0
+        self.max_queued = 0
+        self.served = 0
+        self.rejected = 0
+        self.errors = 0
+        self._waits = deque(maxlen=WAIT_WINDOW)
+
+    def stats(self):
+        """Returns the load stats of the server, including the time (in ms)
+        the most recent requests waited in the queue before being evaluated.
+        """
+        waits = sorted(self._waits)
+        def _percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3) if waits else 0.0
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "served": self.served,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "queue_wait_avg_ms": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+            "queue_wait_p50_ms": _percentile(0.50),
+            "queue_wait_p99_ms": _percentile(0.99),
+        }
+
+    def serve_forever(self):
+        """Serves requests until interrupted.
+        """
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _serve(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+            limit=MAX_HEADER_BYTES, backlog=1024)
+        print(f"Serving on http://{self.host}:{self.port}/ with {self.concurrency} query threads"
+            f" (queue of {self.max_queue})")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    break
+
+                try:
+                    environ, keep_alive = self._parse_request(head, writer)
+                    length = int(environ.get('CONTENT_LENGTH') or 0)
+                    if length < 0 or length > MAX_BODY_BYTES:
+                        raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    body = await reader.readexactly(length) if length else b''
+                except _BadRequest as e:
+                    await self._write_error(writer, e.status)
+                    break
+                except ValueError:
+                    await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+                    break
+                environ['wsgi.input'] = io.BytesIO(body)
+
+                # shed the load at once if the queue is full
+                if self.in_flight + self.queued >= self.concurrency + self.max_queue:
+                    self.rejected += 1
+                    await self._write_error(writer, HTTPStatus.SERVICE_UNAVAILABLE,
+                        [("Retry-After", str(RETRY_AFTER_SECS))], keep_alive)
+                    if not keep_alive:
+                        break
+                    continue
+
+                status, headers, body = await self._evaluate(environ)
+                headers = [(name, value) for name, value in headers
+                    if name.lower() not in ("connection", "content-length")]
+                headers.append(("Content-Length", str(len(body))))
+                headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+                await self._write(writer, status, headers, body)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _evaluate(self, environ):
+        """Waits for a free thread and runs the WSGI app on it.
+        """
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        start_time = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        wait = time.perf_counter() - start_time
+        self._waits.append(wait)
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, body = await loop.run_in_executor(self._executor, self._call_app, environ)
+            if status.startswith("5"):
+                self.errors += 1
+            return status, headers, body
+        finally:
+            self.in_flight -= 1
+            self.served += 1
+            self._slots.release()
+
+    def _call_app(self, environ):
+        """Runs the WSGI app and returns its (status, headers, body).
+        """
+        response = []
+        def _start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+        try:
+            result = self.app(environ, _start_response)
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return response[0], response[1], body
+        except Exception as e:
+            print(f"Error while serving {environ['PATH_INFO']}: {e!r}", file=sys.stderr)
+            return "500 Internal Server Error", [("Content-Type", "text/plain")], b"Internal Server Error"
+
+    def _parse_request(self, head, writer):
+        """Returns the WSGI environ of the request (without its input)
+        and whether the connection is kept alive after it.
+        """
+        lines = head[:-4].decode('latin-1').split('\r\n')
+        try:
+            method, target, protocol = lines[0].split(' ')
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+        if not protocol.startswith('HTTP/1.'):
+            raise _BadRequest(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+
+        path, _, query_string = target.partition('?')
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query_string,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise _BadRequest(HTTPStatus.BAD_REQUEST)
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name == 'TRANSFER_ENCODING':
+                raise _BadRequest(HTTPStatus.NOT_IMPLEMENTED)
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                key = 'HTTP_' + name
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if protocol == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+        return environ, keep_alive
+
+    async def _write(self, writer, status, headers, body):
+        head = [f"HTTP/1.1 {status}"]
+        head.extend(f"{name}: {value}" for name, value in headers)
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _write_error(self, writer, status, headers=(), keep_alive=False):
+        body = status.phrase.encode('latin-1')
+        await self._write(writer, f"{status.value} {status.phrase}", [
+            ("Content-Type", "text/plain"),
+            ("Content-Length", str(len(body))),
+            ("Connection", "keep-alive" if keep_alive else "close"),
+            *headers,
+        ], body)
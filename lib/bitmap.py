@@ -0,0 +1,240 @@
+# lib/bitmap.py
+#
+# bitmap postings lists for dense terms
+#
+# the postings lists of terms that occur in a large fraction of the
+# documents are stored as a roaring-style bitmap of their docids followed
+# by a side array of the (tf, fields bits) of each posting in docid order
+#
+# the docids are split into containers of 2^16 docids (by their high bits);
+# a container is stored as a sorted array of the low 16 bits of its docids
+# if it holds few docids or as a bitmap of 2^16 bits otherwise
+#
+# in memory, the docids are kept as a flat bitmap, so postings lists are
+# intersected with bitwise operations and a posting is found by its rank
+# (the number of docids before it) in the side array
+
+import struct
+from array import array
+from lib.structs import *
+from lib.posting import *
+
+BITMAP_FLAG = 0x80000000    # set in num_postings of bitmap postings lists
+BITMAP_DENSITY = 1 / 16     # min fraction of the documents for bitmap postings lists
+
+_CONTAINER_BITS = 16
+_CONTAINER_BYTES = (1 << _CONTAINER_BITS) // 8  # size of a bitmap container
+_ARRAY_MAX = 4096                               # max docids of an array container
+_RANK_BLOCK = 512                               # bytes per rank block (4096 docids)
+
+BLOCK_DOCIDS = _RANK_BLOCK * 8                  # docids per rank block
+
+_SIDE = struct.Struct('<II')                    # (tf, fields bits) per posting
+
+
+def is_dense(doc_freq, num_docs):
+    """Returns True if a postings list with `doc_freq` postings
+    is stored as a bitmap (for an index of `num_docs` documents).
+    """
+    return num_docs > 0 and doc_freq >= BITMAP_DENSITY * num_docs
+
+
+def iter_bits(bits):
+    """Yields the positions of the set bits in ascending order.
+    """
+    for i in range(0, len(bits), 8):
+        word = int.from_bytes(bits[i:i + 8], byteorder='little')
+        while word:
+            low = word & -word
+            yield i * 8 + low.bit_length() - 1
+            word ^= low
+
+
+def and_bits(*bitmaps):
+    """Returns the bitwise AND of the bitmaps.
+    """
+    size = min(len(bits) for bits in bitmaps)
+    result = int.from_bytes(bitmaps[0][:size], byteorder='little')
+    for bits in bitmaps[1:]:
+        result &= int.from_bytes(bits[:size], byteorder='little')
+    return result.to_bytes(size, byteorder='little')
+
+
+def test_bit(bits, position):
+    """Returns True if the bit at the position is set.
+    """
+    i = position >> 3
+    return i < len(bits) and bool(bits[i] >> (position & 7) & 1)
+
+
+class BitmapPostings:
+    """Postings list of a dense term: the bitmap of its docids
+    and the (tf, fields bits) of each posting in docid order.
+    """
+    def __init__(self, bits, side):
+        self.bits = bits
+        self.side = side
+
+        # number of docids before each rank block
+        self._ranks = array('I', [0])
+        total = 0
+        for start in range(0, len(bits), _RANK_BLOCK):
+            total += int.from_bytes(bits[start:start + _RANK_BLOCK], byteorder='little').bit_count()
+            self._ranks.append(total)
+
+    def __len__(self):
+        return len(self.side) // _SIDE.size
+
+    def nbytes(self):
+        """Returns the number of bytes held by the process
+        (views of shared memory are not counted, see lib/sharedcache.py).
+        """
+        nbytes = self._ranks.itemsize * len(self._ranks)
+        for buf in (self.bits, self.side):
+            if not isinstance(buf, memoryview):
+                nbytes += len(buf)
+        return nbytes
+
+    def contains(self, docid):
+        return test_bit(self.bits, docid)
+
+    def rank(self, docid):
+        """Returns the number of docids (postings) before the docid.
+        """
+        i = docid >> 3
+        if i >= len(self.bits):
+            return len(self)
+        block = i // _RANK_BLOCK
+        return (self._ranks[block]
+            + int.from_bytes(self.bits[block * _RANK_BLOCK:i], byteorder='little').bit_count()
+            + (self.bits[i] & ((1 << (docid & 7)) - 1)).bit_count())
+
+    def posting(self, docid):
+        """Returns the posting of the docid or None.
+        """
+        if not self.contains(docid):
+            return None
+        tf, bits = _SIDE.unpack_from(self.side, self.rank(docid) * _SIDE.size)
+        return posting_from_bits(docid, tf, bits)
+
+    def postings_range(self, lo, hi):
+        """Returns the postings with lo <= docid < hi (sorted by ascending docid).
+        """
+        start = lo >> 3
+        end = min(len(self.bits), (hi + 7) >> 3)
+        if start >= end:
+            return []
+
+        i = self.rank(lo)
+        postings = []
+        for position in iter_bits(self.bits[start:end]):
+            docid = start * 8 + position
+            if docid < lo:
+                continue
+            if docid >= hi:
+                break
+            tf, bits = _SIDE.unpack_from(self.side, i * _SIDE.size)
+            postings.append(posting_from_bits(docid, tf, bits))
+            i += 1
+        return postings
+
+    def postings(self):
+        """Returns the postings list (sorted by ascending docid).
+        """
+        return [
+            posting_from_bits(docid, tf, bits)
+            for docid, (tf, bits) in zip(iter_bits(self.bits), _SIDE.iter_unpack(self.side))
+        ]
+
+
+def sbitmap_rd(fh, num_postings):
+    """read the bitmap and the side array of a bitmap postings list
+    (after its num_postings)
+    """
+    num_containers, _ = u32_rd(fh)
+    rdsize = 4
+    containers = []
+    for _ in range(num_containers):
+        key, _ = u32_rd(fh)
+        cardinality, _ = u32_rd(fh)
+        if cardinality > _ARRAY_MAX:
+            payload = fh.read(_CONTAINER_BYTES)
+        else:
+            payload = struct.unpack(f'<{cardinality}H', fh.read(2 * cardinality))
+        containers.append((key, cardinality, payload))
+        rdsize += 8 + (_CONTAINER_BYTES if cardinality > _ARRAY_MAX else 2 * cardinality)
+
+    # flat bitmap (padded to whole words)
+    size = (containers[-1][0] + 1) * _CONTAINER_BYTES if containers else 0
+    bits = bytearray(size)
+    for key, cardinality, payload in containers:
+        base = key * _CONTAINER_BYTES
+        if cardinality > _ARRAY_MAX:
+            bits[base:base + _CONTAINER_BYTES] = payload
+        else:
+            for low in payload:
+                bits[base + (low >> 3)] |= 1 << (low & 7)
+
+    side = fh.read(num_postings * _SIDE.size)
+    rdsize += len(side)
+
+    return BitmapPostings(bytes(bits), side), rdsize
+
+
+def sbitmap_repr(postings):
+    """byte repr of a bitmap postings list (including its num_postings)
+    """
+    containers = {}
+    for posting in postings:
+        key = posting.docid >> _CONTAINER_BITS
+        containers.setdefault(key, []).append(posting.docid & 0xFFFF)
+
+    seq = bytearray()
+    seq.extend(u32_repr(len(postings) | BITMAP_FLAG))
+    seq.extend(u32_repr(len(containers)))
+    for key in sorted(containers):
+        lows = containers[key]
+        seq.extend(u32_repr(key))
+        seq.extend(u32_repr(len(lows)))
+        if len(lows) > _ARRAY_MAX:
+            bits = bytearray(_CONTAINER_BYTES)
+            for low in lows:
+                bits[low >> 3] |= 1 << (low & 7)
+            seq.extend(bits)
+        else:
+            seq.extend(struct.pack(f'<{len(lows)}H', *lows))
+
+    for posting in postings:
+        seq.extend(_SIDE.pack(posting.tf, posting_bits(posting)))
+
+    return bytes(seq)
+
+
+def spostings_rd(fh):
+    """read a postings list (stored either as postings or as a bitmap)
+    as a list of postings
+    """
+    num_postings, _ = u32_rd(fh)
+    if num_postings & BITMAP_FLAG:
+        bitmap, rdsize = sbitmap_rd(fh, num_postings & ~BITMAP_FLAG)
+        return bitmap.postings(), 4 + rdsize
+
+    postings = []
+    for _ in range(num_postings):
+        posting, _ = sposting_rd(fh)
+        postings.append(posting)
+    return postings, 4 + num_postings * SPOSTING_SIZE
+
+
+def spostings_repr(postings, bitmap=False):
+    """byte repr of a postings list (sorted by ascending docid),
+    stored as a bitmap if `bitmap`
+    """
+    if bitmap:
+        return sbitmap_repr(postings)
+
+    seq = bytearray()
+    seq.extend(u32_repr(len(postings)))
+    for posting in postings:
+        seq.extend(sposting_repr(posting))
+    return bytes(seq)
@@ -0,0 +1,188 @@
+# lib/coordinator.py
+#
+# scatter-gather search over document-partitioned shards
+#
+# the collection is split into shards by docid (see makeindex.py --shards),
+# each served by its own search process (see search.py --shard); a query is
+# sent to every shard at once and the top results of the shards are merged
+#
+# scores must not depend on how the collection is split, so a query takes
+# three rounds of requests (see search.py for the /shard/* routes):
+#   (1) stats: the term statistics of each shard are summed into those of
+#       the whole collection, from which the query is pruned (like
+#       queryproc.prepare_query) and the idf of each term is computed
+#   (2) score: each shard scores its matched documents with the global idfs
+#       and returns the squared norms of their score components (see
+#       queryproc.component_norms), which are summed into the global norms
+#   (3) rank: each shard that matched any document normalizes its components
+#       by the global norms and returns its top results, which are merged
+# the norms of the documents were computed with the global idfs when the
+# shards were built, and compute.py --shards computes the static qualities
+# over the links of the whole collection, so the scores are those of
+# a single index evaluated exhaustively
+#
+# the norms need the components of every matched document, so each shard
+# scores all of its matches (see queryproc.shard_components) and none of
+# the pruning of a single index applies (high tier, early termination,
+# WAND); with the three rounds, a query costs a few more milliseconds than
+# on a single index, which only pays off once the collection is too large
+# for a single process
+#
+# a shard that fails or times out is left out of the results (which are then
+# marked as partial), so a slow shard does not hold up the query for long
+
+import sys
+import json
+import heapq
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from lib.tokenize import tokenize, stem_tokens
+from lib.word_count import word_count
+from lib.writer import term_idf
+from lib.queryproc import prepare_query, merge_norms
+from lib.queryparse import is_boolean_query
+
+
+class ShardError(Exception):
+    """A shard failed to answer a request."""
+
+
+class Coordinator:
+    """Sends queries to the shards (base URLs such as "http://127.0.0.1:5001")
+    and merges their results for at most `concurrency` queries at once.
+    Each request to a shard times out after `timeout` seconds.
+    """
+    def __init__(self, shard_urls, timeout, concurrency=1):
+        self.shard_urls = list(shard_urls)
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(len(self.shard_urls) * concurrency, thread_name_prefix="shard")
+        self._local = threading.local() # keep-alive connections of each thread
+
+        self._stats_lock = threading.Lock()
+        self._num_requests = [0] * len(self.shard_urls)
+        self._num_failures = [0] * len(self.shard_urls)
+
+    def _connection(self, shard):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(shard)
+        if connection is None:
+            url = urlsplit(self.shard_urls[shard])
+            connection = connections[shard] = http.client.HTTPConnection(
+                url.hostname, url.port or 80, timeout=self.timeout)
+        return connection
+
+    def _post(self, shard, path, body):
+        """Returns the JSON response of the shard to the request.
+        Raises ShardError if the shard did not answer.
+        """
+        with self._stats_lock:
+            self._num_requests[shard] += 1
+        data = json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json'}
+        for attempt in range(2):
+            connection = self._connection(shard)
+            try:
+                connection.request('POST', path, data, headers)
+                response = connection.getresponse()
+                payload = response.read()
+                if response.status != 200:
+                    raise ShardError(f"{response.status} {payload[:200]!r}")
+                return json.loads(payload)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                self._local.connections.pop(shard, None)
+                # a keep-alive connection may have been closed by the shard
+                if attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError,
+                        ConnectionResetError)):
+                    continue
+                error = ShardError(repr(e))
+            except ShardError as e:
+                error = e
+            break
+        with self._stats_lock:
+            self._num_failures[shard] += 1
+        raise error
+
+    def _scatter(self, shards, path, body):
+        """Sends the request to the shards at once. Returns the response
+        of each shard that answered (a dict of shard -> response).
+        """
+        futures = {shard: self._executor.submit(self._post, shard, path, body) for shard in shards}
+        responses = {}
+        for shard, future in futures.items():
+            try:
+                responses[shard] = future.result()
+            except ShardError as e:
+                print(f"Shard {shard} ({self.shard_urls[shard]}) failed: {e}", file=sys.stderr)
+        return responses
+
+    def search(self, query, k, offset=0, disjunctive=False):
+        """Returns the top k results of the query over every shard starting
+        from rank `offset` + 1, the total number of matched documents and
+        whether any shard failed to answer (in which case the results only
+        cover the shards that did).
+
+        Each result is a dict of the shard, its docid in the shard, its URL
+        and its score. Boolean queries (see lib/queryparse.py) are not
+        supported and raise ValueError.
+        """
+        if is_boolean_query(query):
+            raise ValueError("boolean queries are not supported by the coordinator")
+        shards = range(len(self.shard_urls))
+
+        # (1) term statistics of the whole collection
+        tokens, _ = tokenize(query)
+        stem_tokens(tokens)
+        tokens = sorted(word_count(tokens))
+        if not tokens:
+            return [], 0, False
+        responses = self._scatter(shards, '/shard/stats', {'tokens': tokens})
+        partial = len(responses) < len(shards)
+        num_docs = sum(response['num_docs'] for response in responses.values())
+        term_stats = {token: [0, 0, 0.0] for token in tokens}
+        for response in responses.values():
+            for token, (doc_freq, coll_freq, max_score) in response['stats'].items():
+                stats = term_stats[token]
+                stats[0] += doc_freq
+                stats[1] += coll_freq
+                stats[2] = max(stats[2], max_score)
+
+        frequencies = prepare_query(query, lambda token: term_stats[token])
+        if not frequencies:
+            return [], 0, partial
+        body = {
+            'terms': frequencies,
+            'idfs': {token: term_idf(term_stats[token][0], num_docs) for token in frequencies},
+            'match': 'any' if disjunctive else 'all',
+        }
+
+        # (2) norms of the score components of the matched documents
+        responses = self._scatter(responses.keys(), '/shard/score', body)
+        partial |= len(responses) < len(shards)
+        matched = {shard: response['matched'] for shard, response in responses.items() if response['matched']}
+        if not matched:
+            return [], 0, partial
+        body['norms'] = merge_norms(response['norms'] for response in responses.values())
+        body['k'] = offset + k
+
+        # (3) top results of each shard, merged
+        responses = self._scatter(matched.keys(), '/shard/rank', body)
+        partial |= len(responses) < len(matched)
+        results = heapq.nlargest(offset + k, (
+            dict(result, shard=shard) for shard, response in responses.items() for result in response
+        ), key=lambda result: result['score'])
+        return results[offset:], sum(matched.values()), partial
+
+    def stats(self):
+        """Returns the number of requests and failures of each shard.
+        """
+        with self._stats_lock:
+            return [
+                {'url': url, 'requests': requests, 'failures': failures}
+                for url, requests, failures in zip(self.shard_urls, self._num_requests, self._num_failures)
+            ]
@@ -0,0 +1,109 @@
+# lib/deadline.py
+#
+# per-query latency budgets
+#
+# a deadline is set for the queries evaluated by the calling thread
+# (see query_deadline); the evaluators check it between blocks of work
+# (docid ranges, or every few documents of top-k retrieval) and once it has
+# passed, they stop and rank the documents found so far, in which case the
+# result is marked as partial (anytime evaluation)
+#
+# the number of queries evaluated with a deadline and the number of them
+# that hit it are counted per process (see get_deadline_stats)
+
+import time
+import threading
+from contextlib import contextmanager
+
+# number of steps (documents scored or skipped to) of top-k retrieval
+# between two checks of the deadline
+CHECK_STEPS = 256
+
+# deadline of each thread (see query_deadline)
+_CURRENT = threading.local()
+
+_stats_lock = threading.Lock()
+_num_queries = 0
+_num_hits = 0
+
+
+class Deadline:
+    """Deadline of a query evaluated within `budget_ms` milliseconds.
+    `partial` is set once an evaluator stops early because of it.
+    """
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self.at = time.monotonic() + budget_ms / 1000
+        self.partial = False
+
+    def expired(self):
+        """Returns True if the deadline has passed, in which case the caller
+        must stop (so the result is marked as partial).
+        """
+        if time.monotonic() < self.at:
+            return False
+        self.partial = True
+        return True
+
+
+@contextmanager
+def query_deadline(budget_ms):
+    """Within the context, the queries evaluated by the calling thread stop
+    early once `budget_ms` milliseconds have passed and return the best
+    results found so far. Yields the Deadline, whose `partial` attribute
+    tells whether any result was cut short (or None if `budget_ms` is None or 0,
+    in which case there is no deadline).
+
+    Partial results are not cached (see queryproc.evaluate_cached).
+    """
+    global _num_queries
+    global _num_hits
+
+    if not budget_ms or getattr(_CURRENT, 'deadline', None) is not None:
+        yield getattr(_CURRENT, 'deadline', None) # no deadline, or nested
+        return
+
+    deadline = Deadline(budget_ms)
+    _CURRENT.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _CURRENT.deadline = None
+        with _stats_lock:
+            _num_queries += 1
+            _num_hits += deadline.partial
+
+
+def current_deadline():
+    """Returns the Deadline of the calling thread or None.
+    """
+    return getattr(_CURRENT, 'deadline', None)
+
+
+def deadline_expired():
+    """Returns True if the calling thread has a deadline that has passed
+    (see Deadline.expired).
+    """
+    deadline = getattr(_CURRENT, 'deadline', None)
+    return deadline is not None and deadline.expired()
+
+
+def mark_partial():
+    """Marks the result of the calling thread as partial
+    (when work was cut short by the deadline elsewhere, i.e. by a worker).
+    """
+    deadline = getattr(_CURRENT, 'deadline', None)
+    if deadline is not None:
+        deadline.partial = True
+
+
+def get_deadline_stats():
+    """Returns the number of queries evaluated with a deadline
+    and the number of them that hit it.
+    """
+    with _stats_lock:
+        return {
+            'queries': _num_queries,
+            'deadline_hits': _num_hits,
+            'hit_rate': _num_hits / _num_queries if _num_queries else 0.0,
+        }
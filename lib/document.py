@@ -3,6 +3,7 @@
 # document class
 
 from lib.structs import *
+from lib.params import pr_factor, hub_factor, auth_factor
 
 class Document:
     def __init__(
@@ -15,6 +16,7 @@ class Document:
         pr_quality=1.0,
         hub_quality=1.0,
         auth_quality=1.0,
+        norm=0.0,
     ):
         self.docid = docid
         self.url = url
@@ -24,6 +26,16 @@ class Document:
         self.pr_quality = pr_quality
         self.hub_quality = hub_quality
         self.auth_quality = auth_quality
+        self.norm = norm # length of the document's tfidf vector
+
+
+def static_quality(document):
+    """Returns the static quality score g(d) of the document,
+    which mixes its pagerank and HITS (hub/auth) scores.
+    """
+    return (pr_factor * document.pr_quality
+        + hub_factor * document.hub_quality
+        + auth_factor * document.auth_quality)
 
 
 def sdocument_rd(fh):
@@ -34,6 +46,7 @@ def sdocument_rd(fh):
     pr_quality, _ = f32_rd(fh)
     hub_quality, _ = f32_rd(fh)
     auth_quality, _ = f32_rd(fh)
+    norm, _ = f32_rd(fh)
     url, url_rdsize = sstr_rd(fh)
     return Document(
         docid=docid,
@@ -42,7 +55,8 @@ def sdocument_rd(fh):
         pr_quality=pr_quality,
         hub_quality=hub_quality,
         auth_quality=auth_quality,
-    ), 24 + url_rdsize
+        norm=norm,
+    ), 28 + url_rdsize
 
 
 def sdocument_repr(obj):
@@ -54,6 +68,7 @@ def sdocument_repr(obj):
     pr_quality = obj.pr_quality
     hub_quality = obj.hub_quality
     auth_quality = obj.auth_quality
+    norm = obj.norm
 
     seq = bytearray()
 
@@ -62,6 +77,7 @@ def sdocument_repr(obj):
     seq.extend(f32_repr(pr_quality))
     seq.extend(f32_repr(hub_quality))
     seq.extend(f32_repr(auth_quality))
+    seq.extend(f32_repr(norm))
     seq.extend(sstr_repr(url))
 
     return bytes(seq)
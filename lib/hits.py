@@ -12,12 +12,13 @@ def initialize_scores(docs):
     authority_scores = {doc.docid: 1 for doc in docs}
     return hub_scores, authority_scores
 
-def hits_algorithm(docs, max_iter=25, tol=1e-6):
+def hits_algorithm(docs, max_iter=25, tol=1e-6, links=get_linked_docids):
     """Calculate HITS scores for documents.
 
     :param docs: List of Document objects
     :param max_iter: Maximum number of iterations (default 100)
     :param tol: Convergence tolerance (default 1e-6)
+    :param links: Function of a docid to the docids it links to (default: those of the index)
     :return: Tuple of dictionaries of docid to hub and authority scores
     """
     hub_scores, authority_scores = initialize_scores(docs)
@@ -32,7 +33,7 @@ def hits_algorithm(docs, max_iter=25, tol=1e-6):
         # Hub scores = sum of the authority scores of the documents it links to
         # Auth scores = sum of the hub scores of the documents that link to it
         for doc in docs:
-            linked_docs = get_linked_docids(doc.docid)
+            linked_docs = links(doc.docid)
             new_hub_scores[doc.docid] = sum(authority_scores.get(link, 0) for link in linked_docs)
             new_authority_scores[doc.docid] = sum(hub_scores.get(link, 0) for link in linked_docs)
         
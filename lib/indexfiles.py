@@ -4,9 +4,20 @@
 
 INDEX_DIR = "index"
 BUCKETS_DIR = f"{INDEX_DIR}/buckets"
+SEGMENTS_DIR = f"{INDEX_DIR}/segments"
+SHARDS_DIR = f"{INDEX_DIR}/shards"
 
 PART_NAME = f"{INDEX_DIR}/.part"
 DOCINFO_NAME = f"{INDEX_DIR}/.docinfo"
 DOCLINKS_NAME = f"{INDEX_DIR}/.doclinks"
 MERGEINFO_NAME = f"{INDEX_DIR}/.mergeinfo"
 SUMMARY_NAME = f"{INDEX_DIR}/.summary"
+RESULT_CACHE_NAME = f"{INDEX_DIR}/.resultcache"
+QUERY_LOG_NAME = f"{INDEX_DIR}/.querylog"
+
+
+def shard_path(shard, name):
+    """Returns the path of the file (or directory) `name` of the index
+    in the shard (see makeindex.py --shards), which has the same layout.
+    """
+    return name.replace(INDEX_DIR, f"{SHARDS_DIR}/{shard}", 1)
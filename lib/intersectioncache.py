@@ -0,0 +1,75 @@
+# lib/intersectioncache.py
+#
+# cache for the intersections of pairs of postings lists
+#
+# entries are keyed by a sorted pair of terms and hold the sorted docids
+# of the documents that contain both terms, so conjunctive queries that
+# share a pair of terms (i.e. "uci ics") start from the cached intersection
+# instead of intersecting the pair's postings lists again
+#
+# the cache is bounded by memory and evicts entries using GreedyDual-Size
+# (see lib/versionedcache.py): an entry's priority is the cache age plus its
+# cost (the number of postings intersected to compute it) per byte, and the
+# age increases to the priority of each evicted entry, so entries that are
+# expensive to recompute and small stay longer, and entries that are no
+# longer hit eventually age out
+#
+# the entries are dropped whenever the index version changes
+
+from array import array
+from lib.versionedcache import VersionedCache
+
+_ENTRY_OVERHEAD = 192 # estimated bytes per entry (excluding the docids and terms)
+
+
+class _Entry:
+    __slots__ = ('docids', 'cost', 'priority', 'nbytes')
+
+    def __init__(self, docids, cost, nbytes):
+        self.docids = docids
+        self.cost = cost
+        self.nbytes = nbytes
+        self.priority = 0.0
+
+
+class IntersectionCache(VersionedCache):
+    """Thread-safe cache of the docids that contain both terms of a pair,
+    bounded by `max_bytes`.
+    """
+    def _priority(self, entry):
+        return entry.cost / entry.nbytes
+
+    def get(self, keys, index_version):
+        """Returns the smallest cached intersection of the pairs `keys`
+        as a (key, docids) tuple, or None if none of the pairs is cached.
+        A lookup counts as a single hit or miss.
+        """
+        with self._lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            best_key = None
+            best = None
+            for key in keys:
+                entry = self._entries.get(key, None)
+                if entry is not None and (best is None or len(entry.docids) < len(best.docids)):
+                    best_key, best = key, entry
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch(best_key, best)
+            return best_key, best.docids
+
+    def put(self, key, docids, cost, index_version):
+        """Caches the sorted docids of the pair `key` (a sorted tuple of
+        two terms), where `cost` is the number of postings intersected.
+        """
+        docids = array('Q', docids)
+        nbytes = (_ENTRY_OVERHEAD + sum(len(term) + 16 for term in key)
+            + docids.itemsize * len(docids))
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            self._pop(key)
+            self._insert(key, _Entry(docids, max(cost, 1), nbytes))
@@ -5,13 +5,14 @@
 import numpy as np
 from lib.reader import get_linked_docids
 
-def page_rank(docs, damping=0.85, max_iter=25, tol=1e-6):
+def page_rank(docs, damping=0.85, max_iter=25, tol=1e-6, links=get_linked_docids):
     """Calculate PageRank scores for documents.
 
     :param docs: List of Document objects
     :param damping: Damping factor (default 0.85)
     :param max_iter: Maximum number of iterations (default 100)
     :param tol: Convergence tolerance (default 1e-6)
+    :param links: Function of a docid to the docids it links to (default: those of the index)
     :return: Dictionary of docid to PageRank score
     """
 
@@ -26,7 +27,7 @@ def page_rank(docs, damping=0.85, max_iter=25, tol=1e-6):
     link_structure = {doc.docid: set() for doc in docs}
     for doc in docs:
         print("Docid: ", doc.docid)
-        linked_docids = get_linked_docids(doc.docid)  # Fetch linked doc IDs
+        linked_docids = links(doc.docid)  # Fetch linked doc IDs
         for linked_docid in linked_docids:
             if linked_docid in link_structure:
                 link_structure[linked_docid].add(doc.docid)
@@ -37,7 +38,7 @@ def page_rank(docs, damping=0.85, max_iter=25, tol=1e-6):
         # Calculate each document's new rank
         for docid, linked_by in link_structure.items():
             # Sum the PageRank of each linking document divided by the number of links it has
-            rank_sum = sum(page_ranks[linking_docid] / len(get_linked_docids(linking_docid)) for linking_docid in linked_by)
+            rank_sum = sum(page_ranks[linking_docid] / len(links(linking_docid)) for linking_docid in linked_by)
             
             # Calculate the new rank using the damping factor
             new_ranks[docid] = (1 - damping) + (damping * rank_sum)
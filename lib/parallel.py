@@ -0,0 +1,61 @@
+# lib/parallel.py
+#
+# intra-query parallelism
+#
+# broad queries are split into ranges of docids that are matched and scored
+# by a pool of worker processes (threads would be serialized by the GIL),
+# and the partial results are merged by the calling process
+#
+# the workers are forked once the reader is initialized, so they start with
+# its in-memory seek entries, docinfo and memory-mapped bucket files;
+# each worker keeps its own postings cache
+#
+# the ranges are aligned to the rank blocks of bitmap postings lists
+# (see lib/bitmap.py), so a worker only decodes the blocks in its range
+
+import multiprocessing
+from lib.bitmap import BLOCK_DOCIDS
+from lib.params import parallel_postings_per_worker
+
+_POOL = None
+_NUM_WORKERS = 0
+
+
+def enable_parallel(num_workers):
+    """Starts a pool of `num_workers` worker processes that evaluate
+    broad queries in parallel.
+
+    This forks the current process, so it must be called after the reader
+    is initialized and before any other thread is started.
+    """
+    global _POOL
+    global _NUM_WORKERS
+    _POOL = multiprocessing.get_context('fork').Pool(num_workers)
+    _NUM_WORKERS = num_workers
+
+
+def choose_workers(cost):
+    """Returns the number of workers that evaluate a query which reads
+    about `cost` postings (1 if it should be evaluated serially).
+    """
+    if _POOL is None:
+        return 1
+    return max(1, min(_NUM_WORKERS, cost // parallel_postings_per_worker))
+
+
+def docid_ranges(num_docs, num_ranges):
+    """Splits the docids from 1 to `num_docs` into at most `num_ranges`
+    ranges (lo, hi) of lo <= docid < hi of about the same size,
+    whose bounds are multiples of BLOCK_DOCIDS.
+    """
+    blocks = num_docs // BLOCK_DOCIDS + 1
+    num_ranges = min(num_ranges, blocks)
+    bounds = [BLOCK_DOCIDS * (blocks * i // num_ranges) for i in range(num_ranges + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def map_ranges(func, args, ranges):
+    """Returns the list of `func(*args, lo, hi)` for each range,
+    evaluated by the workers. `func` must be a module-level function.
+    """
+    return _POOL.starmap(func, [(*args, lo, hi) for lo, hi in ranges])
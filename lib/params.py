@@ -38,6 +38,11 @@ cosine_factor = 1 - tfidf_factor
 _assert_sum_is_one(tfidf_factor, cosine_factor,
     assertmsg="relevance factors must sum to 1")
 
+# documents whose cosine similarity is below this fraction of
+# the most similar document's are considered too dissimilar
+# and get no relevance score
+cosine_cutoff = 0.4
+
 
 # quality factor parameters
 # pagerank, hits (hub/auth)
@@ -49,3 +54,29 @@ _assert_sum_is_one(pr_factor, hub_factor, auth_factor,
     assertmsg="quality factors must sum to 1")
 
 
+# disjunctive (OR) query parameters
+# candidates are retrieved by their tfidf sums using WAND
+# and then reranked by net score; this is the number of
+# candidates retrieved per requested result
+rerank_factor = 3
+
+
+# result cache parameters
+# the number of results per query cached by the cache warm-up
+# (results are cached for the number of results requested,
+# so this is the number requested by default, see search.py)
+result_cache_depth = 10
+
+
+# intra-query parallelism parameters
+# broad queries are split into docid ranges that are evaluated by
+# worker processes (if enabled); this is the number of postings
+# per worker below which fewer workers are used
+parallel_postings_per_worker = 100000
+
+
+# latency budget parameters
+# with a deadline (see lib/deadline.py), a broad query that scores every
+# document is scored one docid range at a time, checking the deadline
+# between ranges; this is the number of postings per range
+deadline_range_postings = 50000
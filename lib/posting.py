@@ -5,6 +5,8 @@
 from functools import total_ordering
 from lib.structs import *
 
+SPOSTING_SIZE = 16 # size of struct posting
+
 @total_ordering
 class Posting:
     def __init__(
@@ -12,11 +14,13 @@ class Posting:
         docid=None,
         tf=None,
         important=0,
+        impact=0,
     ):
         self.docid = docid
         self.tf = tf
         self.fields = dict()
         self.fields['important'] = important
+        self.fields['impact'] = impact # quantized tfidf (impact-scored indexes only)
 
     def __lt__(self, other):
         return self.docid < other.docid
@@ -25,39 +29,45 @@ class Posting:
         return self.docid == other.docid
 
 
-def sposting_rd(fh):
-    """read struct posting
+def posting_from_bits(docid, tf, bits):
+    """Returns the posting with its fields read from the fields bits.
     """
-    docid, _ = u64_rd(fh)
-    tf, _ = u32_rd(fh)
-    bits, _ = u32_rd(fh)
-
-    # read fields from bits
-    important = bits & 0x0F
-
     return Posting(
         docid=docid,
         tf=tf,
-        important=important,
-    ), 16
+        important=bits & 0x0F,
+        impact=(bits >> 8) & 0xFF,
+    )
 
 
-def sposting_repr(obj):
-    """byte repr of struct posting
+def posting_bits(obj):
+    """Returns the fields of the posting as fields bits.
     """
-    docid = obj.docid
-    tf = obj.tf
     fields = obj.fields
-    bits = (
+    return (
         fields['important'] << 0    # 4 bits
+        | fields['impact'] << 8     # 8 bits
         | 1 << 31
     )
 
+
+def sposting_rd(fh):
+    """read struct posting
+    """
+    docid, _ = u64_rd(fh)
+    tf, _ = u32_rd(fh)
+    bits, _ = u32_rd(fh)
+
+    return posting_from_bits(docid, tf, bits), 16
+
+
+def sposting_repr(obj):
+    """byte repr of struct posting
+    """
     seq = bytearray()
 
-    seq.extend(u64_repr(docid))
-    seq.extend(u32_repr(tf))
-    seq.extend(u32_repr(bits))
+    seq.extend(u64_repr(obj.docid))
+    seq.extend(u32_repr(obj.tf))
+    seq.extend(u32_repr(posting_bits(obj)))
 
     return bytes(seq)
-
@@ -0,0 +1,233 @@
+# lib/postingcache.py
+#
+# cache for decoded postings lists bounded by bytes
+#
+# eviction is segmented LRU (SLRU): new entries start in the probation
+# segment and are promoted to the protected segment when they are hit again,
+# so a scan of one-off entries only churns the probation segment
+#
+# admission is TinyLFU: the access frequencies of all keys (cached or not)
+# are estimated with a count-min sketch that is halved periodically, and
+# a new entry is only admitted if it is accessed more frequently than the
+# entries it would evict
+
+import sys
+import threading
+from collections import OrderedDict
+from lib.posting import Posting
+
+_PROTECTED_RATIO = 0.8  # share of the budget for the protected segment
+_SKETCH_DEPTH = 4       # number of rows in the count-min sketch
+_SKETCH_WIDTH = 1 << 16 # number of counters per row
+_SKETCH_MAX = 15        # counters saturate (like 4-bit counters)
+_SKETCH_SEEDS = (0x9e3779b1, 0x85ebca77, 0xc2b2ae3d, 0x27d4eb2f)
+
+
+def _posting_nbytes():
+    """Returns the number of bytes used by a decoded Posting
+    (including its slot in the postings list).
+    """
+    posting = Posting(docid=1 << 40, tf=1 << 20, important=0)
+    return (sys.getsizeof(posting)
+        + sys.getsizeof(posting.__dict__)
+        + sys.getsizeof(posting.fields)
+        + sys.getsizeof(posting.docid)
+        + sys.getsizeof(posting.tf)
+        + 8) # list slot
+
+POSTING_NBYTES = _posting_nbytes()
+
+
+def postings_nbytes(postings):
+    """Returns the (estimated) number of bytes used by the decoded postings list.
+    """
+    return sys.getsizeof(postings) + POSTING_NBYTES * len(postings)
+
+
+class _FrequencySketch:
+    """Count-min sketch estimating how often each key was accessed.
+    Every counter is halved after a sample of accesses so that
+    the estimates favor recent accesses.
+    """
+    def __init__(self):
+        self._rows = [bytearray(_SKETCH_WIDTH) for _ in range(_SKETCH_DEPTH)]
+        self._sample_size = 8 * _SKETCH_WIDTH
+        self._additions = 0
+
+    def _indices(self, key):
+        h = hash(key)
+        return [(h ^ seed) * seed % _SKETCH_WIDTH for seed in _SKETCH_SEEDS]
+
+    def increment(self, key):
+        for row, i in zip(self._rows, self._indices(key)):
+            if row[i] < _SKETCH_MAX:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self._rows, self._indices(key)))
+
+    def _reset(self):
+        for row in self._rows:
+            row[:] = bytes(count >> 1 for count in row)
+        self._additions //= 2
+
+
+class PostingCache:
+    """Thread-safe cache of postings lists bounded by `max_bytes`
+    with TinyLFU admission and SLRU eviction.
+    """
+    def __init__(self, max_bytes):
+        self._lock = threading.Lock()
+        self._sketch = _FrequencySketch()
+        self._probation = OrderedDict() # key -> (value, nbytes); LRU first
+        self._protected = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self.resize(max_bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def resize(self, max_bytes):
+        """Sets the budget of the cache (evicting entries if needed).
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._protected_max = int(max_bytes * _PROTECTED_RATIO)
+            self._demote()
+            while self._probation_bytes + self._protected_bytes > self.max_bytes:
+                self._evict_one()
+
+    def clear(self):
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+            self._probation_bytes = 0
+            self._protected_bytes = 0
+
+    def get(self, key):
+        """Returns the cached value of the key or None.
+        """
+        with self._lock:
+            self._sketch.increment(key)
+
+            item = self._protected.get(key, None)
+            if item is not None:
+                self._protected.move_to_end(key)
+                self.hits += 1
+                return item[0]
+
+            item = self._probation.pop(key, None)
+            if item is not None:
+                # promote to the protected segment
+                self._probation_bytes -= item[1]
+                self._protected[key] = item
+                self._protected_bytes += item[1]
+                self._demote()
+                self.hits += 1
+                return item[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value, nbytes):
+        """Caches the value of the key (which uses `nbytes`) if it is
+        accessed more frequently than the entries it would evict.
+        If the key is already cached, its value is replaced in place.
+        """
+        with self._lock:
+            if key in self._probation or key in self._protected:
+                self._replace(key, value, nbytes)
+                return
+            if nbytes > self.max_bytes:
+                self.rejections += 1
+                return
+
+            # admission: find the victims (probation first, then protected)
+            # and only admit if the key is more frequent than every victim
+            free = self.max_bytes - self._probation_bytes - self._protected_bytes
+            if free < nbytes:
+                frequency = self._sketch.frequency(key)
+                victims = []
+                for segment in (self._probation, self._protected):
+                    for victim_key, (_, victim_nbytes) in segment.items():
+                        if free >= nbytes:
+                            break
+                        if self._sketch.frequency(victim_key) >= frequency:
+                            self.rejections += 1
+                            return
+                        victims.append(victim_key)
+                        free += victim_nbytes
+                for victim_key in victims:
+                    self._remove(victim_key)
+                    self.evictions += 1
+
+            self._probation[key] = (value, nbytes)
+            self._probation_bytes += nbytes
+
+    def _replace(self, key, value, nbytes):
+        if key in self._probation:
+            self._probation_bytes += nbytes - self._probation[key][1]
+            self._probation[key] = (value, nbytes)
+        else:
+            self._protected_bytes += nbytes - self._protected[key][1]
+            self._protected[key] = (value, nbytes)
+            self._demote()
+        while self._probation_bytes + self._protected_bytes > self.max_bytes:
+            self._evict_one()
+
+    def _remove(self, key):
+        item = self._probation.pop(key, None)
+        if item is not None:
+            self._probation_bytes -= item[1]
+            return
+        item = self._protected.pop(key)
+        self._protected_bytes -= item[1]
+
+    def _evict_one(self):
+        segment = self._probation if self._probation else self._protected
+        key = next(iter(segment))
+        self._remove(key)
+        self.evictions += 1
+
+    def _demote(self):
+        """Moves the LRU entries of the protected segment to the
+        probation segment (as MRU) while the protected segment is too large.
+        """
+        while self._protected_bytes > self._protected_max:
+            key, item = self._protected.popitem(last=False)
+            self._protected_bytes -= item[1]
+            self._probation[key] = item
+            self._probation_bytes += item[1]
+
+    def hot_keys(self):
+        """Returns the cached keys from the hottest to the coldest:
+        the protected segment, then the probation segment (MRU first).
+        """
+        with self._lock:
+            return [*reversed(self._protected), *reversed(self._probation)]
+
+    def is_full(self):
+        with self._lock:
+            return self._probation_bytes + self._protected_bytes >= self.max_bytes
+
+    def stats(self):
+        """Returns the hit/miss/eviction and memory stats of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'entries': len(self._probation) + len(self._protected),
+                'bytes': self._probation_bytes + self._protected_bytes,
+                'max_bytes': self.max_bytes,
+            }
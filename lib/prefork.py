@@ -0,0 +1,146 @@
+# lib/prefork.py
+#
+# pre-fork server
+#
+# the index is loaded (and its bucket files memory mapped) once by the
+# parent process, which then binds the listening socket and forks worker
+# processes that accept connections from it; the parent only restarts
+# workers that die and stops them on exit
+#
+# each worker serves every connection it accepts in a thread of its own,
+# so a slow client or a long query does not hold up the other requests
+# of the worker (the queries themselves still share its GIL)
+#
+# the workers share the parent's memory copy-on-write: the objects of the
+# index (docinfo, seek entries, ...) are moved out of the reach of the
+# garbage collector before forking (see gc.freeze), so collections in the
+# workers do not write to (and copy) the pages that hold them, and the
+# memory-mapped buckets are shared through the page cache
+#
+# on SIGHUP, the parent reloads (if it can) and forwards the signal to the
+# workers, which reload on their own; workers restarted afterwards are
+# forked from the reloaded parent
+
+import gc
+import os
+import sys
+import time
+import signal
+import socket
+from werkzeug.serving import make_server
+
+# max number of pending connections of the listening socket
+LISTEN_BACKLOG = 1024
+
+# min time (in seconds) between restarts of the same worker
+RESTART_DELAY = 1.0
+
+
+def _serve_worker(app, host, port, sock, num, worker_started, worker_stopped):
+    """Serves requests from the listening socket until the worker is stopped.
+    Never returns (the worker exits instead).
+    """
+    status = 0
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGHUP, signal.SIG_IGN) # unless handled by worker_started
+    try:
+        if worker_started is not None:
+            worker_started(num)
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    except Exception as e:
+        print(f"Worker {num} failed: {e!r}", file=sys.stderr)
+        status = 1
+    finally:
+        try:
+            if worker_stopped is not None:
+                worker_stopped(num)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+
+def serve_prefork(app, host, port, num_processes, worker_started=None, worker_stopped=None, reload=None):
+    """Serves the WSGI app on host:port with `num_processes` forked worker
+    processes (each handling a request per thread) until interrupted.
+
+    `worker_started(num)` and `worker_stopped(num)` are called by the worker
+    `num` (0 to num_processes - 1) when it starts and stops, i.e. to start
+    the threads it needs (threads are not inherited by forked processes)
+    or to save its caches.
+
+    `reload()` is called by the parent on SIGHUP, before the signal is
+    forwarded to the workers (which must handle it, see worker_started).
+
+    This forks the current process, so it must be called after the reader
+    is initialized and before any other thread is started.
+    """
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    # the workers race to accept each connection; the losers must not block
+    sock.setblocking(False)
+
+    # share the objects loaded so far copy-on-write
+    gc.collect()
+    gc.freeze()
+
+    workers = {} # pid -> (num, start time)
+
+    def _spawn(num):
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(app, host, port, sock, num, worker_started, worker_stopped)
+        workers[pid] = (num, time.monotonic())
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+
+    def _reload(signum, frame):
+        if reload is not None:
+            try:
+                reload()
+            except Exception as e:
+                print(f"Failed to reload: {e!r}", file=sys.stderr)
+            gc.collect()
+            gc.freeze()
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGHUP, _reload)
+    print(f"Serving on http://{host}:{port}/ with {num_processes} worker processes")
+    try:
+        for num in range(num_processes):
+            _spawn(num)
+
+        while workers:
+            pid, status = os.wait()
+            if pid not in workers:
+                continue
+            num, started = workers.pop(pid)
+            print(f"Worker {num} exited with status {os.waitstatus_to_exitcode(status)}, restarting",
+                file=sys.stderr)
+            time.sleep(max(0.0, started + RESTART_DELAY - time.monotonic()))
+            _spawn(num)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sock.close()
+        gc.unfreeze()
@@ -0,0 +1,50 @@
+# lib/querylog.py
+#
+# log of the queries served (used to warm up the caches, see lib/warmup.py)
+#
+# each line holds the match mode ("all" or "any") and the query,
+# separated by a tab; whitespace in the query is collapsed to single spaces
+
+import os
+import threading
+from collections import deque
+
+# number of most recent queries read from the log
+QUERY_LOG_WINDOW = 100000
+
+
+class QueryLog:
+    """Thread-safe appender of queries to the query log file.
+    """
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._fh = open(filename, 'a', encoding='utf-8')
+
+    def record(self, query, disjunctive=False):
+        query = " ".join(query.split())
+        if not query:
+            return
+        with self._lock:
+            self._fh.write(f"{'any' if disjunctive else 'all'}\t{query}\n")
+            self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+def read_query_log(filename, max_entries=QUERY_LOG_WINDOW):
+    """Returns the most recent (query, disjunctive) entries of the query log
+    (oldest first) or an empty list if there is no log.
+    """
+    if not os.path.exists(filename):
+        return []
+
+    entries = deque(maxlen=max_entries)
+    with open(filename, 'r', encoding='utf-8', errors='replace') as fh:
+        for line in fh:
+            mode, sep, query = line.rstrip('\n').partition('\t')
+            if not sep or mode not in ('all', 'any') or not query:
+                continue # malformed (i.e. truncated) line
+            entries.append((query, mode == 'any'))
+    return list(entries)
@@ -0,0 +1,172 @@
+# lib/queryparse.py
+#
+# parses boolean queries
+#
+# grammar (operators are uppercase; AND is implied between operands):
+#
+#   query   := or_expr
+#   or_expr := and_expr ("OR" and_expr)*
+#   and_expr := not_expr (["AND"] not_expr)*
+#   not_expr := "NOT" not_expr | atom
+#   atom    := "(" or_expr ")" | '"' phrase '"' | word
+#
+# the parser is lenient since queries are typed by users: a missing ")"
+# or '"' is implied at the end, a stray ")" and dangling operators are
+# ignored, and words without any token (i.e. punctuation) are dropped
+#
+# words and phrases are tokenized and stemmed like documents; a word that
+# yields several tokens (i.e. "don't") is the AND of its tokens
+
+import re
+from lib.tokenize import tokenize, stem_tokens
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+_LEXEME = re.compile(r'\(|\)|"[^"]*"?|[^\s()"]+')
+
+
+class Term:
+    """A single (stemmed) token. Quoted terms are never pruned as stopwords.
+    """
+    def __init__(self, token, quoted=False):
+        self.token = token
+        self.quoted = quoted
+
+    def __repr__(self):
+        return f'"{self.token}"' if self.quoted else self.token
+
+
+class Phrase:
+    """Quoted (stemmed) tokens, which match the documents that contain
+    every token (the index has no term positions). Adjacent tokens must
+    also occur next to each other if their biword is indexed
+    (see makeindex.py --biwords), which only frequent pairs are.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __repr__(self):
+        return '"' + ' '.join(self.tokens) + '"'
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return 'AND(' + ' '.join(sorted(map(repr, self.children))) + ')'
+
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return 'OR(' + ' '.join(sorted(map(repr, self.children))) + ')'
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f'NOT({self.child!r})'
+
+
+def is_boolean_query(query):
+    """Returns True if the query uses any boolean operator,
+    parentheses or quotes (otherwise it is a bag of words).
+    """
+    return any(
+        lexeme in OPERATORS or lexeme[0] in '()"'
+        for lexeme in _LEXEME.findall(query)
+    )
+
+
+def _stem(text):
+    tokens, _ = tokenize(text)
+    stem_tokens(tokens)
+    return [token for token in tokens if token]
+
+
+def _combine(cls, children):
+    """Returns the node of the operator over the children (flattened),
+    the only child or None if there are no children.
+    """
+    flat = []
+    for child in children:
+        if child is None:
+            continue
+        if isinstance(child, cls):
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+    if not flat:
+        return None
+    if len(flat) == 1:
+        return flat[0]
+    return cls(flat)
+
+
+def parse_query(query):
+    """Returns the parse tree of the boolean query (see the grammar above)
+    made of Term, Phrase, And, Or and Not nodes, or None if the query
+    has no terms.
+    """
+    lexemes = _LEXEME.findall(query)
+    pos = 0
+
+    def peek():
+        return lexemes[pos] if pos < len(lexemes) else None
+
+    def parse_or():
+        nonlocal pos
+        children = [parse_and()]
+        while peek() == 'OR':
+            pos += 1
+            children.append(parse_and())
+        return _combine(Or, children)
+
+    def parse_and():
+        nonlocal pos
+        children = []
+        while peek() not in (None, ')', 'OR'):
+            if peek() == 'AND':
+                pos += 1
+                continue
+            children.append(parse_not())
+        return _combine(And, children)
+
+    def parse_not():
+        nonlocal pos
+        if peek() == 'NOT':
+            pos += 1
+            if peek() in (None, ')', 'OR'):
+                return None # dangling operator
+            child = parse_not()
+            return Not(child) if child is not None else None
+        return parse_atom()
+
+    def parse_atom():
+        nonlocal pos
+        lexeme = lexemes[pos]
+        pos += 1
+        if lexeme == '(':
+            node = parse_or()
+            if peek() == ')':
+                pos += 1
+            return node
+        if lexeme[0] == '"':
+            tokens = _stem(lexeme.strip('"'))
+            if len(tokens) > 1:
+                return Phrase(tokens)
+            return Term(tokens[0], quoted=True) if tokens else None
+        return _combine(And, [Term(token) for token in _stem(lexeme)])
+
+    # stray ")" end an expression early, so the rest is AND-ed to it
+    nodes = []
+    while pos < len(lexemes):
+        nodes.append(parse_or())
+        if peek() == ')':
+            pos += 1
+    return _combine(And, nodes)
@@ -0,0 +1,215 @@
+# lib/queryplan.py
+#
+# plans and evaluates boolean queries (see lib/queryparse.py)
+#
+# the plan is a tree of cursors over sorted docids that are advanced
+# document-at-a-time with seek(target), which moves a cursor to its first
+# docid >= target:
+# - the operands of AND are ordered by ascending document frequency, so the
+#   rarest operand leads and the others are only sought to its candidates
+#   (the work is driven by the rarest required term)
+# - NOT operands are pushed to the end of their AND and only exclude the
+#   candidates that every other operand matched
+# - OR merges its operands
+#
+# a term cursor seeks by galloping (exponential then binary search) if its
+# postings list is much longer than the lead of its AND, and by a linear
+# merge otherwise (where galloping would only skip a few postings)
+#
+# NOT only excludes documents from its AND, so a NOT without any other
+# operand matches nothing (i.e. "NOT a") and a NOT operand of OR is
+# ignored (i.e. "a OR NOT b" is "a")
+
+from bisect import bisect_left
+from operator import attrgetter
+from lib.reader import get_postings, get_term_stats, has_biwords
+from lib.stopwords import is_stopword
+from lib.tokenize import biword, is_biword
+from lib.queryparse import Term, Phrase, And, Or, Not
+from lib.deadline import CHECK_STEPS, deadline_expired
+
+END = float('inf') # docid of an exhausted cursor
+
+# a term cursor gallops if its postings list is longer
+# than this many times the lead postings list of its AND
+GALLOP_RATIO = 8
+
+_docid_key = attrgetter('docid')
+
+
+class _TermCursor:
+    def __init__(self, token, doc_freq):
+        self.token = token
+        self.estimate = doc_freq
+        self.gallop = False
+        self.postings = None
+        self.pos = 0
+
+    def open(self):
+        self.postings = get_postings(self.token)
+        self.pos = 0
+
+    def seek(self, target):
+        postings = self.postings
+        pos = self.pos
+        if pos < len(postings) and postings[pos].docid < target:
+            if self.gallop:
+                # exponential search for the range, then binary search
+                step = 1
+                hi = pos + 1
+                while hi < len(postings) and postings[hi].docid < target:
+                    pos = hi
+                    step *= 2
+                    hi = pos + step
+                pos = bisect_left(postings, target, pos, min(hi, len(postings)), key=_docid_key)
+            else:
+                while pos < len(postings) and postings[pos].docid < target:
+                    pos += 1
+            self.pos = pos
+        return postings[pos].docid if pos < len(postings) else END
+
+    def __repr__(self):
+        return f"{self.token}[{self.estimate}{', gallop' if self.gallop else ''}]"
+
+
+class _AndCursor:
+    def __init__(self, positives, negatives):
+        self.positives = sorted(positives, key=lambda cursor: cursor.estimate)
+        self.negatives = negatives
+        self.estimate = self.positives[0].estimate
+
+        lead = self.estimate
+        for cursor in self.positives[1:] + self.negatives:
+            if isinstance(cursor, _TermCursor):
+                cursor.gallop = cursor.estimate > GALLOP_RATIO * lead
+
+    def open(self):
+        for cursor in self.positives + self.negatives:
+            cursor.open()
+
+    def seek(self, target):
+        lead = self.positives[0]
+        docid = lead.seek(target)
+        while docid != END:
+            for cursor in self.positives[1:]:
+                other = cursor.seek(docid)
+                if other != docid:
+                    docid = lead.seek(other) if other != END else END
+                    break
+            else:
+                if not any(cursor.seek(docid) == docid for cursor in self.negatives):
+                    return docid
+                docid = lead.seek(docid + 1)
+        return END
+
+    def __repr__(self):
+        operands = list(map(repr, self.positives)) + [f'NOT {cursor!r}' for cursor in self.negatives]
+        return 'AND(' + ', '.join(operands) + ')'
+
+
+class _OrCursor:
+    def __init__(self, children):
+        self.children = children
+        self.estimate = sum(cursor.estimate for cursor in children)
+
+    def open(self):
+        for cursor in self.children:
+            cursor.open()
+
+    def seek(self, target):
+        return min(cursor.seek(target) for cursor in self.children)
+
+    def __repr__(self):
+        return 'OR(' + ', '.join(map(repr, self.children)) + ')'
+
+
+def plan_query(node):
+    """Returns the plan (root cursor) of the parse tree, along with the query
+    vector (mapping of token to its frequency) of the terms that are not
+    negated, which the matched documents are scored with.
+    Returns (None, {}) if the query can match no document.
+    """
+    def plan(node):
+        if isinstance(node, Term):
+            doc_freq, _, _ = get_term_stats(node.token)
+            if not doc_freq:
+                return None
+            return _TermCursor(node.token, doc_freq)
+
+        if isinstance(node, Phrase):
+            # the terms and (if they are indexed) their biwords,
+            # which only match documents where the terms are adjacent
+            children = [Term(token, quoted=True) for token in node.tokens]
+            if has_biwords():
+                children.extend(
+                    Term(biword(first, second), quoted=True)
+                    for first, second in zip(node.tokens, node.tokens[1:])
+                    if get_term_stats(biword(first, second))[0]
+                )
+            return plan(And(children))
+
+        if isinstance(node, Or):
+            children = [plan(child) for child in node.children if not isinstance(child, Not)]
+            children = [cursor for cursor in children if cursor is not None]
+            if not children:
+                return None
+            return children[0] if len(children) == 1 else _OrCursor(children)
+
+        if isinstance(node, And):
+            positives = [child for child in node.children if not isinstance(child, Not)]
+            negatives = [child.child for child in node.children if isinstance(child, Not)]
+
+            # unquoted stopwords are pruned if other terms are required
+            if any(not _is_stopword_term(child) for child in positives):
+                positives = [child for child in positives if not _is_stopword_term(child)]
+
+            positives = [plan(child) for child in positives]
+            if not positives or any(cursor is None for cursor in positives):
+                return None # a required operand matches nothing
+
+            negatives = [plan(child) for child in negatives]
+            negatives = [cursor for cursor in negatives if cursor is not None]
+
+            if len(positives) == 1 and not negatives:
+                return positives[0]
+            return _AndCursor(positives, negatives)
+
+        return None # NOT without other operands
+
+    root = plan(node)
+    if root is None:
+        return None, {}
+
+    # biwords are not scored (like the terms of the bag-of-words queries)
+    frequencies = {}
+    stack = [root]
+    while stack:
+        cursor = stack.pop()
+        if isinstance(cursor, _TermCursor):
+            if not is_biword(cursor.token):
+                frequencies[cursor.token] = frequencies.get(cursor.token, 0) + 1
+        elif isinstance(cursor, _AndCursor):
+            stack.extend(cursor.positives)
+        else:
+            stack.extend(cursor.children)
+    return root, frequencies
+
+
+def _is_stopword_term(node):
+    return isinstance(node, Term) and not node.quoted and is_stopword(node.token)
+
+
+def match_plan(root):
+    """Returns the sorted docids of the documents that match the plan.
+    If the deadline of the query passes (see lib/deadline.py),
+    only the documents matched so far are returned.
+    """
+    root.open()
+    docids = []
+    docid = root.seek(0)
+    while docid != END:
+        docids.append(docid)
+        if not len(docids) % CHECK_STEPS and deadline_expired():
+            break # out of time
+        docid = root.seek(docid + 1)
+    return docids
@@ -3,26 +3,68 @@
 # processes queries
 
 import math
+import time
 import numpy as np
 import heapq
-from collections import defaultdict
+import threading
+from bisect import bisect_left
+from operator import attrgetter
+from collections import defaultdict, OrderedDict
 from lib.reader import *
 from lib.tokenize import *
 from lib.stopwords import is_stopword
 from lib.word_count import *
 from lib.params import *
 from lib.structs import *
+from lib.bitmap import and_bits, test_bit, iter_bits
+from lib.wand import wand_topk, conjunctive_topk
+from lib.resultcache import ResultCache
+from lib.intersectioncache import IntersectionCache
+from lib.querylog import QueryLog
+from lib.queryparse import parse_query, is_boolean_query
+from lib.queryplan import plan_query, match_plan
+from lib.parallel import choose_workers, docid_ranges, map_ranges
+from lib.deadline import current_deadline, deadline_expired, mark_partial
 
-def postings_set(tokenset):
+_RESULT_CACHE = None
+_INTERSECTION_CACHE = None
+_QUERY_LOG = None
+
+# score components of the last queries scored for a coordinator
+# (see shard_components), so ranking them does not score them again
+SHARD_COMPONENTS_ENTRIES = 64
+_SHARD_COMPONENTS = OrderedDict()
+_SHARD_COMPONENTS_LOCK = threading.Lock()
+
+_docid_key = attrgetter('docid')
+
+def postings_set(tokenset, tiered=False):
     """Returns postings set indexed both by
     doc id (document-at-a-time) or token (term-at-a-time)
+    If tiered, only the high tier (champion list) of each token is used.
+
+    Otherwise, if the intersection cache is enabled, the documents are
+    matched starting from a cached intersection of a pair of the tokens
+    (see pair_candidates). If any token is dense, the bitmaps of the dense
+    tokens are intersected with a bitwise AND (see postings_bitmaps).
     """
+    if not tiered:
+        bitmaps = {token: get_bitmap_postings(token) for token in tokenset}
+        if _INTERSECTION_CACHE is not None and len(bitmaps) > 1:
+            candidates, found = pair_candidates(tokenset, bitmaps)
+            return _lookup_postings(tokenset, candidates, bitmaps, found)
+        if any(bitmap is not None for bitmap in bitmaps.values()):
+            return postings_bitmaps(tokenset, bitmaps)
+
     docid_postings = defaultdict(dict)
     token_postings = defaultdict(list)
 
     docid_sets = []
     for token in tokenset:
-        postings = get_postings(token)
+        if tiered:
+            postings, _ = get_champion_postings(token)
+        else:
+            postings = get_postings(token)
         docid_set = set() # set of documents that have the term
         for posting in postings:
             docid_set.add(posting.docid)
@@ -42,19 +84,223 @@ def postings_set(tokenset):
     return docid_postings, token_postings
 
 
-def compute_scores(docid_postings, token_postings, query_vec):
-    """Computes the net score for each document
+def postings_biwords(tokenset, biwords):
+    """Returns postings indexed both by doc id and token (like postings_set)
+    for the documents that contain every biword and every token.
+    The candidates are the intersection of the (short) biword postings lists;
+    the postings of each token are then looked up by docid.
     """
-    doc_tfidfs = defaultdict(lambda: defaultdict(float))
-    doc_cosine = defaultdict(float)
-    net_relevance = defaultdict(float)
+    # intersect the biwords, starting from the shortest list
+    biword_postings = sorted((get_postings(token) for token in biwords), key=len)
+    candidates = [posting.docid for posting in biword_postings[0]]
+    for postings in biword_postings[1:]:
+        docids = set(posting.docid for posting in postings)
+        candidates = [docid for docid in candidates if docid in docids]
+
+    return _lookup_postings(tokenset, candidates, {
+        token: get_bitmap_postings(token) for token in tokenset
+    })
+
+
+def pair_candidates(tokenset, bitmaps):
+    """Returns the sorted docids of the documents that contain a pair of the
+    tokens (at least two), which seed the matching of a conjunctive query,
+    along with the postings of those documents already found (a mapping of
+    token to its posting of each docid, in order; see _lookup_postings).
+
+    The smallest cached intersection of any pair of the tokens is used
+    (no postings are found then). Otherwise, the two rarest tokens are
+    intersected and cached, where `bitmaps` maps each token to its bitmap
+    postings list or None (see reader.get_bitmap_postings).
+    """
+    tokens = sorted(tokenset)
+    keys = [(first, second) for i, first in enumerate(tokens) for second in tokens[i + 1:]]
+    version = get_index_version() # before intersecting (see _evaluate_cached)
+    cached = _INTERSECTION_CACHE.get(keys, version)
+    if cached is not None:
+        return cached[1], {}
+
+    first, second = sorted(tokens, key=lambda token: get_term_stats(token)[0])[:2]
+    if bitmaps[first] is not None and bitmaps[second] is not None:
+        docids = list(iter_bits(and_bits(bitmaps[first].bits, bitmaps[second].bits)))
+        found = {} # found in the bitmaps without a search
+    elif bitmaps[second] is not None:
+        bits = bitmaps[second].bits
+        postings = [posting for posting in get_postings(first) if test_bit(bits, posting.docid)]
+        docids = [posting.docid for posting in postings]
+        found = {first: postings}
+    else:
+        other = {posting.docid: posting for posting in get_postings(second)}
+        postings = [posting for posting in get_postings(first) if posting.docid in other]
+        docids = [posting.docid for posting in postings]
+        found = {first: postings, second: [other[docid] for docid in docids]}
+
+    # the cost of an entry is the number of postings intersected
+    cost = get_term_stats(first)[0] + get_term_stats(second)[0]
+    _INTERSECTION_CACHE.put(tuple(sorted((first, second))), docids, cost, version)
+    return docids, found
+
+
+def postings_bitmaps(tokenset, bitmaps):
+    """Returns postings indexed both by doc id and token (like postings_set)
+    for the documents that contain every token, where `bitmaps` maps each
+    token to its bitmap postings list (see reader.get_bitmap_postings)
+    or None if the token is not dense.
+    The bitmaps are intersected with a bitwise AND; the candidates are then
+    the docids of the shortest other postings list whose bit is set.
+    """
+    bits = and_bits(*(bitmap.bits for bitmap in bitmaps.values() if bitmap is not None))
+    sparse = [token for token, bitmap in bitmaps.items() if bitmap is None]
+    if sparse:
+        shortest = min(sparse, key=lambda token: get_term_stats(token)[0])
+        candidates = [
+            posting.docid for posting in get_postings(shortest) if test_bit(bits, posting.docid)
+        ]
+    else:
+        candidates = list(iter_bits(bits))
+
+    return _lookup_postings(tokenset, candidates, bitmaps)
+
+
+def _lookup_postings(tokenset, candidates, bitmaps, found=None):
+    """Returns postings indexed both by doc id and token (like postings_set)
+    for the candidates (sorted docids) that contain every token.
+    The posting of a dense token is found in its bitmap (see `bitmaps`),
+    otherwise it is searched for in the token's postings list, unless
+    `found` maps the token to its posting of each candidate (in order).
+    """
+    docid_postings = defaultdict(dict)
+    token_postings = defaultdict(list)
+
+    for token, postings in (found or {}).items():
+        for docid, posting in zip(candidates, postings):
+            docid_postings[docid][token] = posting
+
+    for token in tokenset:
+        if found and token in found:
+            continue
+        bitmap = bitmaps.get(token, None)
+        postings = get_postings(token) if bitmap is None else None
+        matched = []
+        for docid in candidates:
+            if bitmap is not None:
+                posting = bitmap.posting(docid)
+            else:
+                i = bisect_left(postings, docid, key=_docid_key)
+                posting = postings[i] if i < len(postings) and postings[i].docid == docid else None
+            if posting is not None:
+                docid_postings[docid][token] = posting
+                matched.append(docid)
+        candidates = matched
+
+    for docid in list(docid_postings.keys()):
+        if len(docid_postings[docid]) < len(tokenset):
+            del docid_postings[docid]
+
+    for token in tokenset:
+        for vec in docid_postings.values():
+            token_postings[token].append(vec[token])
+
+    return docid_postings, token_postings
+
+
+def score_range(frequencies, version, deadline_at, lo, hi):
+    """Returns the score components (see score_components) of the documents
+    with lo <= docid < hi that contain every token of the query vector.
+    Only the postings in the range are read (see reader.get_postings_range).
+    This is the task of a worker for parallel evaluation (see lib/parallel.py).
+
+    Returns None if the worker cannot read the index of the version
+    (see reader.use_index_version) and False if the deadline of the query
+    (a time.monotonic() value or None) has passed before the range is scored.
+    """
+    if deadline_at is not None and time.monotonic() >= deadline_at:
+        return False
+    if not use_index_version(version):
+        return None
+
+    docid_postings = defaultdict(dict)
+    token_postings = defaultdict(list)
+
+    # the rarest token's postings are the candidates
+    tokens = sorted(frequencies, key=lambda token: get_term_stats(token)[0])
+    for i, token in enumerate(tokens):
+        for posting in get_postings_range(token, lo, hi):
+            if i == 0 or posting.docid in docid_postings:
+                docid_postings[posting.docid][token] = posting
+
+    for docid in list(docid_postings.keys()):
+        if len(docid_postings[docid]) < len(tokens):
+            del docid_postings[docid]
+
+    for token in tokens:
+        for vec in docid_postings.values():
+            token_postings[token].append(vec[token])
+
+    return score_components(docid_postings, token_postings, frequencies)
+
+
+def postings_topk(tokenset, k, disjunctive):
+    """Returns postings indexed both by doc id and token (like postings_set)
+    for the top k documents by tfidf sum (and static quality if the index is
+    quality ordered) that contain any (disjunctive) or every token, along with
+    the idf of each token and the number of matched documents.
+    The number is estimated if the intersection stopped early.
+    """
+    docid_postings = defaultdict(dict)
+    token_postings = defaultdict(list)
+
+    num_docs = get_num_nonempty_documents()
+    idfs = {}
+    for token in tokenset:
+        doc_freq, _, _ = get_term_stats(token)
+        idfs[token] = math.log((1 + num_docs) / (1 + doc_freq))
+
+    if disjunctive:
+        results, _ = wand_topk(idfs, k)
+        # estimated without reading any list, so it never runs past the deadline
+        num_matched = _estimate_union(tokenset)
+    else:
+        results, num_matched, stop_docid = conjunctive_topk(idfs, k)
+        if stop_docid is not None:
+            # extrapolate from the docids that were scanned
+            num_matched = round(num_matched * get_num_documents() / (stop_docid - 1))
+
+    for _, docid, matched in results:
+        for token, posting in matched.items():
+            docid_postings[docid][token] = posting
+            token_postings[token].append(posting)
+
+    return docid_postings, token_postings, idfs, num_matched
 
-    doc_pr_quality = defaultdict(float)
-    doc_hub_quality = defaultdict(float)
-    doc_auth_quality = defaultdict(float)
-    net_quality = defaultdict(float)
 
-    net_scores = defaultdict(float)
+def compute_scores(docid_postings, token_postings, query_vec, idfs=None):
+    """Computes the net score for each document.
+    If idfs is not specified, the idf of each token is computed
+    from its document frequency (see reader.get_term_stats).
+
+    The cosine similarity uses the norm of the document's full tfidf
+    vector, which is computed when the index is built (see merge_partial).
+
+    If the index stores impacts, the tfidf of a posting is its impact
+    (quantized tfidf) instead, so it is not recomputed.
+
+    The scores are normalized over the documents, so they are computed
+    from the components of each document (see score_components),
+    which are then combined (see combine_scores).
+    """
+    return combine_scores(score_components(docid_postings, token_postings, query_vec, idfs))
+
+
+def score_components(docid_postings, token_postings, query_vec, idfs=None):
+    """Returns the components of the net score of the documents that only
+    depend on the document itself: the docids, their tfidf sums, cosine
+    similarities and static qualities (pagerank, hub and authority),
+    as arrays in the order of `docid_postings`.
+    See compute_scores for the parameters.
+    """
+    doc_tfidfs = defaultdict(lambda: defaultdict(float))
+    doc_cosine = defaultdict(float)
 
 
     ### compute relevance ###
@@ -63,11 +309,19 @@ def compute_scores(docid_postings, token_postings, query_vec):
     # this also promotes TFIDF if the posting contains
     # important text - the multiplier varies by its tag
     num_docs = get_num_nonempty_documents()
+    impact_unit = get_impact_unit()
+    given_idfs = idfs
     idfs = defaultdict(float)
     for token, postings in token_postings.items():
-        df = 1 + len(postings)
-        idf = math.log((1 + num_docs) / df)
+        if given_idfs:
+            idf = given_idfs[token]
+        else:
+            doc_freq, _, _ = get_term_stats(token)
+            idf = math.log((1 + num_docs) / (1 + doc_freq))
         for posting in postings:
+            if impact_unit:
+                doc_tfidfs[posting.docid][token] = posting.fields['impact'] * impact_unit
+                continue
             document = get_document(posting.docid)
             tf = posting.tf / document.total_tokens
             tfidf = tf * idf
@@ -92,91 +346,137 @@ def compute_scores(docid_postings, token_postings, query_vec):
         for token, tfidf in query_tfidf.items():
             doc_cosine[docid] += (doc_tfidf[token] * tfidf)
 
-        doc_tfidf_norm = np.linalg.norm(
-            np.fromiter(doc_tfidfs[docid].values(), dtype=float)
-        )
-
-        doc_cosine[docid] /= doc_tfidf_norm * query_tfidf_norm
+        doc_tfidf_norm = get_document(docid).norm
+        if doc_tfidf_norm and query_tfidf_norm:
+            doc_cosine[docid] /= doc_tfidf_norm * query_tfidf_norm
+        else:
+            doc_cosine[docid] = 0.0
 
-    # compute norm of tfidf sums and cosine similarity
-    doc_tfidf_sums_norm = np.linalg.norm(
-        np.fromiter(doc_tfidf_sums.values(), dtype=float)
-    )
-    doc_cosine_norm = np.linalg.norm(
-        np.fromiter(doc_cosine.values(), dtype=float)
+    docids = list(docid_postings.keys())
+    documents = [get_document(docid) for docid in docids]
+    return (
+        np.array(docids, dtype=np.int64),
+        np.array([doc_tfidf_sums[docid] for docid in docids], dtype=float),
+        np.array([doc_cosine[docid] for docid in docids], dtype=float),
+        np.array([document.pr_quality for document in documents], dtype=float),
+        np.array([document.hub_quality for document in documents], dtype=float),
+        np.array([document.auth_quality for document in documents], dtype=float),
     )
 
+
+def concat_components(parts):
+    """Returns the components of the documents of every part
+    (see score_components) as a single set of components.
+    """
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def _normalized(values):
+    norm = np.linalg.norm(values)
+    return values / norm if norm else np.zeros_like(values)
+
+
+def combine_scores(components, norms=None):
+    """Returns the net score of each document from its components
+    (see score_components), where each component is normalized
+    over all of the documents.
+
+    If `norms` are given (see component_norms), the components are
+    normalized by them instead, that is over the documents of every shard.
+    """
+    docids, tfidf_sums, cosines, pr_quality, hub_quality, auth_quality = components
+    if norms is None:
+        normalized = _normalized
+        max_cosine = cosines.max(initial=0.0)
+    else:
+        sq_norms = iter(norms['sq_norms'])
+        def normalized(values):
+            norm = math.sqrt(next(sq_norms))
+            return values / norm if norm else np.zeros_like(values)
+        max_cosine = norms['max_cosine']
+
     # compute net relevance
     # note: if query and document is too dissimilar, we exclude the document relevancy
     # since the terms are most likely not that useful to the user
-    for docid in docid_postings.keys():
-        normalized_tfidf = (doc_tfidf_sums[docid] / doc_tfidf_sums_norm
-            if doc_tfidf_sums_norm else 0.0)
-        normalized_cosine = (doc_cosine[docid] / doc_cosine_norm
-            if doc_cosine_norm else 0.0)
-        net_relevance[docid] = (tfidf_factor * normalized_tfidf
-            + cosine_factor * normalized_cosine) if doc_cosine[docid] > 0.4 else 0.0
+    # (relative to the most similar document since long documents
+    # have small cosine similarities)
+    min_cosine = cosine_cutoff * max_cosine
+    net_relevance = np.where(
+        cosines > min_cosine,
+        tfidf_factor * normalized(tfidf_sums) + cosine_factor * normalized(cosines),
+        0.0
+    )
 
+    # compute net quality
+    net_quality = (pr_factor * normalized(pr_quality)
+        + hub_factor * normalized(hub_quality)
+        + auth_factor * normalized(auth_quality))
 
-    ### compute quality ###
+    # combines relevance and quality scores
+    net_scores = net_relevance_factor * net_relevance + quality_factor * net_quality
+    return dict(zip(docids.tolist(), net_scores.tolist()))
 
-    # retrieve qualities
-    for docid in docid_postings.keys():
-        document = get_document(docid)
-        doc_pr_quality[docid] = document.pr_quality
-        doc_hub_quality[docid] = document.hub_quality
-        doc_auth_quality[docid] = document.auth_quality
 
-    # compute norms of qualities
-    doc_pr_norm = np.linalg.norm(
-        np.fromiter(doc_pr_quality.values(), dtype=float)
-    )
-    doc_hub_norm = np.linalg.norm(
-        np.fromiter(doc_hub_quality.values(), dtype=float)
-    )
-    doc_auth_norm = np.linalg.norm(
-        np.fromiter(doc_auth_quality.values(), dtype=float)
-    )
+def component_norms(components):
+    """Returns the squared norms of the tfidf sums, cosine similarities and
+    static qualities (in the order of combine_scores) of the documents and
+    their largest cosine similarity. The norms of every shard add up to
+    the norms of the whole collection (see merge_norms).
+    """
+    _, tfidf_sums, cosines, pr_quality, hub_quality, auth_quality = components
+    return {
+        'sq_norms': [float(np.dot(values, values))
+            for values in (tfidf_sums, cosines, pr_quality, hub_quality, auth_quality)],
+        'max_cosine': float(cosines.max(initial=0.0)),
+    }
 
-    # compute net quality
-    for docid in docid_postings.keys():
-        normalized_pr = (doc_pr_quality[docid] / doc_pr_norm
-            if doc_pr_norm else 0.0)
-        normalized_hub = (doc_hub_quality[docid] / doc_hub_norm
-            if doc_hub_norm else 0.0)
-        normalized_auth = (doc_auth_quality[docid] / doc_auth_norm
-            if doc_auth_norm else 0.0)
-        net_quality[docid] = (pr_factor * normalized_pr
-            + hub_factor * normalized_hub
-            + auth_factor * normalized_auth)
 
+def merge_norms(shard_norms):
+    """Returns the norms (see component_norms) of the documents of every shard.
+    """
+    shard_norms = list(shard_norms)
+    return {
+        'sq_norms': [sum(sq_norms) for sq_norms in zip(*(norms['sq_norms'] for norms in shard_norms))],
+        'max_cosine': max((norms['max_cosine'] for norms in shard_norms), default=0.0),
+    }
 
-    ### compute net scores ###
 
-    # combines relevance and quality scores
-    for docid in docid_postings.keys():
-        document = get_document(docid)
-        net_scores[docid] = (net_relevance_factor * net_relevance[docid]
-            + quality_factor * net_quality[docid])
+def rank_scores(net_scores, k, offset=0):
+    """Returns the ranked (docid, score) pairs from `offset` to `offset + k`
+    using partial selection. If k is None, every document is ranked.
+    """
+    if k is None:
+        return sorted(
+            net_scores.items(),
+            key=lambda item: item[1],
+            reverse=True
+        )[offset:]
+
+    # partial selection: O(n log(offset + k)) instead of a full sort
+    return heapq.nlargest(
+        offset + k,
+        net_scores.items(),
+        key=lambda item: item[1]
+    )[offset:]
 
-    return net_scores
 
+def prepare_query(query, term_stats=None):
+    """Returns the query vector (mapping of token to its frequency)
+    after tokenizing and stemming the query and pruning its tokens.
+    Returns an empty mapping if nothing is left to search for.
 
-def process_query(query):
-    """Returns the ranked results from this query
+    The tokens are pruned by their statistics in the index, or by
+    `term_stats(token)` if it is given (i.e. the statistics of every shard;
+    see lib/coordinator.py), which returns them like reader.get_term_stats.
     """
-    # tokenize query and stem
-    import time
-    tt = time.time()
+    if term_stats is None:
+        term_stats = get_term_stats
 
+    # tokenize query and stem
     tokens, _ = tokenize(query)
     stem_tokens(tokens)
     frequencies = word_count(tokens)
 
-    et = time.time()
-
-    tt2 = time.time()
-
     # number of pruned tokens (non-unique)
     # number of total valid tokens (non-unique) in query
     # number of unique valid tokens in query
@@ -193,8 +493,7 @@ def process_query(query):
     stopwords = set()
     stopwords_heap = []
     for token in sorted(frequencies.keys()):
-        postings = get_postings(token)
-        doc_freq = len(postings)
+        doc_freq, _, _ = term_stats(token)
         if doc_freq == 0:
             if token.isalnum(): # alphanumeric counts towards prune
                 prune_count += frequencies[token]
@@ -217,65 +516,471 @@ def process_query(query):
     # (i.e. no docs contain these tokens), the query was
     # probably not good in the first place, so return an empty result
     if prune_count > valid_count * 2:
-        return []
+        return {}
 
     # if unique stopwords are insignificant, prune the stopwords
-    # otherwise, consider the first k unique stopwords that are least
+    # otherwise, consider the first m unique stopwords that are least
     # frequently represented in docs (but are represented)
-    # where k = log2(number of stopwords)
+    # where m = log2(number of stopwords)
     if len(stopwords) > 0 and not (len(stopwords) < num_valid_tokens * 0.4):
-        k = int(math.log2(len(stopwords)))
-        for _ in range(k):
+        m = int(math.log2(len(stopwords)))
+        for _ in range(m):
             _, freq, token = heapq.heappop(stopwords_heap)
             frequencies[token] = freq
 
     if not frequencies:
-        return [] # empty query after pruning
+        return {} # empty query after pruning
 
-    et2 = time.time()
+    return frequencies
 
-    tt3 = time.time()
 
-    docid_postings, token_postings = postings_set(frequencies.keys())
+def query_biwords(query, frequencies):
+    """Returns the indexed biwords of the query, that is the pairs of
+    adjacent query terms (that are left in the query vector) which are
+    frequent enough to be indexed. Returns an empty list if there are none.
+    """
+    if not has_biwords():
+        return []
 
-    et3 = time.time()
+    tokens, _ = tokenize(query)
+    stem_tokens(tokens)
 
-    print('tokenize', et-tt)
-    print('preprocessing', et2-tt2)
-    print('postings', et3-tt3)
+    biwords = []
+    for token in biwords_of(tokens):
+        first, _, second = token.partition(BIWORD_SEP)
+        if first not in frequencies or second not in frequencies or token in biwords:
+            continue
+        doc_freq, _, _ = get_term_stats(token)
+        if doc_freq:
+            biwords.append(token)
+    return biwords
 
-    if not docid_postings:
-        return [] # no documents matched
 
-    tt4 = time.time()
+def evaluate_query(frequencies, k=None, offset=0, disjunctive=False, tiered=True, biwords=()):
+    """Returns the top k ranked results of the query vector starting
+    from rank `offset` + 1 along with the total number of matched documents.
+    If k is None, all of the matched documents are ranked.
 
-    net_scores = compute_scores(docid_postings, token_postings, frequencies)
+    By default, documents must contain every (unpruned) query term.
+    If disjunctive, documents may contain any of the query terms;
+    candidates are then retrieved using WAND and reranked by net score.
 
-    et4 = time.time()
+    If biwords are given (see query_biwords), documents that contain the
+    biwords (the query terms next to each other) are matched first, which
+    only reads the short biword postings lists and looks up the terms'
+    postings of those documents. This falls back like the high tier below.
+    The total then only counts the documents that contain the biwords.
 
-    print('compute', et4-tt4)
+    If tiered and the index has a high tier (champion lists), documents
+    are first matched against the high tier of each term and only fall back
+    to the full postings lists when fewer than `offset` + k documents match.
+    Results answered from the high tier are approximate, and so is the
+    total (the smallest document frequency of the terms).
 
-    tt5 = time.time()
+    If the index is quality ordered (see reorder.py), a few candidates
+    per result are retrieved by tfidf sum and static quality and reranked
+    by net score; the intersection stops once no remaining document can make
+    the candidates, in which case the total is estimated.
 
-    ranked_scores = sorted(
-        net_scores.items(),
-        key=lambda item: item[1],
-        reverse=True
-    )
+    Otherwise, every document that contains the terms is scored. If worker
+    processes are enabled (see lib/parallel.py), the docids are split into
+    ranges that are scored in parallel (see score_range) when the query reads
+    enough postings; the number of workers grows with the number of postings.
+    Only this exhaustive evaluation of conjunctive queries is parallel: the
+    other paths above are evaluated by the calling process.
+
+    If the query has a deadline (see lib/deadline.py) that passes, the
+    evaluation stops early and the documents found so far are ranked, and the
+    total is estimated: the high tier (or the biwords) answers even with too
+    few documents, top-k retrieval stops (see lib/wand.py) and the docid
+    ranges left are not scored (the ranges of a query that would score
+    every document are scored one at a time; see deadline_range_postings).
+
+    :param frequencies dict[str, int]: The query vector (see prepare_query)
+    :param k int: The number of results to return
+    :param offset int: The number of top results to skip (for pagination)
+    :param disjunctive bool: Whether to match any term instead of every term
+    :param tiered bool: Whether to answer from the high tier first
+    :param biwords list[str]: The indexed biwords of the query
+    :return: The ranked (docid, score) pairs and the total match count
+    :rtype: tuple[list[tuple[int, float]], int]
+    """
+    idfs = None
+    components = None
+    deadline = current_deadline()
+    if disjunctive:
+        # rerank a few candidates per result (or every matched document)
+        depth = ((offset + k) * rerank_factor if k is not None
+            else get_num_documents())
+        docid_postings, token_postings, idfs, num_matched = postings_topk(
+            frequencies.keys(), depth, disjunctive=True)
+    else:
+        docid_postings = None
+        if biwords and k is not None:
+            # answer from the biwords if enough documents match
+            docid_postings, token_postings = postings_biwords(frequencies.keys(), biwords)
+            if len(docid_postings) >= offset + k or docid_postings and deadline_expired():
+                num_matched = len(docid_postings)
+            else:
+                docid_postings = None
+        if docid_postings is None and tiered and k is not None and get_champions():
+            # answer from the high tier if enough documents match
+            docid_postings, token_postings = postings_set(frequencies.keys(), tiered=True)
+            if len(docid_postings) >= offset + k or docid_postings and deadline_expired():
+                num_matched = min(get_champion_postings(token)[1] for token in frequencies)
+            else:
+                docid_postings = None
+        if docid_postings is None and k is not None and is_quality_ordered():
+            # rerank a few candidates per result and stop early
+            # (the idf is left to compute_scores, like postings_set)
+            docid_postings, token_postings, _, num_matched = postings_topk(
+                frequencies.keys(), (offset + k) * rerank_factor, disjunctive=False)
+        if docid_postings is None:
+            cost = sum(get_term_stats(token)[0] for token in frequencies)
+            # the workers cannot read the documents added since the last flush
+            workers = choose_workers(cost) if not has_unflushed_documents() else 1
+            if workers > 1:
+                # score the docid ranges in parallel
+                ranges = docid_ranges(get_num_documents(), workers)
+                parts = map_ranges(score_range, (frequencies, get_index_version(),
+                    deadline.at if deadline is not None else None), ranges)
+                if None not in parts and any(part is not False for part in parts):
+                    scored = [(lo, hi) for (lo, hi), part in zip(ranges, parts) if part is not False]
+                    if len(scored) < len(ranges):
+                        mark_partial() # the workers skipped ranges
+                    components = concat_components([part for part in parts if part is not False])
+                    num_matched = _estimate_matched(len(components[0]), scored)
+            if components is None and deadline is not None and cost >= 2 * deadline_range_postings:
+                # score the docid ranges in order until the deadline passes
+                parts = []
+                scored = []
+                for lo, hi in docid_ranges(get_num_documents(), cost // deadline_range_postings):
+                    if parts and deadline.expired():
+                        break
+                    parts.append(score_range(frequencies, get_index_version(), None, lo, hi))
+                    scored.append((lo, hi))
+                components = concat_components(parts)
+                num_matched = _estimate_matched(len(components[0]), scored)
+            if components is None:
+                docid_postings, token_postings = postings_set(frequencies.keys())
+                num_matched = len(docid_postings)
+
+    if components is not None:
+        if not len(components[0]):
+            return [], 0 # no documents matched in the scored ranges
+    elif not docid_postings:
+        return [], 0 # no documents matched
+
+    if components is not None:
+        net_scores = combine_scores(components)
+    else:
+        net_scores = compute_scores(docid_postings, token_postings, frequencies, idfs)
+
+    return rank_scores(net_scores, k, offset), num_matched
+
+
+def _estimate_matched(num_matched, scored):
+    """Returns the estimated number of matched documents of a query
+    that matched `num_matched` documents in the `scored` docid ranges.
+    """
+    num_docs = get_num_documents()
+    num_scored = sum(min(hi, num_docs + 1) - max(lo, 1) for lo, hi in scored)
+    if num_scored >= num_docs:
+        return num_matched
+    return round(num_matched * num_docs / max(num_scored, 1))
+
+
+def _estimate_union(tokenset):
+    """Returns the estimated number of documents that contain any of the
+    tokens, from their doc freqs alone (as if the tokens occurred
+    independently), so that no postings list is read to count them.
+    The estimate is at least the largest doc freq.
+    """
+    num_docs = get_num_nonempty_documents()
+    doc_freqs = [get_term_stats(token)[0] for token in tokenset]
+    if not num_docs or not doc_freqs:
+        return 0
+    missed = 1.0
+    for doc_freq in doc_freqs:
+        missed *= 1 - min(doc_freq, num_docs) / num_docs
+    return max(round(num_docs * (1 - missed)), max(doc_freqs))
+
+
+def postings_docids(tokenset, docids):
+    """Returns postings indexed both by doc id and token (like postings_set)
+    for the docids (sorted), where a document may lack some of the tokens.
+    """
+    docid_postings = defaultdict(dict)
+    token_postings = defaultdict(list)
+
+    for token in tokenset:
+        postings = get_postings(token)
+        i = 0
+        for docid in docids:
+            i = bisect_left(postings, docid, i, key=_docid_key)
+            if i < len(postings) and postings[i].docid == docid:
+                docid_postings[docid][token] = postings[i]
+                token_postings[token].append(postings[i])
+
+    return docid_postings, token_postings
+
+
+def shard_term_stats(tokens):
+    """Returns the number of (non-empty) documents of the index and the
+    (doc_freq, coll_freq, max_score) of each token (see reader.get_term_stats),
+    which a coordinator sums over the shards (see lib/coordinator.py).
+    """
+    return {
+        'num_docs': get_num_nonempty_documents(),
+        'stats': {token: get_term_stats(token) for token in tokens},
+    }
+
+
+def shard_components(frequencies, idfs, disjunctive=False):
+    """Returns the score components (see score_components) of the documents
+    of the index that contain every (or any, if disjunctive) token of the
+    query vector, scored with the given idfs (those of the whole collection,
+    see lib/coordinator.py) instead of the idfs of the index.
+
+    Every matched document is scored (no high tier, biwords or early
+    termination), so that the components of every shard together are those
+    of a single index. The components of the last queries are kept, since
+    a coordinator asks for them twice: for their norms and to rank them.
+    """
+    key = (get_index_version(), disjunctive, tuple(sorted(frequencies.items())), tuple(sorted(idfs.items())))
+    with _SHARD_COMPONENTS_LOCK:
+        components = _SHARD_COMPONENTS.get(key)
+        if components is not None:
+            _SHARD_COMPONENTS.move_to_end(key)
+            return components
+
+    tokens = [token for token in frequencies if get_term_stats(token)[0]]
+    if disjunctive:
+        docids = sorted(set().union(*(
+            (posting.docid for posting in get_postings(token)) for token in tokens
+        )))
+        docid_postings, token_postings = postings_docids(tokens, docids)
+    elif len(tokens) == len(frequencies):
+        docid_postings, token_postings = postings_set(tokens)
+    else:
+        docid_postings, token_postings = {}, {} # a token is not in this shard
+
+    # every token of the query vector counts towards its norm,
+    # whether or not the documents of this shard contain it
+    token_postings = defaultdict(list, token_postings)
+    for token in frequencies:
+        token_postings[token]
+    components = score_components(docid_postings, token_postings, frequencies, idfs)
+
+    with _SHARD_COMPONENTS_LOCK:
+        _SHARD_COMPONENTS[key] = components
+        while len(_SHARD_COMPONENTS) > SHARD_COMPONENTS_ENTRIES:
+            _SHARD_COMPONENTS.popitem(last=False)
+    return components
+
+
+def evaluate_boolean(query, k=None, offset=0):
+    """Returns the top k ranked results of the boolean query (with AND, OR,
+    NOT, parentheses and quoted terms; see lib/queryparse.py) starting from
+    rank `offset` + 1 along with the total number of matched documents.
+    If k is None, all of the matched documents are ranked.
+
+    The query is planned by the document frequencies of its terms
+    (see lib/queryplan.py) and the matched documents are scored by
+    the terms that are not negated. Results are cached like evaluate_cached.
+    """
+    tree = parse_query(query)
+    if tree is None:
+        return [], 0
 
-    et5 = time.time()
+    def evaluate(k, offset):
+        root, frequencies = plan_query(tree)
+        if root is None:
+            return [], 0
+        docids = match_plan(root)
+        if not docids:
+            return [], 0
+        docid_postings, token_postings = postings_docids(frequencies.keys(), docids)
+        net_scores = compute_scores(docid_postings, token_postings, frequencies)
+        return rank_scores(net_scores, k, offset), len(docids)
 
-    print('ranking', et5-tt5)
+    # the parse tree is canonical (the operands are sorted)
+    key = (_BOOLEAN_MODE, ((repr(tree), 0),))
+    return _evaluate_cached(key, k, offset, evaluate)
 
-    return ranked_scores
 
+def enable_result_cache(max_bytes, filename=None):
+    """Enables caching the results of queries, bounded by `max_bytes`.
+    If a filename is specified, the cache is loaded from the file (if it
+    exists and its index version matches) and can be saved to it
+    with save_result_cache().
+    """
+    global _RESULT_CACHE
+    _RESULT_CACHE = ResultCache(max_bytes, get_index_version(), filename)
+
+
+def enable_intersection_cache(max_bytes):
+    """Enables caching the intersections of pairs of query terms
+    (see pair_candidates), bounded by `max_bytes`.
+    """
+    global _INTERSECTION_CACHE
+    _INTERSECTION_CACHE = IntersectionCache(max_bytes, get_index_version())
+
+
+def get_intersection_cache_stats():
+    """Returns the stats of the intersection cache or None if it is disabled.
+    """
+    if _INTERSECTION_CACHE is None:
+        return None
+    return _INTERSECTION_CACHE.stats()
+
+
+def save_result_cache():
+    """Saves the result cache to its file (if it has one).
+    """
+    if _RESULT_CACHE is not None:
+        _RESULT_CACHE.save()
+
+
+def get_result_cache_stats():
+    """Returns the hit/miss and memory stats of the result cache
+    or None if the result cache is not enabled.
+    """
+    if _RESULT_CACHE is None:
+        return None
+    return _RESULT_CACHE.stats()
+
+
+def enable_query_log(filename):
+    """Enables recording every query processed to the query log file.
+    """
+    global _QUERY_LOG
+    _QUERY_LOG = QueryLog(filename)
+
+
+# mode of boolean queries in the result cache
+# (the other modes are the disjunctive and tiered bits)
+_BOOLEAN_MODE = 1 << 2
+
+
+def query_key(frequencies, disjunctive, tiered, biwords=()):
+    """Returns the key of the query vector in the result cache.
+    Queries with the same stemmed/pruned terms share the same key.
+    Since the biwords depend on the order of the terms, they are
+    part of the key as terms with a frequency of 0.
+    """
+    terms = sorted(frequencies.items())
+    terms.extend((token, 0) for token in sorted(biwords))
+    return (int(disjunctive) | int(tiered) << 1, tuple(terms))
+
+
+def process_query(query, k=None, offset=0, disjunctive=False, tiered=True):
+    """Returns the top k ranked results from this query starting
+    from rank `offset` + 1 along with the total number of matched documents.
+    If k is None, all of the matched documents are ranked.
+    See evaluate_query for how the query is evaluated
+    and evaluate_cached for how its results are cached.
+
+    If the query uses boolean operators, parentheses or quotes,
+    it is evaluated as a boolean query instead (see evaluate_boolean)
+    and `disjunctive` and `tiered` are ignored.
+
+    If the query log is enabled, the query is recorded to it.
 
-def format_results_tty(result, k):
+    Within deadline.query_deadline, the evaluation stops early once the deadline
+    passes and returns the best results found so far (see evaluate_query).
+
+    The query is evaluated on a single version of the index (see
+    reader.pinned_index); pin the index around the call as well
+    to read the documents of the results from the same version.
+
+    :param query str: The query
+    :param k int: The number of results to return
+    :param offset int: The number of top results to skip (for pagination)
+    :param disjunctive bool: Whether to match any term instead of every term
+    :param tiered bool: Whether to answer from the high tier first
+    :return: The ranked (docid, score) pairs and the total match count
+    :rtype: tuple[list[tuple[int, float]], int]
+    """
+    if _QUERY_LOG is not None:
+        _QUERY_LOG.record(query, disjunctive)
+
+    with pinned_index():
+        if is_boolean_query(query):
+            return evaluate_boolean(query, k, offset)
+
+        frequencies = prepare_query(query)
+        if not frequencies:
+            return [], 0
+
+        biwords = query_biwords(query, frequencies) if not disjunctive else []
+        return evaluate_cached(frequencies, k, offset, disjunctive, tiered, biwords)
+
+
+def process_batch(queries, k=None, offset=0, disjunctive=False, tiered=True):
+    """Returns the (results, total) of each query (see process_query),
+    evaluated together: each postings list needed by the batch is read
+    at most once (see reader.batch_postings) and queries that only differ
+    by whitespace are evaluated once.
+
+    :param queries list[str]: The queries
+    :return: The ranked (docid, score) pairs and the total match count per query
+    :rtype: list[tuple[list[tuple[int, float]], int]]
+    """
+    answers = {}
+    with batch_postings():
+        for query in queries:
+            normalized = " ".join(query.split())
+            if normalized not in answers:
+                answers[normalized] = process_query(normalized, k, offset, disjunctive, tiered)
+    return [answers[" ".join(query.split())] for query in queries]
+
+
+def evaluate_cached(frequencies, k=None, offset=0, disjunctive=False, tiered=True, biwords=()):
+    """Same as evaluate_query, but answers from the result cache if it is enabled.
+
+    The results are cached for the rank of the last result requested
+    (`offset` + k) and answer any request up to that rank, i.e. fewer results
+    or an earlier page (see lib/resultcache.py).
+    """
+    def evaluate(k, offset):
+        return evaluate_query(frequencies, k, offset, disjunctive, tiered, biwords)
+
+    return _evaluate_cached(query_key(frequencies, disjunctive, tiered, biwords), k, offset, evaluate)
+
+
+def _evaluate_cached(key, k, offset, evaluate):
+    """Returns `evaluate(k, offset)`, answered from the result cache
+    (under the key) if it is enabled.
+
+    The results are cached under the index version read before they are
+    evaluated: documents added meanwhile (see reader.add_document) may be
+    missing from them, so they must not pass for results of a later version.
+    """
+    if _RESULT_CACHE is None or k is None:
+        return evaluate(k, offset)
+
+    version = get_index_version()
+    cached = _RESULT_CACHE.get(key, offset + k, version)
+    if cached is not None:
+        results, total = cached
+        return results[offset:offset + k], total
+
+    # evaluating the top `offset` + k results ranks the same documents
+    results, total = evaluate(offset + k, 0)
+    deadline = current_deadline()
+    if deadline is None or not deadline.partial:
+        _RESULT_CACHE.put(key, offset + k, results, total, version)
+    return results[offset:offset + k], total
+
+
+def format_results_tty(result, k, offset=0):
     """Returns the top K results and formats
     the results for the terminal interface.
+    Ranks are numbered starting from `offset` + 1.
     """
     results = []
-    for rank, (docid, score) in enumerate(result[:k], 1):
+    for rank, (docid, score) in enumerate(result[:k], offset + 1):
         document = get_document(docid)
         url = document.url if document.url else "URL not found"
         result = f'Rank {rank}: {url} (Score: {score:.2f})'
@@ -283,13 +988,15 @@ def format_results_tty(result, k):
     return results
 
 
-def format_results_web(result, k, SUMMARY_NAME):
+def format_results_web(result, k, SUMMARY_NAME, offset=0):
     """Returns the top K results and formats
     the results for the web interface.
+    Ranks are numbered starting from `offset` + 1.
     """
     # Format output to include rankings, URLS, and scores
+    # (URLs and summaries are only fetched for the returned rows)
     results = []
-    for rank, (docid, score) in enumerate(result[:k], 1):
+    for rank, (docid, score) in enumerate(result[:k], offset + 1):
         document = get_document(docid)
         url = document.url if document.url else "URL not found"
         summary = get_summary(docid)
@@ -300,3 +1007,18 @@ def format_results_web(result, k, SUMMARY_NAME):
         )
     return results
 
+
+def format_results_json(result, offset=0):
+    """Returns the results as rows (dicts) for the JSON interface.
+    Ranks are numbered starting from `offset` + 1.
+    """
+    rows = []
+    for rank, (docid, score) in enumerate(result, offset + 1):
+        rows.append({
+            "rank": rank,
+            "docid": docid,
+            "url": get_document(docid).url,
+            "score": score,
+            "summary": get_summary(docid),
+        })
+    return rows
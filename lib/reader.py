@@ -1,106 +1,484 @@
 # lib/reader.py
 #
 # reader for index files
+#
+# an opened index is held by an Index handle; the functions below read the
+# current index, or the index pinned by the calling thread (see pinned_index),
+# so a new generation of the index can be opened, warmed up and swapped in
+# (see reload_index) while the queries in flight finish on the old one
+#
+# documents added while the index is served (see add_document) are appended
+# to the index as segments (see lib/segment.py): the functions below read the
+# postings lists and documents of the index followed by those of its segments
 
 import os
+import math
 import glob
-import functools
+import mmap
+import time
+import struct
+import atexit
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from bisect import bisect_left
+from operator import attrgetter
 from collections import defaultdict
 from lib.structs import *
 from lib.posting import *
 from lib.document import *
+from lib.seeker import *
+from lib.bitmap import *
+from lib.segment import Segment, load_segments, segment_filename
+from lib.params import importance
+from lib.postingcache import PostingCache, postings_nbytes
+from lib.sharedcache import shared_cache_prefix, open_shared_cache, remove_shared_caches
+from lib.writer import MERGE_VER, MERGE_LAST_DOCID_OFFSET, MERGE_F_QUALITY_ORDERED, MERGE_F_IMPACTS, MERGE_F_BIWORDS
+from lib.writer import IMPACT_LEVELS, term_idf, impact_fingerprint, quantize_impact
+
+# default memory budget of the postings cache (per process)
+DEFAULT_POSTINGS_CACHE_BYTES = 128 * 1024 * 1024
+
+# default time budget (in seconds) of warming up a reloaded index
+DEFAULT_RELOAD_WARMUP_SECS = 30
+
+# index serving new queries
+_CURRENT = None
+
+# index pinned by each thread (see pinned_index)
+_PINNED = threading.local()
+
+# serializes reloads
+_RELOAD_LOCK = threading.Lock()
 
-_INDEX_BUCKETS = {}
-_INDEX_SEEK = defaultdict(dict)
-_INDEX_CACHE = {}
+# memory budget of the postings cache of every index
+_POSTINGS_CACHE_BYTES = DEFAULT_POSTINGS_CACHE_BYTES
 
-_DOCINFO = []
-_DOCINFO_LINKS_INDEX = {}
-_DOCLINKS = []
+# path prefix, memory budget and lock of the arenas of bitmap postings
+# lists shared by forked processes (if enabled)
+_SHARED_CACHE = None
 
-_MERGEINFO_DOCID = 0
-_MERGEINFO_TOTAL_TOKENS = 0
+# postings lists read by each thread within batch_postings()
+_BATCH = threading.local()
 
-_NONEMPTY_DOC_CNT = 0
-_EMPTY_DOC_CNT = 0
+# serializes adding documents (see add_document)
+_INGEST_LOCK = threading.Lock()
+
+# size of the live segment at which it is flushed (None if documents cannot be added)
+_FLUSH_BYTES = None
+
+_docid_key = attrgetter('docid')
 
 _initialized = False
-_initialized_docs = False
 
-_SUMMARY_INDEX = {}
-_initialized_sums = False
 
-def initialize(docinfo_filename, mergeinfo_filename, buckets_dir):
+def _map_file(filename):
+    """Returns a read-only memory map of the file
+    (or empty bytes if the file is empty).
+    """
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Index:
+    """Handle of an opened index: its docinfo and mergeinfo, the seek entries
+    and memory-mapped bucket files of its postings lists, its segments
+    and its postings cache.
+
+    Its files are only read, but the handle itself changes while it is
+    open: documents added (see add_document) go to its live segment, and
+    flushing the live segment replaces its segments.
+
+    The handle counts the threads that use it (see pinned_index); once it is
+    retired (swapped out by reload_index), its files are closed as soon as
+    the last of them is done.
+    """
+    def __init__(self, docinfo_filename, mergeinfo_filename, buckets_dir, postings_cache_bytes,
+            segments_dir=None):
+        self.docinfo_filename = docinfo_filename
+        self.mergeinfo_filename = mergeinfo_filename
+        self.buckets_dir = buckets_dir
+        self.segments_dir = segments_dir
+
+        self.buckets = {}
+        self.seek = defaultdict(dict)
+        self.champ_buckets = {}
+        self.champ_seek = defaultdict(dict)
+        self.postings_cache = PostingCache(postings_cache_bytes)
+
+        self.docinfo = []
+        self.docinfo_links_index = {}
+        self.doclinks = []
+        self.doclinks_filename = None
+
+        self.summary_index = {}
+        self.summary_filename = None
+
+        self.flags = 0
+        self.last_docid = 0
+        self.total_tokens = 0
+        self.champions = 0
+        self.version = 0
+        self.impact_scale = 0.0
+
+        self.nonempty_doc_cnt = 0
+        self.empty_doc_cnt = 0
+
+        # flushed segments in docid order, followed by the live segment
+        # if documents can be added; the tuple is replaced as a whole when
+        # a segment is flushed, and only the live segment is modified
+        # (see add_document)
+        self.segments = ()
+
+        # arena of the shared postings cache of this version (opened on first use)
+        self._shared_cache = None
+        self._shared_cache_opened = False
+
+        self._lock = threading.Lock()
+        self._refs = 0
+        self._retired = False
+        self._closed = False
+
+        self._load()
+
+    def _load(self):
+        # parse mergeinfo - store mergeinfo file in memory
+        # (first, since the index version is updated after the other files)
+        with open(self.mergeinfo_filename, 'rb') as mergefh:
+            version, _ = u8_rd(mergefh)
+            assert version == MERGE_VER, "index is outdated; rebuild it with makeindex.py"
+            self.flags, _ = u8_rd(mergefh)
+            mergefh.seek(MERGE_LAST_DOCID_OFFSET, 0)
+            self.last_docid, _ = u64_rd(mergefh)
+            self.total_tokens, _ = u32_rd(mergefh)
+            self.champions, _ = u32_rd(mergefh)
+            self.version, _ = u64_rd(mergefh)
+            fingerprint, _ = u32_rd(mergefh)
+            self.impact_scale, _ = f32_rd(mergefh)
+
+        # impacts are ignored if they were computed with other parameters
+        if self.flags & MERGE_F_IMPACTS and fingerprint != impact_fingerprint():
+            print("Impacts are outdated since the scoring parameters changed; "
+                "rebuild the index with makeindex.py --impacts to use them.")
+            self.flags &= ~MERGE_F_IMPACTS
+
+        # parse docinfo - store docinfo file in memory
+        with open(self.docinfo_filename, 'rb') as docfh:
+            docfh.seek(0, 2)
+            docend = docfh.tell()
+            docfh.seek(0, 0)
+            while docfh.tell() != docend:
+                document, _ = sdocument_rd(docfh)
+                for _ in range(document.docid - len(self.docinfo) - 1):
+                    # sparse document ids - append with empty docs
+                    self.docinfo.append(Document(
+                        docid=len(self.docinfo) + 1,
+                        url='',
+                        total_tokens=0,
+                        empty=True
+                    ))
+                    self.empty_doc_cnt += 1
+                self.docinfo.append(document)
+                self.docinfo_links_index[document.url] = document.docid
+                self.nonempty_doc_cnt += 1
+
+        # parse seek files / open bucket files
+        for path in glob.glob("*", root_dir=self.buckets_dir):
+            full_path = os.path.join(self.buckets_dir, path)
+            if os.path.isfile(full_path):
+                bid = None
+                if path.endswith(".bucket"):
+                    # bucket file
+                    bid = int(path[:-7])
+                    self.buckets[bid] = _map_file(full_path)
+                elif path.endswith(".seek"):
+                    # seek file
+                    bid = int(path[:-5])
+                    with open(full_path, 'rb') as seekfh:
+                        seekfh.seek(0, 2)
+                        seekend = seekfh.tell()
+                        seekfh.seek(0, 0)
+                        while seekfh.tell() != seekend:
+                            # store entire seek file in memory
+                            seeker, _ = sseeker_rd(seekfh)
+                            self.seek[bid][seeker.token] = (
+                                seeker.offset,
+                                seeker.doc_freq,
+                                seeker.coll_freq,
+                                seeker.max_score,
+                            )
+                elif path.endswith(".champ") and self.champions:
+                    # high tier bucket file
+                    bid = int(path[:-6])
+                    self.champ_buckets[bid] = _map_file(full_path)
+                elif path.endswith(".cseek") and self.champions:
+                    # high tier seek file
+                    bid = int(path[:-6])
+                    with open(full_path, 'rb') as seekfh:
+                        seekfh.seek(0, 2)
+                        seekend = seekfh.tell()
+                        seekfh.seek(0, 0)
+                        while seekfh.tell() != seekend:
+                            token, _ = sstr_rd(seekfh)
+                            offset, _ = u32_rd(seekfh)
+                            doc_freq, _ = u32_rd(seekfh)
+                            self.champ_seek[bid][token] = (offset, doc_freq)
+
+        # load the flushed segments
+        self.segments = tuple(load_segments(self.segments_dir, self.last_docid, self.docinfo_links_index))
+
+    def next_docid(self):
+        """Returns the docid of the next document added.
+        """
+        return self.segments[-1].next_docid() if self.segments else self.last_docid + 1
+
+    def generation(self):
+        """Returns the version of the index including its segments,
+        which increases whenever the index is rebuilt or modified
+        or a document is added.
+        """
+        return self.version + sum(len(segment) for segment in self.segments)
+
+    def load_doclinks(self, doclinks_filename):
+        # read doclinks
+        with open(doclinks_filename, 'rb') as doclinksfh:
+            doclinksfh.seek(0, 2)
+            doclinksend = doclinksfh.tell()
+            doclinksfh.seek(0, 0)
+            while doclinksfh.tell() != doclinksend:
+                docid, _ = u64_rd(doclinksfh)
+                for _ in range(docid - len(self.doclinks) - 1):
+                    # sparse document ids - append with empty set
+                    self.doclinks.append(set())
+
+                urlset = set()
+                num_urls, _ = u32_rd(doclinksfh)
+                for _ in range(num_urls):
+                    # store url as docid if it exists and non-empty
+                    url, _ = sstr_rd(doclinksfh)
+                    docid = self.docinfo_links_index.get(url, None)
+                    if docid:
+                        document = self.docinfo[docid - 1]
+                        if document and not document.empty:
+                            urlset.add(docid)
+                self.doclinks.append(urlset)
+
+        self.doclinks_filename = doclinks_filename # initialized successfully
+
+    def load_summary(self, filename):
+        if not os.path.exists(filename):
+            print("Summary file does not exist.")
+            return
+
+        try:
+            summary_index = {}
+            with open(filename, "rb") as summary_fh:
+                summary_fh.seek(0, 2)  # Seek to the end of the file
+                end = summary_fh.tell()
+                summary_fh.seek(0, 0)  # Seek back to the beginning of the file
+                while summary_fh.tell() != end:
+                    doc_id_bytes, _ = u64_rd(summary_fh)
+                    summary, summary_length = sstr_rd(summary_fh)
+                    summary_index[doc_id_bytes] = summary
+
+            self.summary_index = summary_index
+            self.summary_filename = filename
+        except Exception as e:
+            print(f"Failed to initialize summary index: {str(e)}")
+
+    def acquire(self):
+        """Registers a thread using the index. Returns False
+        (without registering) if the index is already closed.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            close = self._retired and self._refs == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """Closes the index once no thread uses it anymore.
+        """
+        with self._lock:
+            self._retired = True
+            close = self._refs == 0
+        if close:
+            self.close()
+
+    def shared_cache(self):
+        """Returns the arena of the shared postings cache of this version
+        of the index (see enable_shared_postings_cache) or None.
+        """
+        if not self._shared_cache_opened and _SHARED_CACHE is not None:
+            with self._lock:
+                if not self._shared_cache_opened and not self._closed:
+                    self._shared_cache = open_shared_cache(*_SHARED_CACHE, version=self.version)
+                    self._shared_cache_opened = True
+        return self._shared_cache
+
+    def close(self):
+        """Drops the cached postings and closes the bucket files
+        and the shared cache.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.postings_cache.clear()
+        if self._shared_cache is not None:
+            self._shared_cache.close()
+        for buf in (*self.buckets.values(), *self.champ_buckets.values()):
+            if isinstance(buf, mmap.mmap):
+                try:
+                    buf.close()
+                except BufferError:
+                    pass # still exported (closed once collected)
+
+
+def _index():
+    """Returns the index pinned by the calling thread or the current index.
+    """
+    index = getattr(_PINNED, 'index', None)
+    return index if index is not None else _CURRENT
+
+
+@contextmanager
+def _pinned(index):
+    """Within the context, the calling thread reads the index
+    (which the caller must have acquired).
+    """
+    previous = getattr(_PINNED, 'index', None)
+    _PINNED.index = index
+    try:
+        yield index
+    finally:
+        _PINNED.index = previous
+
+
+@contextmanager
+def pinned_index():
+    """Within the context, the calling thread keeps reading the index that
+    is current when it enters the context, even if a new generation of the
+    index is swapped in meanwhile (see reload_index), and the files of that
+    index stay open. Wrap every query (and the use of its results) in it.
+    """
+    if getattr(_PINNED, 'index', None) is not None:
+        yield _PINNED.index # nested
+        return
+
+    index = _CURRENT
+    while not index.acquire():
+        index = _CURRENT # closed after being swapped out meanwhile
+    try:
+        with _pinned(index):
+            yield index
+    finally:
+        index.release()
+
+
+def initialize(docinfo_filename, mergeinfo_filename, buckets_dir, segments_dir=None):
     """Initializes the reader by opening index files
-    from the docinfo, mergeinfo, and the buckets directories.
+    from the docinfo, mergeinfo, and the buckets directories
+    (and the flushed segments of the segments directory, if given).
+
+    The bucket files are memory mapped and only read through cursors
+    of their own (see structs.BufferCursor), so the postings can be read
+    by any number of threads at once.
     """
     global _initialized
     if _initialized:
         return
 
-    global _INDEX_BUCKETS
-    global _INDEX_SEEK
-    global _DOCINFO
-    global _DOCINFO_LINKS_INDEX
-    global _DOCLINKS
-    global _MERGEINFO_DOCID
-    global _MERGEINFO_TOTAL_TOKENS
-    global _NONEMPTY_DOC_CNT
-    global _EMPTY_DOC_CNT
-
-    # parse docinfo - store docinfo file in memory
-    with open(docinfo_filename, 'rb') as docfh:
-        docfh.seek(0, 2)
-        docend = docfh.tell()
-        docfh.seek(0, 0)
-        while docfh.tell() != docend:
-            document, _ = sdocument_rd(docfh)
-            for _ in range(document.docid - len(_DOCINFO) - 1):
-                # sparse document ids - append with empty docs
-                _DOCINFO.append(Document(
-                    docid=len(_DOCINFO) + 1,
-                    url='',
-                    total_tokens=0,
-                    empty=True
-                ))
-                _EMPTY_DOC_CNT += 1
-            _DOCINFO.append(document)
-            _DOCINFO_LINKS_INDEX[document.url] = document.docid
-            _NONEMPTY_DOC_CNT += 1
-
-    # parse mergeinfo - store mergeinfo file in memory
-    with open(mergeinfo_filename, 'rb') as mergefh:
-        mergefh.seek(4, 0)
-        _MERGEINFO_DOCID, _ = u64_rd(mergefh)
-        _MERGEINFO_TOTAL_TOKENS, _ = u32_rd(mergefh)
-
-    # parse seek files / open bucket files
-    for path in glob.glob("*", root_dir=buckets_dir):
-        full_path = os.path.join(buckets_dir, path)
-        if os.path.isfile(full_path):
-            bid = None
-            if path.endswith(".bucket"):
-                # bucket file
-                bid = int(path[:-7])
-                bucketfh = open(full_path, 'rb')
-                _INDEX_BUCKETS[bid] = bucketfh
-            elif path.endswith(".seek"):
-                # seek file
-                bid = int(path[:-5])
-                seekfh = open(full_path, 'rb')
-                seekfh.seek(0, 2)
-                seekend = seekfh.tell()
-                seekfh.seek(0, 0)
-                while seekfh.tell() != seekend:
-                    # store entire seek file in memory
-                    token, _ = sstr_rd(seekfh)
-                    offset, _ = u32_rd(seekfh)
-                    _INDEX_SEEK[bid][token] = offset
-                seekfh.close()
+    global _CURRENT
+    _CURRENT = Index(docinfo_filename, mergeinfo_filename, buckets_dir, _POSTINGS_CACHE_BYTES, segments_dir)
 
     _initialized = True # initialized successfully
 
 
+def reload_index(warmup_secs=DEFAULT_RELOAD_WARMUP_SECS):
+    """Opens the index files again as a new generation of the index
+    and swaps it in if it is newer than the current index (every rebuild
+    or modification of the index increases its version).
+    Returns True if the index was swapped.
+
+    The live segment is flushed first (see add_document), so the new
+    index starts from every document added so far.
+
+    Before the swap, the postings cache of the new index is warmed up
+    (within `warmup_secs`) with the hottest postings lists of the current
+    index. Queries in flight finish on the current index, whose files are
+    closed once the last of them is done (see pinned_index).
+
+    The files of the current index must not be modified in place meanwhile:
+    build the new index elsewhere and swap the index directory, or replace
+    each file with os.replace and update the index version once every file
+    is replaced, like compute.py and reorder.py do. The version is read
+    first (see Index._load), so a reload before then reads the current
+    version and does not swap the index.
+    """
+    global _CURRENT
+    assert _initialized, "call reader.initialize() before calling this"
+
+    with _RELOAD_LOCK, _INGEST_LOCK:
+        old = _CURRENT
+        _flush_segment(old)
+        new = Index(old.docinfo_filename, old.mergeinfo_filename, old.buckets_dir, _POSTINGS_CACHE_BYTES,
+            old.segments_dir)
+        if new.generation() <= old.generation():
+            new.close()
+            return False
+        if _FLUSH_BYTES is not None:
+            new.segments += (Segment(new.next_docid()),)
+        if old.summary_filename:
+            new.load_summary(old.summary_filename)
+        if old.doclinks_filename:
+            new.load_doclinks(old.doclinks_filename)
+
+        # warm up the new index with the postings lists hot in the old one
+        deadline = time.monotonic() + warmup_secs
+        new.acquire()
+        try:
+            with _pinned(new):
+                for key in old.postings_cache.hot_keys():
+                    if time.monotonic() >= deadline or new.postings_cache.is_full():
+                        break
+                    if isinstance(key, str):
+                        get_postings(key)
+                    elif key[0] == 'champ':
+                        get_champion_postings(key[1])
+                    elif key[0] == 'bitmap':
+                        get_bitmap_postings(key[1])
+        finally:
+            new.release()
+
+        _CURRENT = new
+        old.retire()
+        return True
+
+
+def use_index_version(version):
+    """Makes sure that the calling process reads the index of the version,
+    reloading the index (without warm-up) if the version is newer.
+    Returns False if the index of the version cannot be read anymore.
+
+    Used by the worker processes, which are forked before any reload.
+    """
+    if _index().generation() == version:
+        return True
+    if version > _CURRENT.generation():
+        reload_index(warmup_secs=0)
+    return _index().generation() == version
+
+
 def initialize_doclinks(doclinks_filename):
     """Initializes each docid with the set of URLs crawled.
     If URL is not contained within the documents or the
@@ -109,64 +487,19 @@ def initialize_doclinks(doclinks_filename):
     Note: You should only call this function when you are doing
     pagerank / HITS computations. The search engine does not need this.
     """
-    global _initialized
-    global _initialized_docs
     assert _initialized, "call reader.initialize() before calling this"
-    if _initialized_docs:
+    index = _index()
+    if index.doclinks_filename:
         return
 
-    global _DOCINFO
-    global _DOCLINKS
-    global _DOCLINKS_INDEX
-
-    # read doclinks
-    with open(doclinks_filename, 'rb') as doclinksfh:
-        doclinksfh.seek(0, 2)
-        doclinksend = doclinksfh.tell()
-        doclinksfh.seek(0, 0)
-        while doclinksfh.tell() != doclinksend:
-            docid, _ = u64_rd(doclinksfh)
-            for _ in range(docid - len(_DOCLINKS) - 1):
-                # sparse document ids - append with empty set
-                _DOCLINKS.append(set())
-
-            urlset = set()
-            num_urls, _ = u32_rd(doclinksfh)
-            for _ in range(num_urls):
-                # store url as docid if it exists and non-empty
-                url, _ = sstr_rd(doclinksfh)
-                docid = _DOCINFO_LINKS_INDEX.get(url, None)
-                if docid:
-                    document = _DOCINFO[docid - 1]
-                    if document and not document.empty:
-                        urlset.add(docid)
-            _DOCLINKS.append(urlset)
-
-    _initialized_docs = True # initialized successfully
+    index.load_doclinks(doclinks_filename)
 
 def initialize_summary(filename):
-    global _SUMMARY_INDEX
-    global _initialized_sums
-    if _initialized_sums:
+    index = _index()
+    if index.summary_filename:
         return
 
-    if not os.path.exists(filename):
-        print("Summary file does not exist.")
-        return
-
-    try:
-        with open(filename, "rb") as summary_fh:
-            summary_fh.seek(0, 2)  # Seek to the end of the file
-            end = summary_fh.tell()
-            summary_fh.seek(0, 0)  # Seek back to the beginning of the file
-            while summary_fh.tell() != end:
-                doc_id_bytes, _ = u64_rd(summary_fh)
-                summary, summary_length = sstr_rd(summary_fh)
-                _SUMMARY_INDEX[doc_id_bytes] = summary
-        
-        _initialized_sums = True
-    except Exception as e:
-        print(f"Failed to initialize summary index: {str(e)}")
+    index.load_summary(filename)
 
 
 def get_summary(docid):
@@ -175,46 +508,88 @@ def get_summary(docid):
     :param docid int: The document identifier
     :return str: The summary of the document, or None if not found
     """
-    if docid not in _SUMMARY_INDEX:
-        return None  
-    return _SUMMARY_INDEX[docid] 
+    return _index().summary_index.get(docid, None)
 
 
 def get_total_tokens():
     """Returns the total number of unique tokens
     across the entire set of documents.
     """
-    global _MERGEINFO_TOTAL_TOKENS
-    return _MERGEINFO_TOTAL_TOKENS
+    return _index().total_tokens
 
 
 def get_num_documents():
     """Returns the total number of documents indexed.
     """
-    global _MERGEINFO_DOCID
-    return _MERGEINFO_DOCID
+    index = _index()
+    for segment in reversed(index.segments):
+        if len(segment):
+            return segment.next_docid() - 1
+    return index.last_docid
+
+
+def get_index_version():
+    """Returns the version of the index, which changes
+    whenever the index is rebuilt or modified or a document is added.
+    """
+    return _index().generation()
+
+
+def is_quality_ordered():
+    """Returns True if the docids are ordered by descending
+    static quality (see reorder.py), that is the static quality
+    of a document is at least the static quality of any later document.
+    """
+    return bool(_index().flags & MERGE_F_QUALITY_ORDERED)
+
+
+def has_impacts():
+    """Returns True if the postings store (up-to-date) impacts,
+    that is their quantized tfidf (see writer.write_impacts).
+    """
+    return bool(_index().flags & MERGE_F_IMPACTS)
+
+
+def has_biwords():
+    """Returns True if frequent biwords (pairs of adjacent terms)
+    are indexed (see writer.biword_min_df).
+    """
+    return bool(_index().flags & MERGE_F_BIWORDS)
+
+
+def get_impact_unit():
+    """Returns the tfidf that an impact of 1 stands for
+    (0.0 if the index has no impacts).
+    """
+    if not has_impacts():
+        return 0.0
+    return _index().impact_scale / IMPACT_LEVELS
 
 
 def get_num_empty_documents():
     """Returns the total number of empty documents indexed.
     """
-    global _EMPTY_DOC_CNT
-    return _EMPTY_DOC_CNT
+    return _index().empty_doc_cnt
 
 
 def get_num_nonempty_documents():
     """Returns the total number of non-empty documents indexed.
     """
-    global _NONEMPTY_DOC_CNT
-    return _NONEMPTY_DOC_CNT
+    index = _index()
+    return index.nonempty_doc_cnt + sum(len(segment) for segment in index.segments)
 
 
 def get_document(docid):
     """Returns the Document object associated with the document ID.
     See 'lib/document.py' for the Document interface.
     """
-    global _DOCINFO
-    return _DOCINFO[docid - 1]
+    index = _index()
+    if docid <= index.last_docid:
+        return index.docinfo[docid - 1]
+    for segment in reversed(index.segments):
+        if docid >= segment.first_docid:
+            return segment.document(docid)
+    raise IndexError(f"no document {docid}")
 
 
 def get_linked_docids(docid):
@@ -222,38 +597,537 @@ def get_linked_docids(docid):
     particular document. Note that reachable means its URL exists
     in the document content.
     """
-    global _DOCLINKS
-    return _DOCLINKS[docid - 1]
+    return _index().doclinks[docid - 1]
+
+
+def _get_seeker(token):
+    """Returns the (offset, doc_freq, coll_freq, max_score) seek entry
+    of the token or None if the token is not indexed.
+    """
+    if not token:
+        return None
+    bid = min(ord(token[0]), 128)
+
+    seekbucket = _index().seek.get(bid, None)
+    if not seekbucket:
+        return None
+    return seekbucket.get(token, None)
+
+
+def get_max_score(token):
+    """Returns the largest score of any posting of the token
+    excluding idf, that is max(tf / total_tokens * importance).
+    Returns 0.0 if the token is not indexed.
+    """
+    return get_term_stats(token)[2]
+
+
+def get_max_impact(token):
+    """Returns an upper bound on the impact of any posting of the token
+    (0 if the token is not indexed or the index has no impacts).
+    """
+    if not has_impacts():
+        return 0
+    index = _index()
+    seeker = _get_seeker(token)
+    max_impact = 0
+    if seeker is not None:
+        # the impacts of the buckets are computed with their own idf
+        idf = term_idf(seeker[1], index.nonempty_doc_cnt)
+        max_impact = quantize_impact(seeker[3] * idf, index.impact_scale)
+    for segment in index.segments:
+        max_impact = max(max_impact, segment.max_impact(token))
+    return max_impact
+
+
+def get_term_stats(token):
+    """Returns the (doc_freq, coll_freq, max_score) statistics of the token:
+    the number of documents that contain it, its total tf across
+    the documents and its max score (see get_max_score).
+    Returns (0, 0, 0.0) if the token is not indexed.
+
+    This only reads the seek entry (and the stats of the segments),
+    so no postings are read or decoded.
+    """
+    seeker = _get_seeker(token)
+    stats = (0, 0, 0.0) if seeker is None else seeker[1:]
+    for segment in _index().segments:
+        if token in segment:
+            doc_freq, coll_freq, max_score = segment.term_stats(token)
+            stats = (stats[0] + doc_freq, stats[1] + coll_freq, max(stats[2], max_score))
+    return stats
+
+
+def set_postings_cache_budget(max_bytes):
+    """Sets the memory budget (in bytes) of the decoded postings cache.
+    The cache is shared by the full postings lists and the high tier.
+    """
+    global _POSTINGS_CACHE_BYTES
+    _POSTINGS_CACHE_BYTES = max_bytes
+    if _CURRENT is not None:
+        _CURRENT.postings_cache.resize(max_bytes)
+
+
+def clear_postings_cache():
+    """Drops every cached postings list (the stats are kept).
+    """
+    _index().postings_cache.clear()
+
+
+def get_postings_cache_stats():
+    """Returns the hit/miss/eviction and memory stats of the postings cache.
+    """
+    return _index().postings_cache.stats()
+
+
+def enable_shared_postings_cache(max_bytes):
+    """Enables sharing the decoded bitmap postings lists (see get_bitmap_postings)
+    between this process and the processes forked from it afterwards,
+    in a cache of shared memory bounded by `max_bytes` for all of them.
+
+    The other postings lists need no sharing: their bucket files are memory
+    mapped, so their bytes are already shared through the page cache.
+
+    Each version of the index gets an arena of its own, and the arenas of
+    older versions are freed once every process has reloaded (until then,
+    a reload may briefly take up to twice `max_bytes`). The arenas are
+    removed when this process exits.
+    """
+    global _SHARED_CACHE
+    prefix = shared_cache_prefix()
+    remove_shared_caches(prefix)
+    atexit.register(remove_shared_caches, prefix)
+    _SHARED_CACHE = (prefix, max_bytes, multiprocessing.get_context('fork').Lock())
+
+
+def get_shared_postings_cache_stats():
+    """Returns the stats of the shared postings cache of the current
+    version of the index (hits and misses of this process) or None
+    if it is disabled.
+    """
+    shared_cache = _index().shared_cache()
+    if shared_cache is None:
+        return None
+    return shared_cache.stats()
+
+
+def _shared_bitmap(token, bitmap=None):
+    """Returns the bitmap postings list of the token from the shared cache
+    or None if it is not shared. If `bitmap` is given, it is shared first
+    (and returned as is if the shared cache is full).
+    """
+    shared_cache = _index().shared_cache()
+    if shared_cache is None:
+        return bitmap
+    key = token.encode('utf-8')
+    if bitmap is None:
+        shared = shared_cache.get(key)
+    else:
+        shared = shared_cache.put(key, u32_repr(len(bitmap.bits)), bitmap.bits, bitmap.side)
+        if shared is None:
+            return bitmap
+    if shared is None:
+        return None
+    bits_len, = struct.unpack_from('<I', shared)
+    return BitmapPostings(shared[4:4 + bits_len], shared[4 + bits_len:])
+
+
+@contextmanager
+def batch_postings():
+    """Within the context, every postings list read by the calling thread
+    is kept until the context exits, so it is read (and decoded) at most
+    once, whether or not the postings cache admits it. Used to evaluate
+    a batch of queries that share terms (see queryproc.process_batch).
+    The index is pinned for the whole batch (see pinned_index).
+
+    The lists kept are bounded by the memory budget of the postings cache;
+    once it is used up, further lists are only kept if the cache admits them.
+    """
+    if getattr(_BATCH, 'postings', None) is not None:
+        yield # nested batch
+        return
+    with pinned_index():
+        _BATCH.postings = {}
+        _BATCH.nbytes = 0
+        try:
+            yield
+        finally:
+            _BATCH.postings = None
+
+
+def _cache_get(key):
+    """Returns the cached postings list of the key (or None),
+    looking up the postings lists of the current batch first.
+    """
+    batch = getattr(_BATCH, 'postings', None)
+    if batch is not None:
+        value = batch.get(key)
+        if value is not None:
+            return value
+    return _index().postings_cache.get(key)
+
+
+def _cache_put(key, value, nbytes):
+    """Caches the postings list of the key
+    (and keeps it for the rest of the current batch).
+    """
+    index = _index()
+    batch = getattr(_BATCH, 'postings', None)
+    if batch is not None:
+        if key in batch:
+            batch[key] = value # i.e. merged again with a newer segment
+        elif _BATCH.nbytes + nbytes <= index.postings_cache.max_bytes:
+            batch[key] = value
+            _BATCH.nbytes += nbytes
+    index.postings_cache.put(key, value, nbytes)
+
+
+def _read_postings(buf, offset):
+    """Reads the postings list at the offset of the (mapped) bucket file
+    (stored either as postings or as a bitmap).
+    """
+    postings, _ = spostings_rd(BufferCursor(buf, offset))
+    return postings
+
+
+def _segment_postings(token):
+    """Returns the postings of the token in the segments of the index
+    (sorted by ascending docID).
+    """
+    postings = []
+    for segment in _index().segments:
+        if token not in segment:
+            continue
+        if not segment.frozen:
+            postings.extend(segment.postings(token)) # kept by the live segment
+            continue
+        # keyed by a tuple so that the keys never collide with get_postings
+        key = ('segment', segment.first_docid, token)
+        segment_postings = _cache_get(key)
+        if segment_postings is None:
+            segment_postings = segment.postings(token)
+            _cache_put(key, segment_postings, postings_nbytes(segment_postings))
+        postings.extend(segment_postings)
+    return postings
+
+
+def _merged(kind, token, merge):
+    """Returns the `kind` of list of the token (the postings list, bitmap
+    or high tier) in the buckets followed by its postings in the segments,
+    as `merge()` returns it along with its size in bytes. The merged list is
+    cached per generation of the index (see Index.generation), so it is only
+    merged again once a document is added or a segment is flushed.
+    """
+    index = _index()
+    if not any(token in segment for segment in index.segments):
+        return None
+    generation = index.generation() # before merging (see queryproc._evaluate_cached)
+
+    # keyed by a tuple so that the keys never collide with get_postings;
+    # the entry is replaced once it is outdated
+    key = ('merged', kind, token)
+    cached = _cache_get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    merged, nbytes = merge()
+    _cache_put(key, (generation, merged), nbytes)
+    return merged
 
 
-@functools.lru_cache(maxsize=256)
 def get_postings(token):
     """Returns a list of postings associated with the token.
     Each posting list is sorted by ascending docID.
     See 'lib/posting.py' for the Posting interface.
     """
-    if not token:
+    def merge():
+        postings = _index_postings(token) + _segment_postings(token)
+        return postings, postings_nbytes(postings)
+
+    merged = _merged('postings', token, merge)
+    return merged if merged is not None else _index_postings(token)
+
+
+def _index_postings(token):
+    """Returns the postings list of the token in the buckets
+    (excluding the segments).
+    """
+    seeker = _get_seeker(token)
+    if seeker is None:
         return []
+
+    postings = _cache_get(token)
+    if postings is not None:
+        return postings
+
     bid = min(ord(token[0]), 128)
+    postings = _read_postings(_index().buckets[bid], seeker[0])
+    _cache_put(token, postings, postings_nbytes(postings))
+
+    return postings
+
+
+def get_postings_range(token, lo, hi):
+    """Returns the postings of the token with lo <= docid < hi
+    (sorted by ascending docID).
+
+    Unless the postings list is cached, only the postings in the range
+    are decoded: bitmap postings lists are sliced (see get_bitmap_postings)
+    and the others are binary searched in the bucket file.
+    """
+    postings = _index_postings_range(token, lo, hi)
+    for segment in _index().segments:
+        if token in segment and segment.first_docid < hi and segment.next_docid() > lo:
+            postings = postings + segment.postings_range(token, lo, hi)
+    return postings
 
-    seekbucket = _INDEX_SEEK.get(bid, None)
-    if not seekbucket:
-        return []
 
-    seekoffset = seekbucket.get(token, None)
-    if not seekoffset:
+def _index_postings_range(token, lo, hi):
+    """Returns the postings of the token in the buckets with lo <= docid < hi.
+    """
+    seeker = _get_seeker(token)
+    if seeker is None or lo > _index().last_docid:
         return []
 
-    global _INDEX_BUCKETS
+    postings = _cache_get(token)
+    if postings is not None:
+        return postings[bisect_left(postings, lo, key=_docid_key):bisect_left(postings, hi, key=_docid_key)]
 
-    bucketfh = _INDEX_BUCKETS[bid]
-    bucketfh.seek(seekoffset, 0)
+    bitmap = _index_bitmap_postings(token)
+    if bitmap is not None:
+        return bitmap.postings_range(lo, hi)
 
-    num_postings, _ = u32_rd(bucketfh)
-    postings = []
+    bid = min(ord(token[0]), 128)
+    fh = BufferCursor(_index().buckets[bid], seeker[0])
+    num_postings, _ = u32_rd(fh)
+    base = seeker[0] + 4
 
-    for _ in range(num_postings):
-        posting, _ = sposting_rd(bucketfh)
-        postings.append(posting)
+    def _first_at_least(docid):
+        left, right = 0, num_postings
+        while left < right:
+            mid = (left + right) // 2
+            fh.seek(base + mid * SPOSTING_SIZE, 0)
+            mid_docid, _ = u64_rd(fh)
+            if mid_docid < docid:
+                left = mid + 1
+            else:
+                right = mid
+        return left
 
-    return postings
+    start = _first_at_least(lo)
+    end = _first_at_least(hi)
+    fh.seek(base + start * SPOSTING_SIZE, 0)
+    return [sposting_rd(fh)[0] for _ in range(end - start)]
+
+
+def get_bitmap_postings(token):
+    """Returns the postings list of the token as BitmapPostings
+    (see lib/bitmap.py) if it is stored as a bitmap, that is if the
+    token is dense, or None otherwise.
+
+    Bitmap postings lists are intersected with bitwise operations
+    and a posting is found by its docid without a search.
+    The postings of the token in the segments are added to the bitmap.
+    """
+    bitmap = _index_bitmap_postings(token)
+    if bitmap is None:
+        return None
+
+    def merge():
+        bits = bytearray(bitmap.bits)
+        side = bytearray(bitmap.side)
+        for segment in _index().segments:
+            segment.extend_bitmap(token, bits, side)
+        merged = BitmapPostings(bytes(bits), bytes(side))
+        return merged, merged.nbytes()
+
+    merged = _merged('bitmap', token, merge)
+    return merged if merged is not None else bitmap
+
+
+def _index_bitmap_postings(token):
+    """Returns the bitmap postings list of the token in the buckets
+    or None (see get_bitmap_postings).
+    """
+    index = _index()
+    seeker = _get_seeker(token)
+    if seeker is None or not is_dense(seeker[1], index.nonempty_doc_cnt):
+        return None
+
+    # keyed by a tuple so that the keys never collide with get_postings
+    key = ('bitmap', token)
+    bitmap = _cache_get(key)
+    if bitmap is not None:
+        return bitmap
+
+    if _SHARED_CACHE is not None:
+        bitmap = _shared_bitmap(token)
+        if bitmap is not None:
+            _cache_put(key, bitmap, bitmap.nbytes())
+            return bitmap
+
+    bid = min(ord(token[0]), 128)
+    fh = BufferCursor(index.buckets[bid], seeker[0])
+    num_postings, _ = u32_rd(fh)
+    if not num_postings & BITMAP_FLAG:
+        return None
+    bitmap, _ = sbitmap_rd(fh, num_postings & ~BITMAP_FLAG)
+    if _SHARED_CACHE is not None:
+        bitmap = _shared_bitmap(token, bitmap)
+    _cache_put(key, bitmap, bitmap.nbytes())
+
+    return bitmap
+
+
+def get_champions():
+    """Returns the size of the high tier (champion list) per token
+    or 0 if the index has no high tier.
+    """
+    return _index().champions
+
+
+def get_champion_postings(token):
+    """Returns the high tier of the token's postings along with the
+    number of postings in the full postings list (document frequency).
+    The high tier holds the top postings by tf * importance * static quality
+    and is sorted by ascending docID.
+
+    If the index has no high tier or the postings list is short enough,
+    the high tier is the full postings list. The postings of the token
+    in the segments are always in the high tier.
+    """
+    if not token:
+        return [], 0
+    bid = min(ord(token[0]), 128)
+
+    index = _index()
+    champseeker = index.champ_seek.get(bid, {}).get(token, None)
+    if champseeker is None:
+        postings = get_postings(token)
+        return postings, len(postings)
+
+    # the high tier shares the cache with the full postings lists
+    # (keyed by a tuple so that the keys never collide)
+    key = ('champ', token)
+    postings = _cache_get(key)
+    if postings is None:
+        postings = _read_postings(index.champ_buckets[bid], champseeker[0])
+        _cache_put(key, postings, postings_nbytes(postings))
+
+    def merge():
+        segment_postings = _segment_postings(token)
+        merged = postings + segment_postings
+        return (merged, champseeker[1] + len(segment_postings)), postings_nbytes(merged)
+
+    merged = _merged('champ', token, merge)
+    return merged if merged is not None else (postings, champseeker[1])
+
+
+def enable_ingestion(flush_bytes):
+    """Enables adding documents to the index (see add_document).
+    The live segment is flushed to the segments directory (given to
+    initialize) once its postings and docinfo take `flush_bytes`.
+    """
+    global _FLUSH_BYTES
+    assert _initialized, "call reader.initialize() before calling this"
+    index = _CURRENT
+    assert index.segments_dir, "initialize the reader with a segments directory"
+    os.makedirs(index.segments_dir, exist_ok=True)
+    with _INGEST_LOCK:
+        _FLUSH_BYTES = flush_bytes
+        if not index.segments or index.segments[-1].frozen:
+            index.segments += (Segment(index.next_docid()),)
+
+
+def add_document(url, terms, total_tokens, biword_counts=None):
+    """Adds the document at the URL to the live segment, so that it is
+    searched at once. `terms` maps each token of the document to its
+    (tf, important) and `biword_counts` maps its biwords to their tf
+    (see analyze.page_terms); only the biwords already indexed are kept.
+    Returns the docid of the document, or None if the URL is already indexed.
+
+    The idf of the tokens are those of the index when the document is
+    added (for its norm and its impacts), and the document has no
+    static quality (PageRank and HITS scores of 0), so the docids stay
+    ordered by static quality (see is_quality_ordered).
+    """
+    assert _FLUSH_BYTES is not None, "call reader.enable_ingestion() before calling this"
+    with _INGEST_LOCK:
+        index = _CURRENT
+        if url in index.docinfo_links_index or any(url in segment.urls for segment in index.segments):
+            return None
+        live = index.segments[-1]
+        docid = live.next_docid()
+
+        with _pinned(index):
+            num_docs = get_num_nonempty_documents() + 1
+            postings = {}
+            sq_norm = 0.0
+            for token, (tf, important) in terms.items():
+                score = tf / total_tokens * importance[important]
+                idf = term_idf(get_term_stats(token)[0] + 1, num_docs)
+                sq_norm += (score * idf) ** 2
+                impact = quantize_impact(score * idf, index.impact_scale) if has_impacts() else 0
+                postings[token] = (tf, posting_bits(Posting(docid, tf, important, impact)), score)
+            for token, tf in (biword_counts or {}).items():
+                if get_term_stats(token)[0]:
+                    postings[token] = (tf, posting_bits(Posting(docid, tf)), tf / total_tokens * importance[0])
+
+        live.add(Document(
+            docid=docid,
+            url=url,
+            total_tokens=total_tokens,
+            pr_quality=0.0,
+            hub_quality=0.0,
+            auth_quality=0.0,
+            norm=math.sqrt(sq_norm),
+        ), postings)
+        if live.nbytes >= _FLUSH_BYTES:
+            _flush_segment(index)
+        return docid
+
+
+def _flush_segment(index):
+    """Writes the live segment of the index (if it has documents)
+    to the segments directory and starts a new live segment.
+    The caller must hold _INGEST_LOCK.
+    """
+    if not index.segments or index.segments[-1].frozen or not len(index.segments[-1]):
+        return
+    live = index.segments[-1]
+    live.save(segment_filename(index.segments_dir, live.first_docid))
+    index.segments = index.segments[:-1] + (live, Segment(live.next_docid()))
+
+
+def flush_segment():
+    """Flushes the live segment to disk (i.e. before exiting,
+    since the documents of the live segment are only kept in memory).
+    """
+    if _FLUSH_BYTES is None:
+        return
+    with _INGEST_LOCK:
+        _flush_segment(_CURRENT)
+
+
+def has_unflushed_documents():
+    """Returns True if documents were added to the live segment,
+    which only this process can read (not the worker processes).
+    """
+    segments = _index().segments
+    return bool(segments) and not segments[-1].frozen and len(segments[-1]) > 0
+
+
+def get_segment_stats():
+    """Returns the number of segments and of their documents,
+    and the size of the live segment (or None if documents cannot be added).
+    """
+    if _FLUSH_BYTES is None:
+        return None
+    segments = _index().segments
+    live = segments[-1] if segments and not segments[-1].frozen else None
+    return {
+        "flushed_segments": len(segments) - (live is not None),
+        "documents": sum(len(segment) for segment in segments),
+        "live_documents": len(live) if live is not None else 0,
+        "live_bytes": live.nbytes if live is not None else 0,
+        "flush_bytes": _FLUSH_BYTES,
+    }
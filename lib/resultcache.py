@@ -0,0 +1,206 @@
+# lib/resultcache.py
+#
+# cache for query results (top k docids and scores)
+#
+# entries are keyed by the normalized query, that is the multiset
+# of its stemmed/pruned terms (see queryproc.query_key), so queries
+# that only differ in case or spacing share the same entry
+#
+# an entry holds the results of the query evaluated for a number of results
+# (its depth, the rank of the last result requested); it answers requests of
+# any smaller depth (i.e. fewer results or an earlier page) with the top of
+# its results, and requests of any greater depth once every matched document
+# is ranked (the entry is complete)
+#
+# the high tier, the biwords and top-k retrieval decide on their candidates
+# by the depth, so the top of a deeper entry may differ slightly from the
+# results of evaluating the query for fewer results
+#
+# the cache is bounded by memory and evicts entries using LFU with
+# dynamic aging (see lib/versionedcache.py): an entry's priority is the
+# cache age plus its hit count, and the age increases to the priority of
+# each evicted entry, so popular entries stay but entries that are no
+# longer hit eventually age out
+#
+# the entries are dropped whenever the index version changes (results of
+# queries evaluated on an older version of the index are not cached)
+
+import os
+import struct
+from array import array
+from lib.structs import *
+from lib.versionedcache import VersionedCache
+
+RCACHE_VER = 2
+
+_ENTRY_OVERHEAD = 256 # estimated bytes per entry (excluding arrays and terms)
+
+
+class _Entry:
+    __slots__ = ('docids', 'scores', 'total', 'depth', 'freq', 'priority', 'nbytes')
+
+    def __init__(self, docids, scores, total, depth, freq=1):
+        self.docids = docids
+        self.scores = scores
+        self.total = total
+        self.depth = depth
+        self.freq = freq
+        self.priority = 0.0
+        self.nbytes = 0
+
+
+class _FileCursor(BufferCursor):
+    """Cursor over the bytes of a cache file, which raises ValueError
+    if the file ends before a read does (the file is truncated).
+    """
+    def read(self, size=-1):
+        data = super().read(size)
+        if 0 <= size != len(data):
+            raise ValueError("truncated file")
+        return data
+
+
+def _key_nbytes(key):
+    """Returns the estimated size of a key (mode, ((term, count), ...)).
+    """
+    return sum(len(term) + 16 for term, _ in key[1])
+
+
+def _array_nbytes(arr):
+    """Returns the number of bytes used by the items of the array.
+    """
+    return arr.itemsize * len(arr)
+
+
+class ResultCache(VersionedCache):
+    """Thread-safe cache of ranked query results bounded by `max_bytes`.
+    If a filename is specified, the cache is loaded from the file
+    and can be saved to it.
+    """
+    def __init__(self, max_bytes, index_version, filename=None):
+        super().__init__(max_bytes, index_version)
+        self.filename = filename
+
+        if filename and os.path.isfile(filename):
+            self.load()
+
+    def _priority(self, entry):
+        return entry.freq
+
+    def get(self, key, depth, index_version):
+        """Returns the top `depth` results of the query as a list
+        of (docid, score) pairs along with the total number of matches,
+        or None if the cache does not have the results of the query
+        evaluated for at least `depth` results (or for every result).
+        """
+        with self._lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key, None)
+            if entry is None or depth > entry.depth and len(entry.docids) == entry.depth:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.freq += 1
+            self._touch(key, entry)
+            n = min(depth, len(entry.docids))
+            return list(zip(entry.docids[:n], entry.scores[:n])), entry.total
+
+    def put(self, key, depth, results, total, index_version):
+        """Caches the ranked (docid, score) results of the query evaluated
+        for `depth` results (fewer results are every matched document).
+        The results of the query evaluated for a greater depth are kept.
+        """
+        docids = array('Q', (docid for docid, _ in results))
+        scores = array('d', (float(score) for _, score in results))
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            previous = self._entries.get(key, None)
+            if previous is not None and previous.depth >= depth:
+                return # cached meanwhile
+            self._pop(key)
+            self._insert(key, _Entry(docids, scores, total, depth, previous.freq if previous is not None else 1))
+
+    def _insert(self, key, entry):
+        entry.nbytes = (_ENTRY_OVERHEAD + _key_nbytes(key)
+            + _array_nbytes(entry.docids) + _array_nbytes(entry.scores))
+        super()._insert(key, entry)
+
+    def save(self):
+        """Saves the cache to its file (see lib/spec.md).
+        The file is replaced atomically.
+        """
+        if not self.filename:
+            return
+        with self._lock:
+            seq = bytearray()
+            seq.extend(u8_repr(RCACHE_VER))
+            seq.extend(u64_repr(self.index_version))
+            seq.extend(u32_repr(len(self._entries)))
+            for (mode, terms), entry in self._entries.items():
+                seq.extend(u8_repr(mode))
+                seq.extend(u32_repr(len(terms)))
+                for term, count in terms:
+                    seq.extend(sstr_repr(term))
+                    seq.extend(u32_repr(count))
+                seq.extend(u32_repr(entry.freq))
+                seq.extend(u64_repr(entry.total))
+                seq.extend(u32_repr(entry.depth))
+                seq.extend(u32_repr(len(entry.docids)))
+                for docid, score in zip(entry.docids, entry.scores):
+                    seq.extend(u64_repr(docid))
+                    seq.extend(f64_repr(score))
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as cachefh:
+            cachefh.write(seq)
+        os.replace(tmp_filename, self.filename)
+
+    def load(self):
+        """Loads the cache from its file if the file was saved
+        with the same index version. Otherwise, or if the file is
+        truncated or corrupt, the file is ignored.
+        """
+        with open(self.filename, 'rb') as cachefh:
+            cachefh = _FileCursor(cachefh.read())
+        try:
+            entries = self._read_entries(cachefh)
+        except (ValueError, struct.error) as e:
+            print(f"Ignored the result cache file {self.filename}: {e}")
+            return
+        with self._lock:
+            for key, entry in entries:
+                self._insert(key, entry)
+
+    def _read_entries(self, cachefh):
+        """Returns the (key, entry) pairs of the cache file
+        (none if it was saved with another index version).
+        """
+        version, _ = u8_rd(cachefh)
+        index_version, _ = u64_rd(cachefh)
+        if version != RCACHE_VER or index_version != self.index_version:
+            return [] # outdated cache file
+
+        entries = []
+        num_entries, _ = u32_rd(cachefh)
+        for _ in range(num_entries):
+            mode, _ = u8_rd(cachefh)
+            num_terms, _ = u32_rd(cachefh)
+            terms = tuple((sstr_rd(cachefh)[0], u32_rd(cachefh)[0]) for _ in range(num_terms))
+            freq, _ = u32_rd(cachefh)
+            total, _ = u64_rd(cachefh)
+            depth, _ = u32_rd(cachefh)
+            num_results, _ = u32_rd(cachefh)
+            docids = array('Q')
+            scores = array('d')
+            for _ in range(num_results):
+                docids.append(u64_rd(cachefh)[0])
+                scores.append(f64_rd(cachefh)[0])
+            if len(docids) > depth:
+                raise ValueError("more results than the depth of an entry")
+            entries.append(((mode, terms), _Entry(docids, scores, total, depth, freq)))
+        if cachefh.tell() != len(cachefh.buf):
+            raise ValueError("trailing bytes")
+        return entries
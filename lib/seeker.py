@@ -0,0 +1,51 @@
+# lib/seeker.py
+#
+# seeker class (term dictionary entry of a bucket's seek file)
+
+from lib.structs import *
+
+class Seeker:
+    def __init__(
+        self,
+        token=None,
+        offset=None,
+        doc_freq=0,
+        coll_freq=0,
+        max_score=0.0,
+    ):
+        self.token = token
+        self.offset = offset        # offset of the postings list in the bucket
+        self.doc_freq = doc_freq    # number of postings (documents)
+        self.coll_freq = coll_freq  # sum of tf over the postings
+        self.max_score = max_score  # max(tf / total_tokens * importance)
+
+
+def sseeker_rd(fh):
+    """read struct seeker
+    """
+    token, token_rdsize = sstr_rd(fh)
+    offset, _ = u32_rd(fh)
+    doc_freq, _ = u32_rd(fh)
+    coll_freq, _ = u64_rd(fh)
+    max_score, _ = f32_rd(fh)
+    return Seeker(
+        token=token,
+        offset=offset,
+        doc_freq=doc_freq,
+        coll_freq=coll_freq,
+        max_score=max_score,
+    ), token_rdsize + 20
+
+
+def sseeker_repr(obj):
+    """byte repr of struct seeker
+    """
+    seq = bytearray()
+
+    seq.extend(sstr_repr(obj.token))
+    seq.extend(u32_repr(obj.offset))
+    seq.extend(u32_repr(obj.doc_freq))
+    seq.extend(u64_repr(obj.coll_freq))
+    seq.extend(f32_repr(obj.max_score))
+
+    return bytes(seq)
@@ -0,0 +1,275 @@
+# lib/segment.py
+#
+# near-real-time segments
+#
+# documents added to a running search engine (see reader.add_document) are
+# indexed in memory into the live segment: the postings of each token are
+# kept in arrays of their docids, tfs and fields bits, next to the docinfo
+# of the segment's documents, so a document can be searched as soon as it
+# is added; the docids of a segment follow every docid of the index and of
+# the segments before it, so the postings of the segments are appended to
+# the postings lists of the index as they are
+#
+# once the live segment reaches a size threshold, it is written to disk as
+# an immutable segment file (see Segment.save) and a new live segment is
+# started; the segment files are loaded along with the index
+#
+# layout of a segment file (see lib/spec.md):
+#   u8 version, u64 first docid, u32 number of documents, struct document *
+#   u32 number of tokens, then per token:
+#     sstr token, u32 doc freq, u32 coll freq, f32 max score,
+#     u64 docid * doc freq, u32 tf * doc freq, u32 fields bits * doc freq
+
+import os
+import sys
+import glob
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from lib.structs import *
+from lib.posting import *
+from lib.document import *
+
+SEGMENT_VER = 1
+
+# bytes per posting and per document of a segment (for the size threshold)
+_POSTING_BYTES = 16
+_DOCUMENT_BYTES = 128
+
+_SIDE = struct.Struct('<II') # (tf, fields bits) per posting of a bitmap
+
+
+def _le(values):
+    """Returns the array with its items in little-endian byte order.
+    """
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class _TermPostings:
+    """Postings of a token in a segment, as parallel arrays."""
+    __slots__ = ('docids', 'tfs', 'bits', 'coll_freq', 'max_score', 'max_impact')
+
+    def __init__(self):
+        self.docids = array('Q')
+        self.tfs = array('I')
+        self.bits = array('I')
+        self.coll_freq = 0
+        self.max_score = 0.0
+        self.max_impact = 0
+
+
+class Segment:
+    """Documents (with docids from `first_docid`) and postings lists of
+    a segment. The live segment is mutable (see add); a flushed segment
+    is frozen. A segment can be read by any number of threads while
+    documents are added to it.
+    """
+    def __init__(self, first_docid):
+        self.first_docid = first_docid
+        self.documents = []     # Document of each docid from first_docid
+        self.urls = set()
+        self.frozen = False
+        self.nbytes = 0         # estimated size of the postings and docinfo
+
+        self._terms = {}        # token -> _TermPostings
+        self._lists = {}        # token -> postings list (decoded on demand while live)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, token):
+        return token in self._terms
+
+    def next_docid(self):
+        return self.first_docid + len(self.documents)
+
+    def add(self, document, postings):
+        """Adds the document (whose docid must be next_docid()) and its
+        postings, a dict of token -> (tf, fields bits, score) where
+        score is tf / total_tokens * importance.
+        """
+        assert not self.frozen, "cannot add documents to a flushed segment"
+        with self._lock:
+            assert document.docid == self.next_docid()
+            # the document is visible before its postings
+            self.documents.append(document)
+            self.urls.add(document.url)
+            for token, (tf, bits, score) in postings.items():
+                term = self._terms.get(token)
+                if term is None:
+                    term = self._terms[token] = _TermPostings()
+                term.docids.append(document.docid)
+                term.tfs.append(tf)
+                term.bits.append(bits)
+                term.coll_freq += tf
+                term.max_score = max(term.max_score, score)
+                term.max_impact = max(term.max_impact, bits >> 8 & 0xFF)
+                self._lists.pop(token, None)
+            self.nbytes += _DOCUMENT_BYTES + _POSTING_BYTES * len(postings)
+
+    def document(self, docid):
+        """Returns the Document of the docid (which must be in the segment).
+        """
+        return self.documents[docid - self.first_docid]
+
+    def term_stats(self, token):
+        """Returns the (doc_freq, coll_freq, max_score) of the token
+        in the segment.
+        """
+        term = self._terms.get(token)
+        if term is None:
+            return 0, 0, 0.0
+        with self._lock:
+            return len(term.docids), term.coll_freq, term.max_score
+
+    def max_impact(self, token):
+        """Returns the largest impact of the token's postings in the segment.
+        """
+        term = self._terms.get(token)
+        return term.max_impact if term is not None else 0
+
+    def postings(self, token):
+        """Returns the postings list of the token in the segment
+        (sorted by ascending docid). Do not modify it.
+
+        The lists of the live segment are kept until a document with the
+        token is added; the lists of a flushed segment are decoded on every
+        call (the reader caches them in its postings cache).
+        """
+        if token not in self._terms:
+            return []
+        postings = self._lists.get(token)
+        if postings is None:
+            with self._lock:
+                term = self._terms[token]
+                postings = [
+                    posting_from_bits(docid, tf, bits)
+                    for docid, tf, bits in zip(term.docids, term.tfs, term.bits)
+                ]
+                if not self.frozen:
+                    self._lists[token] = postings
+        return postings
+
+    def postings_range(self, token, lo, hi):
+        """Returns the postings of the token with lo <= docid < hi.
+        """
+        term = self._terms.get(token)
+        if term is None:
+            return []
+        with self._lock:
+            start = bisect_left(term.docids, lo)
+            end = bisect_left(term.docids, hi)
+            return [
+                posting_from_bits(term.docids[i], term.tfs[i], term.bits[i])
+                for i in range(start, end)
+            ]
+
+    def extend_bitmap(self, token, bits, side):
+        """Sets the docids of the token's postings in `bits` and appends
+        their (tf, fields bits) to `side` (see BitmapPostings).
+        """
+        term = self._terms.get(token)
+        if term is None:
+            return
+        with self._lock:
+            size = (term.docids[-1] >> 3) + 1
+            if len(bits) < size:
+                bits.extend(bytes((size - len(bits) + 7) // 8 * 8)) # whole words
+            for docid, tf, fields_bits in zip(term.docids, term.tfs, term.bits):
+                bits[docid >> 3] |= 1 << (docid & 7)
+                side.extend(_SIDE.pack(tf, fields_bits))
+
+    def save(self, filename):
+        """Writes the segment to the file and freezes it.
+        The file is replaced at once, so readers never see it partially written.
+        """
+        with self._lock:
+            self.frozen = True
+            self._lists.clear()
+            with open(f"{filename}.tmp", 'wb') as fh:
+                fh.write(u8_repr(SEGMENT_VER))
+                fh.write(u64_repr(self.first_docid))
+                fh.write(u32_repr(len(self.documents)))
+                for document in self.documents:
+                    fh.write(sdocument_repr(document))
+                fh.write(u32_repr(len(self._terms)))
+                for token in sorted(self._terms):
+                    term = self._terms[token]
+                    fh.write(sstr_repr(token))
+                    fh.write(u32_repr(len(term.docids)))
+                    fh.write(u32_repr(term.coll_freq))
+                    fh.write(f32_repr(term.max_score * (1 + 1e-6))) # round up past f32 precision
+                    for values in (term.docids, term.tfs, term.bits):
+                        fh.write(_le(values).tobytes())
+            os.replace(f"{filename}.tmp", filename)
+
+
+def load_segment(filename):
+    """Reads a segment file (see Segment.save). Returns the frozen Segment.
+    """
+    with open(filename, 'rb') as fh:
+        version, _ = u8_rd(fh)
+        assert version == SEGMENT_VER, f"segment {filename} is outdated"
+        first_docid, _ = u64_rd(fh)
+        segment = Segment(first_docid)
+        num_documents, _ = u32_rd(fh)
+        for _ in range(num_documents):
+            document, _ = sdocument_rd(fh)
+            segment.documents.append(document)
+            segment.urls.add(document.url)
+        num_tokens, _ = u32_rd(fh)
+        for _ in range(num_tokens):
+            token, _ = sstr_rd(fh)
+            doc_freq, _ = u32_rd(fh)
+            term = segment._terms[token] = _TermPostings()
+            term.coll_freq, _ = u32_rd(fh)
+            term.max_score, _ = f32_rd(fh)
+            for values, itemsize in ((term.docids, 8), (term.tfs, 4), (term.bits, 4)):
+                values.frombytes(fh.read(itemsize * doc_freq))
+                if sys.byteorder == 'big':
+                    values.byteswap()
+            term.max_impact = max(bits >> 8 & 0xFF for bits in term.bits) if doc_freq else 0
+            segment.nbytes += _POSTING_BYTES * doc_freq
+        segment.nbytes += _DOCUMENT_BYTES * num_documents
+    segment.frozen = True
+    return segment
+
+
+def segment_filename(segments_dir, first_docid):
+    return os.path.join(segments_dir, f"{first_docid}.seg")
+
+
+def load_segments(segments_dir, last_docid, urls=()):
+    """Reads the segment files of the directory, in docid order.
+
+    A segment whose docids do not follow `last_docid` (the last docid of
+    the index, then of the segment before it) was flushed before the index
+    was rebuilt. It is dropped (and logged) if the index already has every
+    one of its documents, that is if `urls` (the URLs of the index) has
+    every URL of the segment. Otherwise, dropping it would lose documents,
+    so ValueError is raised.
+    """
+    segments = []
+    if not segments_dir or not os.path.isdir(segments_dir):
+        return segments
+    for path in sorted(glob.glob("*.seg", root_dir=segments_dir), key=lambda path: int(path[:-4])):
+        segment = load_segment(os.path.join(segments_dir, path))
+        if not segment.documents:
+            continue
+        if segment.first_docid <= last_docid:
+            missing = sorted(url for url in segment.urls if url not in urls)
+            if missing:
+                raise ValueError(f"segment {path} (docids {segment.first_docid} to {segment.next_docid() - 1})"
+                    f" overlaps docids up to {last_docid}, and {len(missing)} of its documents are not in"
+                    f" the index (i.e. {', '.join(missing[:3])}); add them again, then delete the segment")
+            print(f"Dropped outdated segment {path}: its {len(segment)} documents are in the rebuilt index.",
+                file=sys.stderr)
+            continue
+        segments.append(segment)
+        last_docid = segment.next_docid() - 1
+    return segments
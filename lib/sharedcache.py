@@ -0,0 +1,214 @@
+# lib/sharedcache.py
+#
+# cache of decoded postings lists shared by forked processes
+#
+# the cache is an arena in a file of shared memory (in /dev/shm) that every
+# server process maps, so every process sees the same entries: a list
+# decoded by one process is used by every other process without being
+# read, decoded or stored again
+#
+# the arena is append-only: entries are never moved or overwritten, so
+# readers take no lock and use the values in place (as memoryviews) while
+# writers are serialized by a lock (created before the processes are
+# forked); once the arena (or its index) is full, new lists are no longer
+# shared (the processes keep them privately)
+#
+# each version of the index has an arena of its own (see open_shared_cache):
+# once a process opens the arena of a new version, the files of the older
+# arenas are removed, so their memory is freed as soon as the last process
+# still reading an older version unmaps it
+#
+# layout: header, index, entries
+#   header: u64 end of the entries, u64 number of entries
+#   index:  open-addressed slots of (u64 key hash, u64 entry offset, u64 value size);
+#           a slot is published by writing its key hash last (0 is empty)
+#   entry:  u32 key size, key, value
+
+import os
+import glob
+import mmap
+import struct
+import hashlib
+import tempfile
+
+_HEADER = struct.Struct('<QQ')
+_SLOT = struct.Struct('<QQQ')
+_ENTRY = struct.Struct('<I')
+
+_SLOT_BYTES = 4096      # bytes of arena per index slot
+_MIN_SLOTS = 1024
+_MAX_LOAD = 0.75        # max fraction of the index slots in use
+
+
+def _key_hash(key):
+    """Returns the (non-zero) 64-bit hash of the key, which unlike hash()
+    is the same in every process.
+    """
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), byteorder='little') or 1
+
+
+def shared_cache_prefix():
+    """Returns the path prefix of the arena files of this process
+    (in shared memory if the system has /dev/shm).
+    """
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(shm_dir, f"searchengine-{os.getpid()}-postings-")
+
+
+def _arena_versions(prefix):
+    versions = []
+    for path in glob.glob(glob.escape(prefix) + "*"):
+        try:
+            versions.append((int(path[len(prefix):]), path))
+        except ValueError:
+            pass
+    return versions
+
+
+def open_shared_cache(prefix, max_bytes, lock, version):
+    """Returns the shared cache of the index version (see SharedPostingCache),
+    creating its arena if no process has yet, or None if the arena of a newer
+    version exists (the version is outdated, so its lists are not shared).
+    The arenas of older versions are removed.
+    """
+    path = f"{prefix}{version}"
+    with lock:
+        versions = _arena_versions(prefix)
+        if not os.path.exists(path) and any(other > version for other, _ in versions):
+            return None
+        cache = SharedPostingCache(max_bytes, path, lock)
+        for other, other_path in versions:
+            if other < version:
+                remove_shared_cache(other_path)
+    return cache
+
+
+def remove_shared_cache(path):
+    """Removes the file of an arena (its memory is freed once every
+    process has unmapped it).
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_shared_caches(prefix):
+    """Removes the files of every arena with the prefix (i.e. on exit).
+    """
+    for _, path in _arena_versions(prefix):
+        remove_shared_cache(path)
+
+
+class SharedPostingCache:
+    """Append-only cache of byte values (keyed by bytes) in the shared
+    memory file at `path` (created if it does not exist), bounded by
+    `max_bytes`. Writers are serialized by `lock`, a multiprocessing lock
+    created before the processes that share the cache are forked.
+    """
+    def __init__(self, max_bytes, path, lock):
+        self.max_bytes = max_bytes
+        self.path = path
+        self._num_slots = max(_MIN_SLOTS, max_bytes // _SLOT_BYTES)
+        self._data_start = _HEADER.size + _SLOT.size * self._num_slots
+        size = self._data_start + max_bytes
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # the pages are only allocated once they are written
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._buf = mmap.mmap(fd, size) # MAP_SHARED
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._buf)
+        self._lock = lock
+
+        # stats of the calling process
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+
+    def _find(self, key, h):
+        """Returns (slot index, value view) of the key, where the view
+        is None if the key is not cached and the index is the empty slot
+        it would be published to (or None if the index is full).
+        """
+        for probe in range(self._num_slots):
+            i = (h + probe) % self._num_slots
+            slot_hash, offset, size = _SLOT.unpack_from(self._buf, _HEADER.size + i * _SLOT.size)
+            if slot_hash == 0:
+                return i, None
+            if slot_hash == h:
+                key_size, = _ENTRY.unpack_from(self._buf, offset)
+                start = offset + _ENTRY.size
+                if key_size == len(key) and self._view[start:start + key_size] == key:
+                    return i, self._view[start + key_size:start + key_size + size].toreadonly()
+        return None, None
+
+    def get(self, key):
+        """Returns the value of the key as a read-only memoryview
+        (valid for the lifetime of the process) or None.
+        """
+        _, value = self._find(key, _key_hash(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, *parts):
+        """Caches the concatenation of the byte parts under the key.
+        Returns the cached value (see get) or None if the cache is full.
+        """
+        h = _key_hash(key)
+        size = sum(len(part) for part in parts)
+        with self._lock:
+            i, value = self._find(key, h)
+            if value is not None:
+                return value # cached by another process meanwhile
+
+            end, num_entries = _HEADER.unpack_from(self._buf, 0)
+            offset = self._data_start + end
+            entry_size = _ENTRY.size + len(key) + size
+            if (i is None or num_entries + 1 > _MAX_LOAD * self._num_slots
+                    or offset + entry_size > len(self._buf)):
+                self.rejections += 1
+                return None
+
+            # write the entry, then the header, then publish the slot
+            _ENTRY.pack_into(self._buf, offset, len(key))
+            position = offset + _ENTRY.size
+            self._buf[position:position + len(key)] = key
+            position += len(key)
+            for part in parts:
+                self._buf[position:position + len(part)] = part
+                position += len(part)
+            _HEADER.pack_into(self._buf, 0, end + entry_size, num_entries + 1)
+            slot = _HEADER.size + i * _SLOT.size
+            struct.pack_into('<QQ', self._buf, slot + 8, offset, size)
+            struct.pack_into('<Q', self._buf, slot, h)
+
+        value_start = offset + _ENTRY.size + len(key)
+        return self._view[value_start:value_start + size].toreadonly()
+
+    def close(self):
+        """Unmaps the arena (once the values read from it are released).
+        """
+        self._view.release()
+        try:
+            self._buf.close()
+        except BufferError:
+            pass # still exported (unmapped once collected)
+
+    def stats(self):
+        end, num_entries = _HEADER.unpack_from(self._buf, 0)
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "rejections": self.rejections,
+            "entries": num_entries,
+            "bytes": end,
+            "max_bytes": self.max_bytes,
+        }
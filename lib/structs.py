@@ -4,6 +4,35 @@
 
 import struct
 
+
+class BufferCursor:
+    """Read-only file-like cursor over a buffer (i.e. a memory map of a file).
+    Every cursor has its own position, so any number of threads can read
+    the same buffer concurrently.
+    """
+    def __init__(self, buf, offset=0):
+        self.buf = buf
+        self.pos = offset
+
+    def read(self, size=-1):
+        end = len(self.buf) if size < 0 else self.pos + size
+        data = self.buf[self.pos:end]
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = len(self.buf) + offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
 def sstr_rd(fh):
     """read struct str
     """
@@ -67,3 +96,15 @@ def f32_repr(obj):
     return struct.pack('<f', obj)
 
 
+
+
+def f64_rd(fh):
+    """read f64
+    """
+    return struct.unpack('<d', fh.read(8))[0], 8
+
+
+def f64_repr(obj):
+    """byte repr of f64
+    """
+    return struct.pack('<d', obj)
@@ -61,3 +61,31 @@ def stem_tokens(tokens):
     # https://www.geeksforgeeks.org/python-stemming-words-with-nltk/
     tokens[:] = map(lambda token: _stemmer.stem(token), tokens)
 
+
+
+# separates the terms of a biword (tokens never contain spaces)
+BIWORD_SEP = ' '
+
+
+def biword(first, second):
+    """Returns the biword token of two adjacent (stemmed) tokens.
+    """
+    return first + BIWORD_SEP + second
+
+
+def is_biword(token):
+    """Returns True if the token is a biword.
+    """
+    return BIWORD_SEP in token
+
+
+def biwords_of(tokens):
+    """Returns the biwords of the list of (stemmed) tokens in order,
+    that is every pair of adjacent alphanumeric tokens.
+    Pairs that are separated by punctuation are not biwords.
+    """
+    return [
+        biword(first, second)
+        for first, second in zip(tokens, tokens[1:])
+        if first.isalnum() and second.isalnum()
+    ]
@@ -0,0 +1,124 @@
+# lib/versionedcache.py
+#
+# base of the caches of values derived from the index (see lib/resultcache.py
+# and lib/intersectioncache.py)
+#
+# the cache is bounded by memory and evicts the entry of lowest priority,
+# where an entry's priority is the cache age plus a value of the entry
+# (see the _priority of each subclass) and the age increases to the
+# priority of each evicted entry, so entries that are no longer hit
+# eventually age out
+#
+# the entries are dropped whenever the index version changes
+
+import heapq
+import threading
+
+
+class VersionedCache:
+    """Thread-safe cache bounded by `max_bytes` of values derived from
+    the version `index_version` of the index. The entries must have
+    `priority` and `nbytes` attributes.
+
+    Subclasses define `_priority(entry)`, which returns the value of the
+    entry added to the cache age to prioritize it (higher priorities are
+    evicted last).
+    """
+    def __init__(self, max_bytes, index_version):
+        self.max_bytes = max_bytes
+        self.index_version = index_version
+
+        self._entries = {}
+        self._heap = [] # (priority, seq, key); lazily updated
+        self._seq = 0
+        self._age = 0.0
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, index_version):
+        """Drops the entries if the index version is newer. Returns False
+        if it is older, that is if the query was evaluated on an index that
+        has been reloaded since (see reader.reload_index).
+        """
+        if index_version < self.index_version:
+            return False
+        if index_version != self.index_version:
+            self._clear()
+            self.index_version = index_version
+            self.invalidations += 1
+        return True
+
+    def _clear(self):
+        self._entries.clear()
+        self._heap.clear()
+        self._age = 0.0
+        self._nbytes = 0
+
+    def _touch(self, key, entry):
+        entry.priority = self._age + self._priority(entry)
+        self._seq += 1
+        heapq.heappush(self._heap, (entry.priority, self._seq, key))
+
+        # drop outdated heap items once they pile up
+        if len(self._heap) > 4 * len(self._entries) + 64:
+            self._heap = [(e.priority, i, k) for i, (k, e) in enumerate(self._entries.items())]
+            heapq.heapify(self._heap)
+
+    def _evict(self):
+        while self._heap:
+            priority, _, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key, None)
+            if entry is None or entry.priority != priority:
+                continue # outdated heap item
+            del self._entries[key]
+            self._nbytes -= entry.nbytes
+            self._age = priority
+            self.evictions += 1
+            return
+
+    def _pop(self, key):
+        """Removes the entry of the key (if any) and returns it.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry.nbytes
+        return entry
+
+    def _insert(self, key, entry):
+        """Adds the entry (whose key is not cached), evicting entries
+        until it fits. An entry larger than the cache is not added.
+        """
+        if entry.nbytes > self.max_bytes:
+            return # never fits
+        while self._nbytes + entry.nbytes > self.max_bytes:
+            self._evict()
+        self._entries[key] = entry
+        self._nbytes += entry.nbytes
+        self._touch(key, entry)
+
+    def clear(self):
+        """Drops every entry (the stats are kept).
+        """
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """Returns the hit/miss and memory stats of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+            }
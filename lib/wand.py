@@ -0,0 +1,265 @@
+# lib/wand.py
+#
+# top-k retrieval using dynamic pruning
+# (WAND / weak AND for disjunctive queries)
+# and early termination on quality ordered indexes
+#
+# a document's score is its tfidf sum over the query terms,
+# each term's contribution is bounded by idf * max score (see reader)
+# so documents that cannot beat the k-th best score are skipped
+# without being scored
+#
+# if the docids are ordered by static quality (see reorder.py),
+# the score also mixes in the static quality of the document:
+#   net_relevance_factor * tfidf sum / sum of bounds
+#   + quality_factor * static quality / max static quality
+# since the static quality only decreases as the docids increase,
+# scanning stops once the remaining documents can't make the top k
+#
+# if the index stores impacts (see writer.write_impacts), a posting's
+# contribution is its impact instead, so scoring only sums small integers
+# and each term is bounded by its max impact
+#
+# if the query has a deadline (see lib/deadline.py), it is checked every
+# few steps and retrieval stops with the top k found so far once it passes
+
+import heapq
+from bisect import bisect_left
+from operator import attrgetter
+from lib.reader import get_postings, get_max_score, get_document, is_quality_ordered
+from lib.reader import has_impacts, get_max_impact
+from lib.document import static_quality
+from lib.deadline import CHECK_STEPS, deadline_expired
+from lib.params import importance, net_relevance_factor, quality_factor
+
+_docid_key = attrgetter('docid')
+
+
+class _Cursor:
+    """Iterates over the postings list of a single query term.
+    """
+    def __init__(self, token, postings, idf, impacts=False):
+        self.token = token
+        self.postings = postings
+        self.idf = idf
+        self.impacts = impacts
+        if impacts:
+            self.weight = 1 # scaled contribution per impact
+            self.upper_bound = get_max_impact(token)
+        else:
+            self.weight = idf # scaled contribution per (tf / total_tokens * importance)
+            self.upper_bound = idf * get_max_score(token)
+        self.pos = 0
+
+    def scale(self, factor):
+        self.weight *= factor
+        self.upper_bound *= factor
+
+    def docid(self):
+        return self.postings[self.pos].docid
+
+    def posting(self):
+        return self.postings[self.pos]
+
+    def exhausted(self):
+        return self.pos >= len(self.postings)
+
+    def next(self):
+        self.pos += 1
+
+    def seek(self, docid):
+        """Moves the cursor to the first posting with docid >= `docid`.
+        """
+        self.pos = bisect_left(self.postings, docid, lo=self.pos, key=_docid_key)
+
+    def contribution(self, document):
+        posting = self.posting()
+        if self.impacts:
+            return posting.fields['impact'] * self.weight
+        return (posting.tf / document.total_tokens * self.weight
+            * importance[posting.fields['important']])
+
+
+def _make_cursors(idfs):
+    """Returns the cursors of the tokens along with the static quality prior.
+    The prior is None unless the index is quality ordered, in which case
+    it maps a docid to its (scaled) static quality, which also bounds the
+    static quality of every later docid. The cursors are scaled to match.
+    """
+    cursors = []
+    impacts = has_impacts()
+    for token, idf in idfs.items():
+        postings = get_postings(token)
+        if postings:
+            cursors.append(_Cursor(token, postings, idf, impacts))
+
+    if not is_quality_ordered() or not cursors:
+        return cursors, None
+
+    total_bound = sum(cursor.upper_bound for cursor in cursors)
+    if total_bound > 0:
+        for cursor in cursors:
+            cursor.scale(net_relevance_factor / total_bound)
+
+    max_quality = static_quality(get_document(1))
+    if max_quality <= 0:
+        return cursors, None
+
+    def prior(docid):
+        return quality_factor * static_quality(get_document(docid)) / max_quality
+
+    return cursors, prior
+
+
+def _push(heap, k, item):
+    """Pushes the (score, docid, postings) item into the min heap of size k.
+    Returns the new threshold (the k-th best score) or 0.0 if the heap isn't full.
+    """
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item[0] > heap[0][0]:
+        heapq.heapreplace(heap, item)
+    return heap[0][0] if len(heap) == k else 0.0
+
+
+def _ranked(heap):
+    return sorted(heap, key=lambda item: (-item[0], item[1]))
+
+
+def wand_topk(idfs, k):
+    """Returns the top k documents by score among documents
+    that contain any of the tokens along with the number of documents scored.
+
+    Each result is a (score, docid, postings) tuple where postings maps
+    each matched token to its posting. Results are in descending order.
+
+    If the deadline of the query passes (see lib/deadline.py),
+    the top k documents scored so far are returned.
+
+    :param idfs dict[str, float]: Mapping of token to its idf
+    :param k int: The number of documents to return
+    :return: The top k results and the number of documents scored
+    :rtype: tuple[list[tuple], int]
+    """
+    cursors, prior = _make_cursors(idfs)
+
+    heap = [] # min heap of (score, docid, postings)
+    threshold = 0.0
+    num_scored = 0
+    num_steps = 0
+
+    while cursors and k > 0:
+        num_steps += 1
+        if not num_steps % CHECK_STEPS and deadline_expired():
+            break # out of time: the top k so far
+
+        cursors.sort(key=lambda cursor: cursor.docid())
+
+        # find the pivot: the first cursor where the sum of
+        # upper bounds so far could beat the threshold
+        # (documents before the pivot can only contain the preceding terms)
+        pivot = None
+        acc = 0.0
+        for i, cursor in enumerate(cursors):
+            acc += cursor.upper_bound
+            bound = acc + prior(cursor.docid()) if prior else acc
+            if bound > threshold or len(heap) < k:
+                pivot = i
+                break
+        if pivot is None:
+            break # no remaining document can enter the top k
+
+        pivot_docid = cursors[pivot].docid()
+
+        if cursors[0].docid() == pivot_docid:
+            # every cursor up to the pivot is on the pivot document
+            # so the pivot document is fully scored
+            document = get_document(pivot_docid)
+            score = prior(pivot_docid) if prior else 0.0
+            matched = {}
+            for cursor in cursors:
+                if cursor.docid() != pivot_docid:
+                    break
+                score += cursor.contribution(document)
+                matched[cursor.token] = cursor.posting()
+                cursor.next()
+            num_scored += 1
+            threshold = _push(heap, k, (score, pivot_docid, matched))
+        else:
+            # skip the cursors before the pivot to the pivot document
+            for cursor in cursors[:pivot]:
+                cursor.seek(pivot_docid)
+
+        cursors = [cursor for cursor in cursors if not cursor.exhausted()]
+
+    return _ranked(heap), num_scored
+
+
+def conjunctive_topk(idfs, k):
+    """Returns the top k documents by score among documents
+    that contain every token. The postings lists are intersected
+    document-at-a-time, starting from the shortest list.
+
+    If the index is quality ordered, the intersection stops early once no
+    remaining document can make the top k. The number of matched documents
+    then only counts the documents before the docid where it stopped.
+    The same goes if the deadline of the query passes (see lib/deadline.py).
+
+    Each result is a (score, docid, postings) tuple where postings maps
+    each token to its posting. Results are in descending order.
+
+    :param idfs dict[str, float]: Mapping of token to its idf
+    :param k int: The number of documents to return
+    :return: The top k results, the number of matched documents
+        and the docid where the intersection stopped early (or None)
+    :rtype: tuple[list[tuple], int, int]
+    """
+    cursors, prior = _make_cursors(idfs)
+    if len(cursors) < len(idfs) or k <= 0:
+        return [], 0, None # some token has no postings
+
+    cursors.sort(key=lambda cursor: len(cursor.postings))
+    total_bound = sum(cursor.upper_bound for cursor in cursors)
+
+    heap = [] # min heap of (score, docid, postings)
+    threshold = 0.0
+    num_matched = 0
+
+    lead = cursors[0]
+    num_steps = 0
+    while not lead.exhausted():
+        candidate = lead.docid()
+
+        num_steps += 1
+        if not num_steps % CHECK_STEPS and deadline_expired():
+            return _ranked(heap), num_matched, candidate
+
+        # early termination: the static quality only decreases from here
+        if prior and len(heap) == k and total_bound + prior(candidate) <= threshold:
+            return _ranked(heap), num_matched, candidate
+
+        # move the other cursors to the candidate
+        next_candidate = None
+        for cursor in cursors[1:]:
+            cursor.seek(candidate)
+            if cursor.exhausted():
+                return _ranked(heap), num_matched, None
+            if cursor.docid() != candidate:
+                next_candidate = cursor.docid()
+                break
+        if next_candidate is not None:
+            lead.seek(next_candidate)
+            continue
+
+        # every cursor is on the candidate
+        document = get_document(candidate)
+        score = prior(candidate) if prior else 0.0
+        matched = {}
+        for cursor in cursors:
+            score += cursor.contribution(document)
+            matched[cursor.token] = cursor.posting()
+        num_matched += 1
+        threshold = _push(heap, k, (score, candidate, matched))
+        lead.next()
+
+    return _ranked(heap), num_matched, None
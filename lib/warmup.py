@@ -0,0 +1,108 @@
+# lib/warmup.py
+#
+# warms up the postings cache and the result cache at startup
+# from the most frequent queries of the query log (see lib/querylog.py)
+#
+# the postings lists of the most frequent terms are loaded first
+# (up to a memory budget; dense terms are loaded as the bitmaps that
+# queries read them from, see lib/bitmap.py), then the results of the most frequent queries
+# are cached; both stop once the time budget runs out
+
+import time
+import threading
+from collections import Counter
+from lib.querylog import read_query_log
+from lib.reader import get_postings, get_bitmap_postings, pinned_index
+from lib.postingcache import postings_nbytes
+from lib.params import result_cache_depth
+import lib.queryproc as queryproc
+
+
+class CacheWarmer(threading.Thread):
+    """Background thread that warms up the caches from the query log
+    within `time_budget` seconds, loading at most `max_bytes` of postings.
+    Prints a report once it has finished.
+    """
+    def __init__(self, log_filename, time_budget, max_bytes):
+        super().__init__(name="cache-warmup", daemon=True)
+        self.log_filename = log_filename
+        self.time_budget = time_budget
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._status = {
+            'done': False,
+            'postings': 0,
+            'bytes': 0,
+            'queries': 0,
+            'seconds': 0.0,
+        }
+
+    def _update(self, **kwargs):
+        with self._lock:
+            self._status.update(kwargs)
+
+    def status(self):
+        """Returns the progress of the warm-up.
+        """
+        with self._lock:
+            return dict(self._status)
+
+    def run(self):
+        # warm up the caches of the index current at startup
+        # (a reloaded index is warmed up by reader.reload_index)
+        with pinned_index():
+            self._warm_up()
+
+    def _warm_up(self):
+        start = time.monotonic()
+        deadline = start + self.time_budget
+
+        # count the normalized queries and their terms
+        # (raw queries are only normalized once)
+        query_counts = Counter()
+        term_counts = Counter()
+        queries = {} # key -> (frequencies, disjunctive, biwords)
+        for (query, disjunctive), count in Counter(read_query_log(self.log_filename)).items():
+            if time.monotonic() >= deadline:
+                break
+            frequencies = queryproc.prepare_query(query)
+            if not frequencies:
+                continue
+            for token in frequencies:
+                term_counts[token] += count
+
+            # boolean queries only warm up the postings of their terms
+            if queryproc.is_boolean_query(query):
+                continue
+            biwords = queryproc.query_biwords(query, frequencies) if not disjunctive else []
+            key = queryproc.query_key(frequencies, disjunctive, True, biwords)
+            queries[key] = (frequencies, disjunctive, biwords)
+            query_counts[key] += count
+
+        # load the postings lists of the most frequent terms
+        num_postings = 0
+        nbytes = 0
+        for token, _ in term_counts.most_common():
+            if time.monotonic() >= deadline or nbytes >= self.max_bytes:
+                break
+            bitmap = get_bitmap_postings(token)
+            nbytes += bitmap.nbytes() if bitmap is not None else postings_nbytes(get_postings(token))
+            num_postings += 1
+            self._update(postings=num_postings, bytes=nbytes)
+
+        # cache the results of the most frequent queries
+        num_queries = 0
+        if queryproc.get_result_cache_stats() is not None:
+            for key, _ in query_counts.most_common():
+                if time.monotonic() >= deadline:
+                    break
+                frequencies, disjunctive, biwords = queries[key]
+                queryproc.evaluate_cached(frequencies, result_cache_depth, 0, disjunctive, True, biwords)
+                num_queries += 1
+                self._update(queries=num_queries)
+
+        seconds = time.monotonic() - start
+        self._update(done=True, seconds=seconds)
+        print(f"Cache warm-up finished in {seconds:.2f} s: {num_postings} postings lists "
+            f"({nbytes / 1024 / 1024:.1f} MB), {num_queries} query results")
@@ -3,13 +3,39 @@
 # writes inverted index to disk
 # see lib/spec.md
 
+import os
+import glob
+import math
+import time
+import zlib
+import heapq
+import shutil
 from queue import PriorityQueue
+from collections import defaultdict
 from lib.structs import *
 from lib.posting import *
 from lib.document import *
+from lib.seeker import *
+from lib.bitmap import *
+from lib.tokenize import is_biword
+from lib.params import importance
 
 PART_VER = 1
-MERGE_VER = 1
+MERGE_VER = 6
+
+# offsets of the mergeinfo fields that are updated in place
+MERGE_FLAGS_OFFSET = 1
+MERGE_LAST_DOCID_OFFSET = 4
+MERGE_VERSION_OFFSET = 20
+
+MERGE_F_QUALITY_ORDERED = 0x01  # docids are ordered by descending static quality
+MERGE_F_IMPACTS = 0x02          # postings store quantized impacts (see write_impacts)
+MERGE_F_BIWORDS = 0x04          # frequent biwords are indexed (see biword_min_df)
+
+IMPACT_LEVELS = 255             # impacts are quantized to 8 bits
+
+BIWORD_BUDGET = 0.2             # max biword postings per unigram posting
+BIWORD_MIN_DF = 2               # biwords in fewer documents are never indexed
 
 CHK_P_OK = 0x00                 # partial file is complete
 CHK_P_VER_MISMATCH = 0xfd       # wrong partial file version
@@ -163,14 +189,74 @@ def write_partial(index, docs, partfh, docfh, doclinksfh):
         raise e # propagate
 
 
-def merge_partial(partfh, merge_filename, buckets_dir):
+def read_docinfo(docinfo_filename):
+    """Returns the mapping of docid to Document from the docinfo file.
+    """
+    documents = {}
+    with open(docinfo_filename, 'rb') as docfh:
+        docfh.seek(0, 2)
+        docend = docfh.tell()
+        docfh.seek(0, 0)
+        while docfh.tell() != docend:
+            document, _ = sdocument_rd(docfh)
+            documents[document.docid] = document
+    return documents
+
+
+def read_doclinks(doclinks_filename):
+    """Returns the mapping of docid to the list of URLs that the document
+    links to from the doclinks file.
+    """
+    doclinks = {}
+    with open(doclinks_filename, 'rb') as doclinksfh:
+        doclinksfh.seek(0, 2)
+        doclinksend = doclinksfh.tell()
+        doclinksfh.seek(0, 0)
+        while doclinksfh.tell() != doclinksend:
+            docid, _ = u64_rd(doclinksfh)
+            num_urls, _ = u32_rd(doclinksfh)
+            doclinks[docid] = [sstr_rd(doclinksfh)[0] for _ in range(num_urls)]
+    return doclinks
+
+
+def merge_partial(partfh, merge_filename, buckets_dir, docinfo_filename, champions=0, impacts=False,
+        biwords=False, doc_freqs=None, num_docs=None):
     """Merges the partial container using k-way (k = partcnt).
     The contents are stored in `buckets_dir` as buckets based on
     the first char of the token.
 
     For each bucket, a corresponding seek file is created to enable
-    fast retrieval. This is internally stored as a sequence of string to
-    u32 pairs.
+    fast retrieval. This is internally stored as a sequence of seekers
+    (see lib/seeker.py), which hold the offset of the token's postings list
+    along with its term statistics: the document frequency, the collection
+    frequency (sum of tf) and the max score.
+
+    The max score of a token is the largest per-posting score without idf,
+    that is max(tf / total_tokens * importance). Multiplied by the idf,
+    it bounds how much the token contributes to a document's tfidf sum.
+
+    The length (norm) of each document's tfidf vector is also computed
+    over every token and stored in the docinfo (see update_doc_norms),
+    where the tfidf of a token is tf / total_tokens * importance * idf.
+    If `doc_freqs` and `num_docs` are given (the term statistics of every
+    shard, see makeindex.py), the idf is computed from them instead of from
+    this index, so the norms are those of the whole collection; so are the
+    biwords that are kept.
+
+    The postings lists of dense tokens (see bitmap.is_dense) are stored
+    as bitmaps of their docids followed by a side array of their tf and
+    fields (see lib/bitmap.py).
+
+    If `impacts`, each posting also stores its quantized tfidf
+    (see write_impacts).
+
+    If `biwords`, the biwords of the partial container (see makeindex.py)
+    that occur in at least `biword_min_df` documents are kept, so that the
+    biword postings stay within BIWORD_BUDGET of the unigram postings.
+    Otherwise, every biword is dropped.
+
+    If `champions` is positive, a high tier of (at most) that many postings
+    per token is also written (see write_champions).
 
     Bucket files have ".bucket" as the file extension.
     Seek files have ".seek" as the file extension.
@@ -178,16 +264,31 @@ def merge_partial(partfh, merge_filename, buckets_dir):
     :param partfh: The partial container file handler
     :param merge_filename str: The filename where merge info is stored.
     :param buckets_dir str: The directory where buckets are stored.
+    :param docinfo_filename str: The docinfo file (for the document lengths).
+    :param champions int: The size of the high tier per token (0 to disable).
+    :param impacts bool: Whether to store quantized impacts in the postings.
+    :param biwords bool: Whether to keep the frequent biwords.
+    :param doc_freqs dict[str, int]: The document frequencies of the collection (optional).
+    :param num_docs int: The number of documents of the collection (optional).
 
     :return: Whether the merge was successful
     :rtype: bool
 
     """
+    # setup: biwords that are kept
+    min_df = biword_min_df(partfh, doc_freqs) if biwords else 0
+
     # read partial header
     partfh.seek(2, 0)
     docid, _ = u64_rd(partfh)
     partcnt, _ = u32_rd(partfh)
 
+    # setup: document lengths for max scores and norms
+    documents = read_docinfo(docinfo_filename)
+    idf_num_docs = num_docs if doc_freqs is not None else len(documents)
+    num_docs = len(documents)
+    sq_norms = defaultdict(float) # docid -> squared tfidf vector length
+
     # setup: internals
     tokencnt = 0
     bucket_char = None
@@ -219,10 +320,14 @@ def merge_partial(partfh, merge_filename, buckets_dir):
         nonlocal bucket_fh
         nonlocal bucket_seekfh
         nonlocal token_key
-        codepoint = ord(token_key[0])
-        first_char = '\u0080' if codepoint >= 128 else token_key[0]
+        nonlocal tokencnt
+        bid = min(ord(token_key[0]), 128)
+        first_char = chr(bid)
         num_postings = 0
-        token_val_mmap = bytearray()
+        coll_freq = 0
+        max_score = 0.0
+        scores = [] # (docid, score) per posting
+        postings = []
 
         # make new bucket if first char doesn't match
         if bucket_char != first_char:
@@ -230,21 +335,49 @@ def merge_partial(partfh, merge_filename, buckets_dir):
             if bucket_fh:
                 bucket_fh.close()
                 bucket_seekfh.close()
-            bucket_fh = open(f'{buckets_dir}/{codepoint}.bucket', 'wb')
-            bucket_seekfh = open(f'{buckets_dir}/{codepoint}.seek', 'wb')
+            bucket_fh = open(f'{buckets_dir}/{bid}.bucket', 'wb')
+            bucket_seekfh = open(f'{buckets_dir}/{bid}.seek', 'wb')
 
         # process value queue until it's empty
         while not val_queue.empty():
             # sequentially writes postings and keeps track of how many
             num_postings += 1
             posting = val_queue.get(block=False)
-            token_val_mmap.extend(sposting_repr(posting))
+            postings.append(posting)
+            coll_freq += posting.tf
+
+            # keep track of the max score (upper bound)
+            score = (posting.tf / documents[posting.docid].total_tokens
+                * importance[posting.fields['important']])
+            max_score = max(max_score, score)
+            scores.append((posting.docid, score))
+
+        # biwords are only indexed if they are frequent,
+        # and are not terms of the documents' tfidf vectors
+        if is_biword(token_key):
+            doc_freq = doc_freqs[token_key] if doc_freqs is not None else num_postings
+            if not min_df or doc_freq < min_df:
+                tokencnt -= 1
+                return
+            scores.clear()
+
+        # add the tfidf of the token to the norms of its documents
+        if doc_freqs is not None:
+            idf = term_idf(doc_freqs[token_key], idf_num_docs)
+        else:
+            idf = term_idf(num_postings, num_docs)
+        for docid, score in scores:
+            sq_norms[docid] += (score * idf) ** 2
 
         # append to seek file and bucket
-        bucket_seekfh.write(sstr_repr(token_key))
-        bucket_seekfh.write(u32_repr(bucket_fh.tell()))
-        bucket_fh.write(u32_repr(num_postings))
-        bucket_fh.write(token_val_mmap)
+        bucket_seekfh.write(sseeker_repr(Seeker(
+            token=token_key,
+            offset=bucket_fh.tell(),
+            doc_freq=num_postings,
+            coll_freq=coll_freq,
+            max_score=max_score * (1 + 1e-6), # round up past f32 precision
+        )))
+        bucket_fh.write(spostings_repr(postings, bitmap=is_dense(num_postings, num_docs)))
 
     # process key queue until it's empty
     while not key_queue.empty():
@@ -281,15 +414,6 @@ def merge_partial(partfh, merge_filename, buckets_dir):
     if token_key:
         _dump_token_to_bucket()
 
-    # write merge info (32 bytes)
-    mergeinfofh = open(merge_filename, 'wb')
-    mergeinfofh.write(u8_repr(MERGE_VER))
-    mergeinfofh.write(b'\0\0\0')
-    mergeinfofh.write(u64_repr(docid))
-    mergeinfofh.write(u32_repr(tokencnt))
-    mergeinfofh.write(b'\0' * 16)
-    mergeinfofh.close()
-
     # close temp file handlers
     for pseeker in partseekers:
         pseeker[1].close()
@@ -297,16 +421,423 @@ def merge_partial(partfh, merge_filename, buckets_dir):
         bucket_fh.close()
         bucket_seekfh.close()
 
+    # write document norms
+    update_doc_norms(docinfo_filename, {
+        docid: math.sqrt(sq_norm) for docid, sq_norm in sq_norms.items()
+    })
+
+    # write impacts
+    impact_scale = write_impacts(buckets_dir, documents) if impacts else 0.0
+
+    # write merge info (40 bytes)
+    mergeinfofh = open(merge_filename, 'wb')
+    mergeinfofh.write(u8_repr(MERGE_VER))
+    mergeinfofh.write(u8_repr(
+        (MERGE_F_IMPACTS if impacts else 0)
+        | (MERGE_F_BIWORDS if min_df else 0)
+    ))   # flags
+    mergeinfofh.write(b'\0\0')
+    mergeinfofh.write(u64_repr(docid))
+    mergeinfofh.write(u32_repr(tokencnt))
+    mergeinfofh.write(u32_repr(champions))
+    mergeinfofh.write(u64_repr(time.time_ns()))  # index version
+    mergeinfofh.write(u32_repr(impact_fingerprint() if impacts else 0))
+    mergeinfofh.write(f32_repr(impact_scale))
+    mergeinfofh.write(u32_repr(min_df))
+    mergeinfofh.close()
+
+    # write the high tier (or remove a stale one)
+    write_champions(docinfo_filename, buckets_dir, champions, documents=documents)
+
     return True # success
 
 
+def biword_min_df(partfh, doc_freqs=None):
+    """Returns the document frequency above which biwords are indexed,
+    chosen from the corpus statistics of the partial container (or
+    `doc_freqs`, the document frequencies of every shard): the most
+    frequent biwords are kept while their postings stay within BIWORD_BUDGET
+    of the unigram postings (and occur in at least BIWORD_MIN_DF documents).
+    Returns 0 if no biword is kept.
+
+    :param partfh: The partial container file handler
+    :param doc_freqs dict[str, int]: The document frequencies of the collection (optional)
+    :return: The minimum document frequency of the indexed biwords
+    :rtype: int
+    """
+    # document frequencies (summed across partitions)
+    unigram_postings = 0
+    biword_dfs = {}
+    if doc_freqs is None:
+        doc_freqs = partial_doc_freqs(partfh)
+    for token, doc_freq in doc_freqs.items():
+        if is_biword(token):
+            biword_dfs[token] = doc_freq
+        else:
+            unigram_postings += doc_freq
+
+    # number of biwords per document frequency
+    df_counts = defaultdict(int)
+    for df in biword_dfs.values():
+        df_counts[df] += 1
+
+    budget = BIWORD_BUDGET * unigram_postings
+    total = 0
+    min_df = 0
+    for df in sorted(df_counts, reverse=True):
+        if df < BIWORD_MIN_DF or total + df * df_counts[df] > budget:
+            break
+        total += df * df_counts[df]
+        min_df = df
+
+    return min_df
+
+
+def partial_doc_freqs(partfh):
+    """Returns the document frequency of each token of the partial
+    container (summed across partitions), without reading the postings.
+
+    :param partfh: The partial container file handler
+    :return: The mapping of token to its document frequency
+    :rtype: dict[str, int]
+    """
+    partfh.seek(2, 0)
+    _, _ = u64_rd(partfh)
+    partcnt, _ = u32_rd(partfh)
+
+    doc_freqs = defaultdict(int)
+    for _ in range(partcnt):
+        partsize, _ = u32_rd(partfh)
+        partend = partfh.tell() + partsize
+        while partfh.tell() < partend:
+            token, _ = sstr_rd(partfh)
+            num_postings, _ = u32_rd(partfh)
+            partfh.seek(num_postings * SPOSTING_SIZE, 1)
+            doc_freqs[token] += num_postings
+
+    return doc_freqs
+
+
+def update_index_version(merge_filename):
+    """Writes a new index version to the mergeinfo file.
+    This should be called whenever the index files are modified after
+    merging, so that anything derived from the index (i.e. cached results)
+    can tell that it is outdated.
+    """
+    with open(merge_filename, 'r+b') as mergefh:
+        mergefh.seek(MERGE_VERSION_OFFSET, 0)
+        mergefh.write(u64_repr(time.time_ns()))
+
+
+def term_idf(doc_freq, num_docs):
+    """Returns the idf of a token that occurs in `doc_freq` of `num_docs` documents.
+    """
+    return math.log((1 + num_docs) / (1 + doc_freq))
+
+
+def impact_fingerprint():
+    """Returns the fingerprint of the parameters that impacts are computed
+    from. Impacts are outdated if the fingerprint has changed since the
+    index was built.
+    """
+    return zlib.crc32(repr((IMPACT_LEVELS, importance)).encode('utf-8'))
+
+
+def quantize_impact(score, scale):
+    """Returns the impact of the score, that is the score quantized to
+    an integer in [1, IMPACT_LEVELS] where IMPACT_LEVELS stands for `scale`.
+    Scores are rounded up, so the impact of an upper bound is an upper bound.
+    Returns 0 if the score is not positive.
+    """
+    if score <= 0 or scale <= 0:
+        return 0
+    return max(1, min(IMPACT_LEVELS, math.ceil(score / scale * IMPACT_LEVELS)))
+
+
+def write_impacts(buckets_dir, documents):
+    """Stores the impact of each posting in `buckets_dir`: its tfidf
+    (tf / total_tokens * importance * idf) quantized to 8 bits
+    (see quantize_impact). The bucket files are rewritten.
+
+    The scale of the impacts is the largest tfidf of any posting,
+    which is bounded using the max score of each token.
+    Biwords are not scored, so their impacts are left at 0.
+
+    :param buckets_dir str: The directory where buckets are stored
+    :param documents dict[int, Document]: The docinfo
+    :return: The scale of the impacts
+    :rtype: float
+    """
+    num_docs = len(documents)
+
+    # read seek files
+    bucket_seekers = {}
+    for path in glob.glob("*.seek", root_dir=buckets_dir):
+        bid = path[:-5]
+        with open(f'{buckets_dir}/{bid}.seek', 'rb') as seekfh:
+            bucket_seekers[bid] = _read_seekers(seekfh)
+
+    scale = max((
+        seeker.max_score * term_idf(seeker.doc_freq, num_docs)
+        for seekers in bucket_seekers.values()
+        for seeker in seekers
+        if not is_biword(seeker.token)
+    ), default=0.0)
+
+    def _impacts(seeker, postings):
+        if is_biword(seeker.token):
+            return postings
+        idf = term_idf(seeker.doc_freq, num_docs)
+        for posting in postings:
+            score = (posting.tf / documents[posting.docid].total_tokens
+                * importance[posting.fields['important']])
+            posting.fields['impact'] = quantize_impact(score * idf, scale)
+        return postings
+
+    _rewrite_buckets(buckets_dir, num_docs, _impacts)
+
+    return scale
+
+
+def _read_seekers(seekfh):
+    """Returns the list of seekers of the seek file.
+    """
+    seekfh.seek(0, 2)
+    seekend = seekfh.tell()
+    seekfh.seek(0, 0)
+    seekers = []
+    while seekfh.tell() != seekend:
+        seeker, _ = sseeker_rd(seekfh)
+        seekers.append(seeker)
+    return seekers
+
+
+def _rewrite_buckets(buckets_dir, num_docs, transform):
+    """Rewrites every postings list of the buckets in `buckets_dir`
+    as `transform(seeker, postings)`, which returns the new postings list
+    (sorted by docid, with the same number of postings).
+
+    The size of a postings list may change (i.e. bitmap postings lists
+    of renumbered docids), so each bucket and its seek file are written
+    to new files with the new offsets which then replace the old ones.
+
+    :param buckets_dir str: The directory where buckets are stored
+    :param num_docs int: The number of documents (see bitmap.is_dense)
+    :param transform: The function that rewrites a postings list
+    """
+    for path in glob.glob("*.seek", root_dir=buckets_dir):
+        bid = path[:-5]
+        bucket_filename = f'{buckets_dir}/{bid}.bucket'
+        seek_filename = f'{buckets_dir}/{bid}.seek'
+
+        with open(seek_filename, 'rb') as seekfh:
+            seekers = _read_seekers(seekfh)
+
+        with open(bucket_filename, 'rb') as bucketfh, \
+                open(f'{bucket_filename}.tmp', 'wb') as newbucketfh, \
+                open(f'{seek_filename}.tmp', 'wb') as newseekfh:
+            for seeker in seekers:
+                bucketfh.seek(seeker.offset, 0)
+                postings, _ = spostings_rd(bucketfh)
+                postings = transform(seeker, postings)
+
+                seeker.offset = newbucketfh.tell()
+                newbucketfh.write(spostings_repr(postings, bitmap=is_dense(len(postings), num_docs)))
+                newseekfh.write(sseeker_repr(seeker))
+
+        os.replace(f'{bucket_filename}.tmp', bucket_filename)
+        os.replace(f'{seek_filename}.tmp', seek_filename)
+
+
+def champion_score(posting, document):
+    """Returns the score used to rank postings within a token's high tier:
+    tf * importance * static quality.
+    """
+    tf = posting.tf / document.total_tokens
+    return tf * importance[posting.fields['important']] * static_quality(document)
+
+
+def write_champions(docinfo_filename, buckets_dir, champions, documents=None):
+    """Writes the high tier (champion lists) of each bucket in `buckets_dir`.
+    For each token with more than `champions` postings, its high tier
+    holds the top `champions` postings by champion score (sorted by docid).
+    Tokens with fewer postings are not written; their postings list
+    is its own high tier.
+
+    The high tier is stored like buckets: ".champ" files store the postings
+    lists and ".cseek" files store the tokens paired with their offsets
+    and their document frequencies (in the full postings list).
+
+    Since the champion score uses static quality, this should be
+    called again after the quality scores are updated.
+    If `champions` is 0, the high tier files are removed.
+
+    The files are replaced rather than rewritten in place, so a server
+    that has mapped them keeps reading the old ones until it reloads.
+
+    :param docinfo_filename str: The docinfo file
+    :param buckets_dir str: The directory where buckets are stored
+    :param champions int: The size of the high tier per token
+    :param documents dict[int, Document]: The docinfo (if it was already read)
+    """
+    stale = set(glob.glob("*.champ", root_dir=buckets_dir) + glob.glob("*.cseek", root_dir=buckets_dir))
+    seekpaths = glob.glob("*.seek", root_dir=buckets_dir) if champions > 0 else []
+
+    if seekpaths and documents is None:
+        documents = read_docinfo(docinfo_filename)
+
+    for path in seekpaths:
+        bid = path[:-5]
+        stale.discard(f'{bid}.champ')
+        stale.discard(f'{bid}.cseek')
+        seekfh = open(f'{buckets_dir}/{bid}.seek', 'rb')
+        bucketfh = open(f'{buckets_dir}/{bid}.bucket', 'rb')
+        champfh = open(f'{buckets_dir}/{bid}.champ.tmp', 'wb')
+        champseekfh = open(f'{buckets_dir}/{bid}.cseek.tmp', 'wb')
+
+        seekfh.seek(0, 2)
+        seekend = seekfh.tell()
+        seekfh.seek(0, 0)
+        while seekfh.tell() != seekend:
+            seeker, _ = sseeker_rd(seekfh)
+            if seeker.doc_freq <= champions:
+                continue # postings list is its own high tier
+            if is_biword(seeker.token):
+                continue # biwords are not scored
+
+            bucketfh.seek(seeker.offset, 0)
+            postings, _ = spostings_rd(bucketfh)
+            top = heapq.nlargest(
+                champions,
+                postings,
+                key=lambda p: champion_score(p, documents[p.docid])
+            )
+            top.sort()
+
+            champseekfh.write(sstr_repr(seeker.token))
+            champseekfh.write(u32_repr(champfh.tell()))
+            champseekfh.write(u32_repr(len(postings)))
+            champfh.write(spostings_repr(top))
+
+        seekfh.close()
+        bucketfh.close()
+        champfh.close()
+        champseekfh.close()
+        os.replace(f'{buckets_dir}/{bid}.champ.tmp', f'{buckets_dir}/{bid}.champ')
+        os.replace(f'{buckets_dir}/{bid}.cseek.tmp', f'{buckets_dir}/{bid}.cseek')
+
+    # remove the high tier files that were not rewritten
+    for path in stale:
+        os.remove(os.path.join(buckets_dir, path))
+
+
+def reorder_index(docinfo_filename, doclinks_filename, merge_filename, buckets_dir, summary_filename=None):
+    """Renumbers the docids of the index by descending static quality.
+    Empty documents (pruned pages) are removed, so the docids become dense.
+    Rewrites the docinfo, the doclinks, the buckets (each postings list
+    is sorted by its new docids) and the summary file (if it exists),
+    and marks the mergeinfo with MERGE_F_QUALITY_ORDERED.
+
+    Each file is written to a temporary file that then replaces it, so
+    a reload meanwhile (see reader.reload_index) reads whole files.
+
+    Note: The high tier must be rewritten afterwards (see write_champions),
+    and then the index version updated (see update_index_version).
+
+    :param docinfo_filename str: The docinfo file
+    :param doclinks_filename str: The doclinks file
+    :param merge_filename str: The mergeinfo file
+    :param buckets_dir str: The directory where buckets are stored
+    :param summary_filename str: The summary file (optional)
+
+    :return: The mapping of old docid to new docid
+    :rtype: dict[int, int]
+    """
+    # new docids by descending static quality (ties keep their order)
+    documents = sorted(
+        read_docinfo(docinfo_filename).values(),
+        key=lambda document: (-static_quality(document), document.docid)
+    )
+    docids = {}
+    for new_docid, document in enumerate(documents, 1):
+        docids[document.docid] = new_docid
+
+    # rewrite docinfo
+    with open(f'{docinfo_filename}.tmp', 'wb') as docfh:
+        for document in documents:
+            document.docid = docids[document.docid]
+            docfh.write(sdocument_repr(document))
+    os.replace(f'{docinfo_filename}.tmp', docinfo_filename)
+
+    # rewrite doclinks
+    doclinks = []
+    with open(doclinks_filename, 'rb') as doclinksfh:
+        doclinksfh.seek(0, 2)
+        doclinksend = doclinksfh.tell()
+        doclinksfh.seek(0, 0)
+        while doclinksfh.tell() != doclinksend:
+            docid, _ = u64_rd(doclinksfh)
+            num_urls, _ = u32_rd(doclinksfh)
+            urls = [sstr_rd(doclinksfh)[0] for _ in range(num_urls)]
+            if docid in docids:
+                doclinks.append((docids[docid], urls))
+    doclinks.sort()
+    with open(f'{doclinks_filename}.tmp', 'wb') as doclinksfh:
+        for docid, urls in doclinks:
+            doclinksfh.write(u64_repr(docid))
+            doclinksfh.write(u32_repr(len(urls)))
+            for url in urls:
+                doclinksfh.write(sstr_repr(url))
+    os.replace(f'{doclinks_filename}.tmp', doclinks_filename)
+
+    # rewrite summaries (keyed by docid)
+    if summary_filename and os.path.isfile(summary_filename):
+        summaries = []
+        with open(summary_filename, 'rb') as summaryfh:
+            summaryfh.seek(0, 2)
+            summaryend = summaryfh.tell()
+            summaryfh.seek(0, 0)
+            while summaryfh.tell() != summaryend:
+                docid, _ = u64_rd(summaryfh)
+                summary, _ = sstr_rd(summaryfh)
+                if docid in docids:
+                    summaries.append((docids[docid], summary))
+        summaries.sort()
+        with open(f'{summary_filename}.tmp', 'wb') as summaryfh:
+            for docid, summary in summaries:
+                write_summary(docid, summary, summaryfh)
+        os.replace(f'{summary_filename}.tmp', summary_filename)
+
+    # rewrite buckets
+    def _renumber(seeker, postings):
+        for posting in postings:
+            posting.docid = docids[posting.docid]
+        postings.sort()
+        return postings
+
+    _rewrite_buckets(buckets_dir, len(documents), _renumber)
+
+    # update mergeinfo (last docid, flags)
+    with open(merge_filename, 'r+b') as mergefh:
+        mergefh.seek(MERGE_FLAGS_OFFSET, 0)
+        flags, _ = u8_rd(mergefh)
+        mergefh.seek(MERGE_FLAGS_OFFSET, 0)
+        mergefh.write(u8_repr(flags | MERGE_F_QUALITY_ORDERED))
+        mergefh.seek(MERGE_LAST_DOCID_OFFSET, 0)
+        mergefh.write(u64_repr(len(documents)))
+
+    return docids
+
+
 def update_doc_pr_quality(docinfo_filename, scores):
     """Writes the pr_quality field of specified
     documents based on the scores.
+    The fields are written to a copy of the file that then replaces it.
 
     :param scores dict[int, float]: Mapping of docid to float score
     """
-    with open(docinfo_filename, 'r+b') as docfh:
+    shutil.copyfile(docinfo_filename, f'{docinfo_filename}.tmp')
+    with open(f'{docinfo_filename}.tmp', 'r+b') as docfh:
         docfh.seek(0, 2)
         docfhend = docfh.tell()
         docfh.seek(0, 0)
@@ -319,9 +850,11 @@ def update_doc_pr_quality(docinfo_filename, scores):
             if score != None:
                 docfh.write(f32_repr(score))
 
+            _, _ = f32_rd(docfh)
             _, _ = f32_rd(docfh)
             _, _ = f32_rd(docfh)
             _, _ = sstr_rd(docfh)
+    os.replace(f'{docinfo_filename}.tmp', docinfo_filename)
 
 
 def update_doc_hits_quality(docinfo_filename, scores):
@@ -329,10 +862,12 @@ def update_doc_hits_quality(docinfo_filename, scores):
     specified document based on the scores.
     First score is interpreted as hub quality.
     Second score is interpreted as authority quality.
+    The fields are written to a copy of the file that then replaces it.
 
     :param scores dict[int, tuple]: Mapping of docid to 2-tuple float scores
     """
-    with open(docinfo_filename, 'r+b') as docfh:
+    shutil.copyfile(docinfo_filename, f'{docinfo_filename}.tmp')
+    with open(f'{docinfo_filename}.tmp', 'r+b') as docfh:
         docfh.seek(0, 2)
         docfhend = docfh.tell()
         docfh.seek(0, 0)
@@ -347,6 +882,35 @@ def update_doc_hits_quality(docinfo_filename, scores):
                 docfh.write(f32_repr(score[0]))
                 docfh.write(f32_repr(score[1]))
 
+            _, _ = f32_rd(docfh)
+            _, _ = sstr_rd(docfh)
+    os.replace(f'{docinfo_filename}.tmp', docinfo_filename)
+
+
+def update_doc_norms(docinfo_filename, norms):
+    """Writes the norm field of specified documents
+    (the length of their tfidf vectors).
+
+    :param norms dict[int, float]: Mapping of docid to norm
+    """
+    with open(docinfo_filename, 'r+b') as docfh:
+        docfh.seek(0, 2)
+        docfhend = docfh.tell()
+        docfh.seek(0, 0)
+        while docfh.tell() != docfhend:
+            docid, _ = u64_rd(docfh)
+            _, _ = u32_rd(docfh)
+            _, _ = f32_rd(docfh)
+            _, _ = f32_rd(docfh)
+            _, _ = f32_rd(docfh)
+
+            # norm
+            norm = norms.get(docid, None)
+            if norm != None:
+                docfh.write(f32_repr(norm))
+            else:
+                _, _ = f32_rd(docfh)
+
             _, _ = sstr_rd(docfh)
 
 
@@ -3,29 +3,29 @@
 # constructs an index file
 # from a collection of web pages
 #
-# usage: python makeindex.py [--keep-partial | -p] path/to/pages
+# usage: python makeindex.py [--keep-partial | -p] [--champions | -c r] [--impacts | -i] [--biwords | -b] [--shards | -s n] path/to/pages
 
 import os
 import sys
 import time
+import shutil
 import itertools
 
-from bs4 import BeautifulSoup
 from collections import defaultdict # simplify and speed up Posting insertion
 from collections import deque
 from json import load
-from nltk.stem import PorterStemmer
 from hashlib import sha256
-from urllib.parse import urldefrag, urljoin
+from urllib.parse import urldefrag
 
 from lib.duphash import * # similar / exact hashing from scratch
-from lib.tokenize import *
+from lib.analyze import extract_page, page_terms
 from lib.word_count import word_count
 from lib.posting import Posting
 from lib.writer import *
 from lib.indexfiles import * # constants for index paths
 
-USAGE_MSG = "usage: python makeindex.py [--keep-partial | -p] path/to/pages"
+USAGE_MSG = "usage: python makeindex.py [--keep-partial | -p] [--champions | -c r] [--impacts | -i] [--biwords | -b]" \
+    " [--shards | -s n] path/to/pages"
 
 
 def setup_dir():
@@ -46,24 +46,44 @@ def clean_index_metainfo():
         os.remove(DOCLINKS_NAME)
 
 
-def make_partial(pagedir, partfh, partdoc):
+class PartialOutput:
+    """Partial index, docinfo and doclinks of the documents
+    of an index (or of a shard of the index).
+    """
+    def __init__(self, partfh, docinfo_filename, doclinks_filename):
+        self.partfh = partfh
+        self.docfh = open(docinfo_filename, 'ab')
+        self.doclinksfh = open(doclinks_filename, 'ab')
+        self.inverted_index = defaultdict(list)
+        self.docs = []
+
+    def flush(self):
+        write_partial(self.inverted_index, self.docs, self.partfh, self.docfh, self.doclinksfh)
+
+    def close(self):
+        self.docfh.close()
+        self.doclinksfh.close()
+
+
+def make_partial(pagedir, outputs, partdoc, biwords=False):
     """Uses JSON files from within `pagedir` and writes the
-    partial index to `partfh` starting from doc ID `partdoc` + 1.
+    partial index to the outputs starting from doc ID `partdoc` + 1.
+    If `biwords`, the biwords (pairs of adjacent terms) of each
+    document are indexed as well.
+
+    If there are several outputs (shards), the documents are partitioned
+    among them: document d is indexed by output (d - 1) % n as its
+    document (d - 1) // n + 1, so the shards have about as many documents.
     """
 
     start_time = time.time()
 
-    if partdoc == 0:
-        partfh = new_partial(fh=partfh) # restart partial file
-    partfh.seek(0, 2) # start from end
+    for output in outputs:
+        if partdoc == 0:
+            output.partfh = new_partial(fh=output.partfh) # restart partial file
+        output.partfh.seek(0, 2) # start from end
 
     docid = 0
-    docfh = open(DOCINFO_NAME, 'ab')
-    doclinksfh = open(DOCLINKS_NAME, 'ab')
-
-    stemmer = PorterStemmer()
-    inverted_index = defaultdict(list)
-    docs = []
 
     # USED FOR DETECTING DUPLICATE PAGES
     # NOTE: this resets if makeindex is interrupted
@@ -95,8 +115,9 @@ def make_partial(pagedir, partfh, partdoc):
         for file in files:
             # Periodically writes partial index to disk
             # if and only if docs is non-empty
-            if partial_iter % partial_flush_period == 0 and docs:
-                write_partial(inverted_index, docs, partfh, docfh, doclinksfh)
+            if partial_iter % partial_flush_period == 0 and any(output.docs for output in outputs):
+                for output in outputs:
+                    output.flush()
                 print(f"partial flush @ docID: {docid} ; pruned={pruned_docs}", flush=True)
             partial_iter += 1
 
@@ -143,50 +164,11 @@ def make_partial(pagedir, partfh, partdoc):
 
                 ### Content Extraction ###
                 ###
-                ### Extract content using bs4
-                ### This extracts regular test / important text
+                ### Extract content using bs4 (see lib/analyze.py)
+                ### This extracts regular test / important text and links
                 ### After extraction, memory used by soup is freed by decomposition
 
-                # soupify content
-                soup = BeautifulSoup(content, 'lxml')
-                important_tokens = defaultdict(set)
-
-                # extract regular text
-                text = soup.get_text()
-                tokens, ngrams_col = tokenize(text, n=1)
-                text = "" # possibly free up memory
-
-                # extract important text
-                #
-                # titles, bold text, headings up to h4
-                # (h4 is similar to bold)
-                # and mark (highlighted) text
-                important_tags = [
-                    ('title',1), ('h1',2), ('h2',3), ('h3',4),
-                    ('h4',5), ('b',6), ('strong',7), ('mark',8),
-                ]
-                for tag, _ in important_tags:
-                    taglist = soup.find_all(tag)
-                    for tag_soup in taglist:
-                        tag_text = tag_soup.get_text()
-                        important_tokens[tag].update(tokenize(tag_text, n=1)[0])
-                        tag_text = "" # possibly free up memory
-                        tag_soup.decompose() # free up memory from soup
-
-                # extract links
-                #
-                # store them as a list of adjacent edges
-                # these are storred as defragged URLs
-                #
-                # these are used to determine the static quality score (hits or pagerank)
-                doclinks = set()
-                for link in soup.find_all('a', href=True):
-                    link = urljoin(url.url, link['href'])
-                    defragged_link = urldefrag(link).url
-                    doclinks.add(defragged_link)
-
-                # free up memory from soup
-                soup.decompose()
+                tokens, ngrams_col, important_tokens, doclinks = extract_page(content, url.url)
 
 
                 ### Detect duplicate pages (SIMILAR) ###
@@ -216,36 +198,35 @@ def make_partial(pagedir, partfh, partdoc):
                 ### Populate postings and documents
                 ### if and only if the page is not a duplicate (exact, similar)
 
-                # manipulate tokens
-                extend_tokens_from_ngrams(tokens, ngrams_col)
-                stem_tokens(tokens)
-
-                token_counts = word_count(tokens)
-                total_tokens = len(token_counts.items())
+                terms, total_tokens, biword_counts = page_terms(tokens, ngrams_col, important_tokens, biwords)
 
+                # docid of the document in its output
+                output = outputs[(docid - 1) % len(outputs)]
+                out_docid = (docid - 1) // len(outputs) + 1
 
                 # Iterate over each token and its count and add a Posting to the inverted index
-                for token, count in token_counts.items():
-                    # determine whether token is important
-                    # tags ordered first are prioritized
-                    important = 0
-                    for tag, val in important_tags:
-                        if token in important_tokens[tag]:
-                            importance = val
-                            break
-
+                for token, (count, important) in terms.items():
                     # tf = term frequency for each individual token
                     posting = Posting(
-                        docid=docid,
+                        docid=out_docid,
                         tf=count,
                         important=important,
                     )
-                    inverted_index[token].append(posting)
+                    output.inverted_index[token].append(posting)
+
+                # biwords only narrow down the documents that contain
+                # adjacent query terms, so they are neither important
+                # nor counted towards the total tokens
+                for token, count in biword_counts.items():
+                    output.inverted_index[token].append(Posting(
+                        docid=out_docid,
+                        tf=count,
+                    ))
 
                 # append doc to docinfo
                 # (docid, total_tokens, url)
-                docs.append(Document(
-                    docid=docid,
+                output.docs.append(Document(
+                    docid=out_docid,
                     url=url.url,
                     total_tokens=total_tokens,
                     links=doclinks,
@@ -253,27 +234,40 @@ def make_partial(pagedir, partfh, partdoc):
 
 
     # Final write for any remaining documents
-    if inverted_index:
-        write_partial(inverted_index, docs, partfh, docfh, doclinksfh)
+    if any(output.inverted_index for output in outputs):
+        for output in outputs:
+            output.flush()
         print(f"final flush @ docID: {docid} ; pruned={pruned_docs}", flush=True)
-    mark_partial(partfh)
+    for output in outputs:
+        mark_partial(output.partfh)
 
     end_time = time.time()  # Capture the end time of the indexing process
     elapsed_time = end_time - start_time  # Calculate the elapsed time
     print(f"Elapsed time of indexing: {elapsed_time:.2f} seconds")
 
     # close temp file pointers from this function
-    docfh.close()
+    for output in outputs:
+        output.close()
 
 
-def make_final(partfh):
+def make_final(partfh, champions, impacts, biwords, shard=None, doc_freqs=None, num_docs=None):
     """Merges the partial index from `partfh` into buckets
     based on the first char of the tokens.
+    If `champions` is positive, a high tier of that many
+    postings per token is also written.
+    If `impacts`, the postings also store their quantized tfidf.
+    If `biwords`, the frequent biwords are kept (see merge_partial).
+    If `shard` is given, the partial index is that of the shard, which is
+    merged with the term statistics of every shard (see merge_partial).
     """
+    def path(name):
+        return shard_path(shard, name) if shard is not None else name
+
     start_time = time.time()  # Capture the start time of the merging process
     partfh.seek(0, 0)  # Move the file pointer to the beginning of the file
     try:
-        merge_partial(partfh, MERGEINFO_NAME, BUCKETS_DIR)
+        merge_partial(partfh, path(MERGEINFO_NAME), path(BUCKETS_DIR), path(DOCINFO_NAME), champions, impacts,
+            biwords, doc_freqs, num_docs)
     except Exception as e:
         raise e
         print(f"An error occurred during merging: {e}")
@@ -283,17 +277,65 @@ def make_final(partfh):
     print(f"Elapsed time of merging: {elapsed_time:.2f} seconds")
 
 
-def main(dir, keep_partial):
+def make_shards(dir, keep_partial, champions, biwords, shards):
+    """Makes `shards` document-partitioned shards of the index (in SHARDS_DIR)
+    from a collection of cached pages recursively from the directory (dir).
+    Each shard is laid out like the index and is served by its own search
+    process (see search.py --shard and coordinator.py).
+
+    The shards are always indexed from scratch. They are merged with the
+    term statistics of the whole collection, so that the norms of their
+    documents (and the biwords they keep) are those of a single index.
+    """
+    if os.path.isdir(SHARDS_DIR):
+        shutil.rmtree(SHARDS_DIR)
+    outputs = []
+    for shard in range(shards):
+        os.makedirs(shard_path(shard, BUCKETS_DIR))
+        outputs.append(PartialOutput(
+            open(shard_path(shard, PART_NAME), "w+b"),
+            shard_path(shard, DOCINFO_NAME),
+            shard_path(shard, DOCLINKS_NAME),
+        ))
+
+    print(f"Indexing the pages into {shards} shards.", flush=True)
+    make_partial(dir, outputs, 0, biwords)
+
+    # term statistics of the whole collection
+    doc_freqs = defaultdict(int)
+    num_docs = 0
+    for shard, output in enumerate(outputs):
+        for token, doc_freq in partial_doc_freqs(output.partfh).items():
+            doc_freqs[token] += doc_freq
+        num_docs += len(read_docinfo(shard_path(shard, DOCINFO_NAME)))
+
+    print("Merging partial index files...", flush=True)
+    for shard, output in enumerate(outputs):
+        make_final(output.partfh, champions, False, biwords, shard, doc_freqs, num_docs)
+        output.partfh.close()
+        if not keep_partial:
+            os.remove(shard_path(shard, PART_NAME))
+
+
+def main(dir, keep_partial, champions, impacts, biwords, shards):
     """Makes the index from a collection of cached pages
     recursively from the directory (dir).
 
     :param dir str: The directory
     :param keep_partial bool: Whether partial file should be kept
+    :param champions int: The size of the high tier per token (0 to disable)
+    :param impacts bool: Whether postings should store impacts
+    :param biwords bool: Whether frequent biwords should be indexed
+    :param shards int: The number of shards (0 for a single index)
 
     """
     # setup necessary directories
     setup_dir()
 
+    if shards:
+        make_shards(dir, keep_partial, champions, biwords, shards)
+        return
+
     # setup partial index
     partok = True
     partdoc = 0
@@ -320,11 +362,13 @@ def main(dir, keep_partial):
 
     # if partial index file is not ready, index the pages
     if not partok:
-        make_partial(dir, partfh, partdoc)
+        output = PartialOutput(partfh, DOCINFO_NAME, DOCLINKS_NAME)
+        make_partial(dir, [output], partdoc, biwords)
+        partfh = output.partfh
 
     # Merge the partial index files
     print("Merging partial index files...", flush=True)
-    make_final(partfh)
+    make_final(partfh, champions, impacts, biwords)
 
     partfh.close()
     if not keep_partial:
@@ -340,20 +384,48 @@ if __name__ == "__main__":
 
     dir = None
     keep_partial = False
+    champions = 0
+    impacts = False
+    biwords = False
+    shards = 0
     dirarg = 1
 
-    # optional arg: keep partial
-    if sys.argv[dirarg] == "--keep-partial" or sys.argv[dirarg] == "-p":
-        # keep partial file
-        keep_partial = True
-        dirarg += 1
-
     try:
+        # optional args (before the path to pages)
+        while dirarg < argc - 1:
+            if sys.argv[dirarg] == "--keep-partial" or sys.argv[dirarg] == "-p":
+                # keep partial file
+                keep_partial = True
+                dirarg += 1
+            elif sys.argv[dirarg] == "--champions" or sys.argv[dirarg] == "-c":
+                # size of the high tier per token
+                champions = int(sys.argv[dirarg + 1])
+                assert champions >= 0, USAGE_MSG
+                dirarg += 2
+            elif sys.argv[dirarg] == "--impacts" or sys.argv[dirarg] == "-i":
+                # store quantized impacts in the postings
+                impacts = True
+                dirarg += 1
+            elif sys.argv[dirarg] == "--biwords" or sys.argv[dirarg] == "-b":
+                # index frequent biwords (pairs of adjacent terms)
+                biwords = True
+                dirarg += 1
+            elif sys.argv[dirarg] == "--shards" or sys.argv[dirarg] == "-s":
+                # number of document-partitioned shards
+                shards = int(sys.argv[dirarg + 1])
+                assert shards >= 1, USAGE_MSG
+                dirarg += 2
+            else:
+                break
+
         dir = sys.argv[dirarg]
+        assert dirarg == argc - 1, USAGE_MSG
         assert os.path.isdir(dir), USAGE_MSG
+        # impacts are quantized with the scale of each shard
+        assert not (shards and impacts), USAGE_MSG
     except Exception as e:
         print(USAGE_MSG)
         sys.exit(1)
 
-    main(dir, keep_partial)
+    main(dir, keep_partial, champions, impacts, biwords, shards)
 
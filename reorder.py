@@ -0,0 +1,56 @@
+# reorder.py
+#
+# renumbers the docids of the index by descending static quality
+# and removes the empty documents (pruned pages) from the index
+#
+# run this after compute.py so that the query engine can stop
+# scanning postings once the remaining documents can't make the top k
+#
+# usage: python reorder.py
+
+import os
+import sys
+import time
+from lib.reader import initialize, get_champions, get_num_documents
+from lib.writer import reorder_index, write_champions, update_index_version
+from lib.indexfiles import *
+
+USAGE_MSG = "usage: python reorder.py"
+
+
+def reorder():
+    """Reorders the index by descending static quality.
+    """
+    initialize(
+        docinfo_filename=DOCINFO_NAME,
+        mergeinfo_filename=MERGEINFO_NAME,
+        buckets_dir=BUCKETS_DIR
+    )
+    num_documents = get_num_documents()
+
+    docids = reorder_index(DOCINFO_NAME, DOCLINKS_NAME, MERGEINFO_NAME, BUCKETS_DIR, SUMMARY_NAME)
+    print(f"Renumbered {len(docids)} documents (previously {num_documents} docids).")
+
+    # the high tier is sorted by docid
+    if get_champions():
+        write_champions(DOCINFO_NAME, BUCKETS_DIR, get_champions())
+
+    # once every file is rewritten (see reader.reload_index)
+    update_index_version(MERGEINFO_NAME)
+
+    # the partial index still uses the old docids
+    if os.path.isfile(PART_NAME):
+        os.remove(PART_NAME)
+        print("Removed the partial index file (its docids are outdated).")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 1:
+        print(USAGE_MSG)
+        sys.exit(1)
+
+    print("Reordering the index...")
+    start = time.time()
+    reorder()
+    end = time.time()
+    print(f"Time taken: {end - start:.2f} seconds")
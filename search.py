@@ -8,14 +8,81 @@ import webbrowser
 import threading
 import os
 import sys
-from flask import Flask, request, render_template
-from lib.queryproc import process_query, format_results_web
-from lib.reader import initialize, initialize_summary
+import atexit
+import signal
+from urllib.parse import urldefrag
+from flask import Flask, request, render_template, jsonify
+from lib.queryproc import process_query, process_batch, format_results_web, format_results_json
+from lib.queryproc import enable_result_cache, save_result_cache, get_result_cache_stats
+from lib.queryproc import enable_intersection_cache, get_intersection_cache_stats
+from lib.queryproc import enable_query_log
+from lib.queryproc import shard_term_stats, shard_components, component_norms
+from lib.queryproc import combine_scores, rank_scores
+from lib.reader import initialize, initialize_summary, reload_index, pinned_index, get_index_version
+from lib.reader import get_document
+from lib.reader import set_postings_cache_budget, get_postings_cache_stats
+from lib.reader import enable_shared_postings_cache, get_shared_postings_cache_stats
+from lib.reader import enable_ingestion, add_document, flush_segment, get_segment_stats, has_biwords
+from lib.analyze import extract_page, page_terms
+from lib.warmup import CacheWarmer
+from lib.deadline import query_deadline, get_deadline_stats
+from lib.parallel import enable_parallel
+from lib.prefork import serve_prefork
+from lib.asyncserver import AsyncServer
 from lib.indexfiles import *
 
 app = Flask(__name__)
 
-USAGE_MSG = "usage: python search.py"
+USAGE_MSG = "usage: python search.py [--cache mb] [--persist-cache] [--postings-cache mb]" \
+    " [--intersection-cache mb] [--shared-cache mb] [--query-log] [--warmup s] [--warmup-mb mb] [--workers n]" \
+    " [--deadline ms] [--ingest [--segment-mb mb]] [--processes n | --async [--threads n] [--queue n]]" \
+    " [--shard i] [--host host] [--port port]"
+
+# number of results per page when "all" results are requested
+ALL_PAGE_SIZE = 50
+
+# default memory budget of the result cache (in MB)
+DEFAULT_CACHE_MB = 64
+
+# default memory budget of the postings cache (in MB)
+DEFAULT_POSTINGS_CACHE_MB = 128
+
+# default memory budget of the intersection cache (in MB)
+DEFAULT_INTERSECTION_CACHE_MB = 16
+
+# default time (in seconds) and memory (in MB) budgets of the cache warm-up
+DEFAULT_WARMUP_SECS = 30
+DEFAULT_WARMUP_MB = 64
+
+# default number of results per query of the JSON API
+DEFAULT_API_K = 10
+
+# max number of results per query and of queries per batch of the JSON API
+MAX_API_K = 1000
+MAX_BATCH_QUERIES = 1000
+
+# max number of documents per request of the ingestion API
+MAX_INGEST_DOCUMENTS = 1000
+
+# default size (in MB) at which the live segment of added documents is flushed
+DEFAULT_SEGMENT_MB = 4
+
+# default number of query threads and max queued requests of the asyncio server
+DEFAULT_ASYNC_THREADS = 4
+DEFAULT_ASYNC_QUEUE = 64
+
+# default address of the server
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+
+# latency budget of each request in ms (0 for none)
+deadline_ms = 0
+
+# cache warm-up thread (if the query log is enabled)
+warmer = None
+
+# asyncio server (if enabled)
+server = None
 
 # https://flask.palletsprojects.com/en/3.0.x/
 @app.route("/", methods=["GET", "POST"])
@@ -24,50 +91,449 @@ def search():
     query_time = 0
     query = ""
     total_results = 0
+    num_results = "5"
+    page = 1
+    num_pages = 1
+    match = "all"
+    partial = False
     if request.method == "POST":
         query = request.form.get("query")
         num_results = request.form.get("num_results")
+        match = request.form.get("match", "all")
 
-        all_results = False
-
+        # "all" results are paginated so that only a single page
+        # of results is ranked and materialized per request
         if num_results == "all":
-            all_results = True
+            k = ALL_PAGE_SIZE
+            try:
+                page = max(1, int(request.form.get("page", 1)))
+            except ValueError:
+                page = 1 # not a page number
         else:
-            num_results = int(num_results)
+            k = int(num_results)
+        offset = (page - 1) * k
 
-        start_time = time.time_ns()
-        result = process_query(query)
-        total_results = len(result)
+        with pinned_index(), query_deadline(deadline_ms) as deadline:
+            start_time = time.time_ns()
+            result, total_results = process_query(query, k, offset, disjunctive=(match == "any"))
 
-        end_time = time.time_ns()
-        results = format_results_web(result, num_results if not all_results else total_results, SUMMARY_NAME)
+            end_time = time.time_ns()
+            results = format_results_web(result, k, SUMMARY_NAME, offset)
+            partial = deadline is not None and deadline.partial
         query_time = (end_time - start_time) / 1_000_000
-    return render_template('search.html', results=results, query_time=query_time, query=query, total_results=total_results)
+        if num_results == "all":
+            num_pages = max(1, -(-total_results // k))
+    return render_template('search.html', results=results, query_time=query_time, query=query,
+        total_results=total_results, num_results=num_results, match=match, page=page, num_pages=num_pages,
+        partial=partial)
+
+def api_params(params):
+    """Returns the (k, offset, disjunctive, deadline in ms) of a JSON API
+    request or raises ValueError if they are invalid. A request may shorten
+    the deadline of the server (see "--deadline") but not extend it.
+    """
+    k = int(params.get("k", DEFAULT_API_K))
+    offset = int(params.get("offset", 0))
+    match = params.get("match", "all")
+    budget_ms = float(params.get("deadline_ms", 0))
+    if not 0 < k <= MAX_API_K or offset < 0 or match not in ("all", "any") or budget_ms < 0:
+        raise ValueError(f"k must be in 1..{MAX_API_K}, offset >= 0, match 'all' or 'any'"
+            " and deadline_ms >= 0")
+    if deadline_ms:
+        budget_ms = min(budget_ms, deadline_ms) if budget_ms else deadline_ms
+    return k, offset, match == "any", budget_ms
+
+@app.route("/api/search", methods=["GET", "POST"])
+def api_search():
+    """Returns the results of the query "q" as JSON rows
+    (rank, docid, url, score and summary). "partial" is true
+    if the deadline passed before the query was fully evaluated.
+    """
+    params = request.get_json(silent=True) or request.values
+    query = params.get("q")
+    try:
+        if not isinstance(query, str):
+            raise ValueError("missing query 'q'")
+        k, offset, disjunctive, budget_ms = api_params(params)
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+
+    with pinned_index(), query_deadline(budget_ms) as deadline:
+        start_time = time.time_ns()
+        result, total_results = process_query(query, k, offset, disjunctive=disjunctive)
+        query_time = (time.time_ns() - start_time) / 1_000_000
+        return jsonify(query=query, total=total_results, time_ms=query_time,
+            partial=deadline is not None and deadline.partial, results=format_results_json(result, offset))
+
+@app.route("/api/batch", methods=["POST"])
+def api_batch():
+    """Returns the results of every query of the JSON body
+    {"queries": [...], "k": 10, "offset": 0, "match": "all"}, in order.
+    The queries are evaluated together (see queryproc.process_batch)
+    and share a single deadline.
+    """
+    params = request.get_json(silent=True)
+    try:
+        if not isinstance(params, dict):
+            raise ValueError("expected a JSON object")
+        queries = params.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("'queries' must be a list of strings")
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise ValueError(f"at most {MAX_BATCH_QUERIES} queries per batch")
+        k, offset, disjunctive, budget_ms = api_params(params)
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+
+    with pinned_index(), query_deadline(budget_ms) as deadline:
+        start_time = time.time_ns()
+        answers = process_batch(queries, k, offset, disjunctive=disjunctive)
+        batch_time = (time.time_ns() - start_time) / 1_000_000
+        return jsonify(time_ms=batch_time, partial=deadline is not None and deadline.partial, results=[
+            {"query": query, "total": total_results, "results": format_results_json(result, offset)}
+            for query, (result, total_results) in zip(queries, answers)
+        ])
+
+@app.route("/api/documents", methods=["POST"])
+def api_documents():
+    """Adds the documents of the JSON body {"url": ..., "content": html}
+    or {"documents": [{"url": ..., "content": html}, ...]} to the index
+    (see reader.add_document); they are searched at once. Returns the docid
+    of each document, in order, or an error if it was not added.
+    """
+    if get_segment_stats() is None:
+        return jsonify(error="adding documents is disabled (see --ingest)"), 404
+    params = request.get_json(silent=True)
+    try:
+        if not isinstance(params, dict):
+            raise ValueError("expected a JSON object")
+        documents = params.get("documents", [params])
+        if not isinstance(documents, list) or not all(isinstance(document, dict)
+                and isinstance(document.get("url"), str) and isinstance(document.get("content"), str)
+                for document in documents):
+            raise ValueError("each document must have a 'url' and a 'content' string")
+        if len(documents) > MAX_INGEST_DOCUMENTS:
+            raise ValueError(f"at most {MAX_INGEST_DOCUMENTS} documents per request")
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    start_time = time.time_ns()
+    added = []
+    for document in documents:
+        url = urldefrag(document["url"]).url
+        content = document["content"].strip()
+        if not url or not content:
+            added.append({"url": url, "error": "empty url or content"})
+            continue
+
+        # same content extraction as makeindex.py
+        tokens, ngrams_col, important_tokens, _ = extract_page(content, url)
+        terms, total_tokens, biword_counts = page_terms(tokens, ngrams_col, important_tokens, has_biwords())
+        if not terms:
+            added.append({"url": url, "error": "no text content"})
+            continue
+        docid = add_document(url, terms, total_tokens, biword_counts)
+        if docid is None:
+            added.append({"url": url, "error": "already indexed"})
+        else:
+            added.append({"url": url, "docid": docid})
+    ingest_time = (time.time_ns() - start_time) / 1_000_000
+    return jsonify(time_ms=ingest_time, documents=added)
+
+def shard_params(params):
+    """Returns the (query vector, idfs, disjunctive) of a request of
+    a coordinator or raises ValueError if they are invalid.
+    """
+    if not isinstance(params, dict):
+        raise ValueError("expected a JSON object")
+    frequencies = params.get("terms")
+    idfs = params.get("idfs")
+    match = params.get("match", "all")
+    if not (isinstance(frequencies, dict) and frequencies and isinstance(idfs, dict)
+            and set(idfs) == set(frequencies) and match in ("all", "any")):
+        raise ValueError("'terms' and 'idfs' must map the same tokens and match 'all' or 'any'")
+    return ({str(token): int(freq) for token, freq in frequencies.items()},
+        {str(token): float(idf) for token, idf in idfs.items()}, match == "any")
+
+@app.route("/shard/stats", methods=["POST"])
+def shard_stats():
+    """Returns the number of documents of the shard and the term statistics
+    of the tokens of the JSON body {"tokens": [...]} (see lib/coordinator.py).
+    """
+    params = request.get_json(silent=True)
+    tokens = params.get("tokens") if isinstance(params, dict) else None
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        return jsonify(error="'tokens' must be a list of strings"), 400
+    with pinned_index():
+        return jsonify(version=get_index_version(), **shard_term_stats(tokens))
+
+@app.route("/shard/score", methods=["POST"])
+def shard_score():
+    """Returns the number of documents of the shard that match the query
+    vector of the JSON body {"terms": {...}, "idfs": {...}, "match": "all"}
+    and the norms of their score components (see queryproc.component_norms).
+    """
+    try:
+        frequencies, idfs, disjunctive = shard_params(request.get_json(silent=True))
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+    with pinned_index():
+        components = shard_components(frequencies, idfs, disjunctive)
+        return jsonify(matched=len(components[0]), norms=component_norms(components))
+
+@app.route("/shard/rank", methods=["POST"])
+def shard_rank():
+    """Returns the top "k" documents of the shard for the query vector (like
+    /shard/score), scored with the "norms" of every shard, as JSON rows
+    (docid, url and score).
+    """
+    params = request.get_json(silent=True)
+    try:
+        frequencies, idfs, disjunctive = shard_params(params)
+        k = int(params.get("k", DEFAULT_API_K))
+        norms = params.get("norms")
+        if not isinstance(norms, dict) or len(norms.get("sq_norms", ())) != 5:
+            raise ValueError("missing 'norms'")
+        norms = {'sq_norms': [float(sq_norm) for sq_norm in norms["sq_norms"]],
+            'max_cosine': float(norms.get("max_cosine", 0.0))}
+        if not 0 < k <= MAX_API_K:
+            raise ValueError(f"k must be in 1..{MAX_API_K}")
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+    with pinned_index():
+        components = shard_components(frequencies, idfs, disjunctive)
+        ranked = rank_scores(combine_scores(components, norms), k)
+        return jsonify([
+            {"docid": docid, "url": get_document(docid).url, "score": score}
+            for docid, score in ranked
+        ])
+
+@app.route("/stats")
+def stats():
+    return jsonify(index_version=get_index_version(),
+        result_cache=get_result_cache_stats(), postings_cache=get_postings_cache_stats(),
+        intersection_cache=get_intersection_cache_stats(),
+        shared_postings_cache=get_shared_postings_cache_stats(), deadlines=get_deadline_stats(),
+        segments=get_segment_stats(),
+        warmup=warmer.status() if warmer else None,
+        server=server.stats() if server else None)
 
 def open_browser():
-    webbrowser.open_new("http://127.0.0.1:5000/")
+    webbrowser.open_new(f"http://{host}:{port}/")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 1:
+    cache_mb = DEFAULT_CACHE_MB
+    persist_cache = False
+    postings_cache_mb = DEFAULT_POSTINGS_CACHE_MB
+    intersection_cache_mb = DEFAULT_INTERSECTION_CACHE_MB
+    shared_cache_mb = 0
+    query_log = False
+    warmup_secs = DEFAULT_WARMUP_SECS
+    warmup_mb = DEFAULT_WARMUP_MB
+    workers = 0
+    deadline_ms = 0
+    ingest = False
+    segment_mb = DEFAULT_SEGMENT_MB
+    processes = 0
+    use_async = False
+    async_threads = DEFAULT_ASYNC_THREADS
+    async_queue = DEFAULT_ASYNC_QUEUE
+    shard = None
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    try:
+        arg = 1
+        while arg < len(sys.argv):
+            if sys.argv[arg] == "--cache":
+                # memory budget of the result cache (0 disables it)
+                cache_mb = float(sys.argv[arg + 1])
+                assert cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--persist-cache":
+                # keep the result cache across restarts
+                persist_cache = True
+                arg += 1
+            elif sys.argv[arg] == "--postings-cache":
+                # memory budget of the decoded postings cache
+                postings_cache_mb = float(sys.argv[arg + 1])
+                assert postings_cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--intersection-cache":
+                # memory budget of the intersection cache (0 disables it)
+                intersection_cache_mb = float(sys.argv[arg + 1])
+                assert intersection_cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--shared-cache":
+                # memory budget of the bitmap postings lists shared by the processes (0 disables it)
+                shared_cache_mb = float(sys.argv[arg + 1])
+                assert shared_cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--query-log":
+                # record queries and warm up the caches from them at startup
+                query_log = True
+                arg += 1
+            elif sys.argv[arg] == "--warmup":
+                # time budget of the cache warm-up
+                warmup_secs = float(sys.argv[arg + 1])
+                assert warmup_secs >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--warmup-mb":
+                # memory budget of the postings loaded by the cache warm-up
+                warmup_mb = float(sys.argv[arg + 1])
+                assert warmup_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--workers":
+                # number of worker processes for broad queries (0 disables them)
+                workers = int(sys.argv[arg + 1])
+                assert workers >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--deadline":
+                # latency budget of each request (0 for none)
+                deadline_ms = float(sys.argv[arg + 1])
+                assert deadline_ms >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--ingest":
+                # serve the ingestion API (/api/documents)
+                ingest = True
+                arg += 1
+            elif sys.argv[arg] == "--segment-mb":
+                # size at which the live segment of added documents is flushed
+                segment_mb = float(sys.argv[arg + 1])
+                assert segment_mb > 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--processes":
+                # number of pre-forked server processes (0 runs the development server)
+                processes = int(sys.argv[arg + 1])
+                assert processes >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--async":
+                # asyncio server with bounded concurrency
+                use_async = True
+                arg += 1
+            elif sys.argv[arg] == "--threads":
+                # number of queries evaluated at once by the asyncio server
+                async_threads = int(sys.argv[arg + 1])
+                assert async_threads > 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--queue":
+                # max number of requests waiting for a thread (more are rejected)
+                async_queue = int(sys.argv[arg + 1])
+                assert async_queue >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--shard":
+                # serve a shard of the index (see makeindex.py --shards)
+                shard = int(sys.argv[arg + 1])
+                assert shard >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--host":
+                host = sys.argv[arg + 1]
+                arg += 2
+            elif sys.argv[arg] == "--port":
+                port = int(sys.argv[arg + 1])
+                assert 0 <= port < 65536, USAGE_MSG
+                arg += 2
+            else:
+                raise ValueError(USAGE_MSG)
+        assert not (use_async and processes > 0), USAGE_MSG
+        # added documents are kept in the memory of a single server process
+        assert not (ingest and processes > 0), USAGE_MSG
+    except Exception as e:
         print(USAGE_MSG)
         sys.exit(1)
 
+    if shard is not None:
+        # the files of the shard are laid out like those of the index
+        DOCINFO_NAME, MERGEINFO_NAME, BUCKETS_DIR, SEGMENTS_DIR, SUMMARY_NAME, \
+            RESULT_CACHE_NAME, QUERY_LOG_NAME = (shard_path(shard, name) for name in (
+                DOCINFO_NAME, MERGEINFO_NAME, BUCKETS_DIR, SEGMENTS_DIR, SUMMARY_NAME,
+                RESULT_CACHE_NAME, QUERY_LOG_NAME))
+
     try:
         initialize(
             docinfo_filename=DOCINFO_NAME,
             mergeinfo_filename=MERGEINFO_NAME,
-            buckets_dir=BUCKETS_DIR
+            buckets_dir=BUCKETS_DIR,
+            segments_dir=SEGMENTS_DIR
         )
 
         initialize_summary(SUMMARY_NAME)  
+        set_postings_cache_budget(int(postings_cache_mb * 1024 * 1024))
+        if shared_cache_mb > 0:
+            # mapped before any process is forked
+            enable_shared_postings_cache(int(shared_cache_mb * 1024 * 1024))
 
     except Exception as e:
         print(f"Failed to initialize reader: {e}")
         sys.exit(1)
 
+    if cache_mb > 0:
+        enable_result_cache(int(cache_mb * 1024 * 1024), RESULT_CACHE_NAME if persist_cache else None)
+        if persist_cache and processes == 0:
+            atexit.register(save_result_cache)
+
+    if intersection_cache_mb > 0:
+        enable_intersection_cache(int(intersection_cache_mb * 1024 * 1024))
+
+    if ingest:
+        enable_ingestion(int(segment_mb * 1024 * 1024))
+        atexit.register(flush_segment)
+
+    def start_serving(num=0):
+        """Starts the threads and worker processes of a server process.
+        """
+        global warmer
+
+        # the workers are forked before any other thread is started
+        if workers > 1:
+            enable_parallel(workers)
+
+        signal.signal(signal.SIGHUP, reload_in_background)
+
+        # only the server processes record queries and warm up their caches
+        if query_log:
+            enable_query_log(QUERY_LOG_NAME)
+            warmer = CacheWarmer(QUERY_LOG_NAME, warmup_secs,
+                int(min(warmup_mb, postings_cache_mb) * 1024 * 1024))
+            warmer.start()
+
+    def reload_in_background(signum, frame):
+        """Reloads the index (on SIGHUP) without blocking the requests.
+        """
+        def _reload():
+            if reload_index(warmup_secs):
+                print(f"Reloaded the index (version {get_index_version()})")
+            else:
+                print("The index is up to date")
+        threading.Thread(target=_reload, name="index-reload", daemon=True).start()
+
+    def reload_before_fork():
+        """Reloads the index of the pre-fork parent (on SIGHUP),
+        so that restarted server processes start from it.
+        """
+        reload_index(warmup_secs=0)
+
+    def stop_serving(num):
+        """Saves the result cache of the first server process.
+        """
+        if persist_cache and num == 0:
+            save_result_cache()
+
+    if processes > 0:
+        # production mode: the index loaded above is shared by the server processes
+        serve_prefork(app, host, port, processes, start_serving, stop_serving, reload_before_fork)
+        sys.exit(0)
+
+    if use_async:
+        # production mode: queries are evaluated by a bounded number of threads
+        start_serving()
+        server = AsyncServer(app, host, port, async_threads, async_queue)
+        server.serve_forever()
+        sys.exit(0)
+
     # Check WERKZEUG_RUN_MAIN Environment Variable to ensure
     # that the server is only started once
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_serving()
         threading.Timer(1.25, open_browser).start()
 
-    app.run(debug=True)
+    app.run(host=host, port=port, debug=True)
@@ -4,23 +4,55 @@
 # retrieves documents based on query
 
 # import query.abc
+import os
 import sys
+import json
 import math
+import atexit
 import time
+import functools
+import multiprocessing
 import numpy as np
 from nltk.stem import PorterStemmer
 from collections import defaultdict
 from lib.reader import get_num_nonempty_documents, get_postings, initialize, get_document
+from lib.reader import set_postings_cache_budget, get_postings_cache_stats
+from lib.reader import get_term_stats, batch_postings
 from lib.stopwords import is_stopword
 from lib.indexfiles import *
 from lib.tokenize import *
 import lib.queryproc as queryproc
+from lib.warmup import CacheWarmer
+from lib.parallel import enable_parallel
 
-USAGE_MSG = "usage: python searcht.py"
+USAGE_MSG = "usage: python searcht.py [--any] [--cache mb] [--persist-cache] [--postings-cache mb]" \
+    " [--intersection-cache mb] [--query-log] [--warmup s] [--warmup-mb mb] [--workers n]" \
+    " [--batch path/to/queries|- [--output path] [--format tsv|jsonl] [-k k] [--jobs n]]"
 
-def run_server():
+# default memory budget of the result cache (in MB)
+DEFAULT_CACHE_MB = 64
+
+# default memory budget of the postings cache (in MB)
+DEFAULT_POSTINGS_CACHE_MB = 128
+
+# default memory budget of the intersection cache (in MB)
+DEFAULT_INTERSECTION_CACHE_MB = 16
+
+# default time (in seconds) and memory (in MB) budgets of the cache warm-up
+DEFAULT_WARMUP_SECS = 30
+DEFAULT_WARMUP_MB = 64
+
+# default number of results per query in batch mode
+DEFAULT_BATCH_K = 10
+
+# number of queries evaluated together by a batch worker
+# (each postings list is read at most once per chunk)
+BATCH_CHUNK = 500
+
+def run_server(disjunctive=False):
     """Runs the server as a long running process
     that constantly accepts user input (from the local machine).
+    If disjunctive, documents that match any query term are returned.
     """
     while True:
         query = input("Enter query:")
@@ -30,28 +62,246 @@ def run_server():
 
         print("-" * 50)
         start_time = time.time_ns()  # Start timing using time_ns() for higher precision
-        result = queryproc.process_query(query)
+        result, total_results = queryproc.process_query(query, 5, disjunctive=disjunctive)
         end_time = time.time_ns()  # End timing
         print("-" * 50)
 
-        print(f"Number of results: {len(result)}")
+        print(f"Number of results: {total_results}")
         for result in queryproc.format_results_tty(result, 5):
             print(result)
 
         query_time = (end_time - start_time) / 1_000_000  # Convert nanoseconds to milliseconds
         print(f"Query time: {query_time:.2f} milliseconds")
+
+        cache_stats = queryproc.get_result_cache_stats()
+        if cache_stats:
+            print(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['entries']} entries, {cache_stats['bytes'] / 1024:.1f} KB")
+        postings_stats = get_postings_cache_stats()
+        print(f"Postings cache: {postings_stats['hits']} hits, {postings_stats['misses']} misses, "
+            f"{postings_stats['evictions']} evictions, {postings_stats['bytes'] / 1024 / 1024:.1f} MB")
+        intersection_stats = queryproc.get_intersection_cache_stats()
+        if intersection_stats:
+            print(f"Intersection cache: {intersection_stats['hits']} hits, {intersection_stats['misses']} misses, "
+                f"{intersection_stats['entries']} entries, {intersection_stats['bytes'] / 1024:.1f} KB")
         print(f"{'-' * 50}\n\n")
 
 
+def read_batch(fh, disjunctive=False):
+    """Returns the (query, disjunctive) of each non-empty line.
+    Lines in the format of the query log ("all" or "any", a tab and the query)
+    keep their match mode; other lines use `disjunctive`.
+    """
+    cases = []
+    for line in fh:
+        mode, sep, query = line.rstrip('\n').partition('\t')
+        if sep and mode in ('all', 'any'):
+            cases.append((query, mode == 'any'))
+        elif line.strip():
+            cases.append((line.strip(), disjunctive))
+    return cases
+
+
+def group_queries(cases):
+    """Returns the cases as (index, query, disjunctive) ordered so that
+    the queries that share their longest postings list are next to each other.
+    """
+    keys = []
+    for i, (query, disjunctive) in enumerate(cases):
+        frequencies = queryproc.prepare_query(query)
+        longest = max(frequencies, key=lambda token: get_term_stats(token)[0], default='')
+        keys.append((longest, i))
+    keys.sort()
+    return [(i, *cases[i]) for _, i in keys]
+
+
+def evaluate_chunk(chunk, k):
+    """Returns the (index, results, total, latency in s) of each case of
+    the chunk, evaluated together so that each postings list is read once.
+    """
+    answers = []
+    with batch_postings():
+        for i, query, disjunctive in chunk:
+            start_time = time.perf_counter()
+            result, total_results = queryproc.process_query(query, k, disjunctive=disjunctive)
+            answers.append((i, result, total_results, time.perf_counter() - start_time))
+    return answers
+
+
+def run_batch(cases, outfh, output_format, k, jobs):
+    """Evaluates the (query, disjunctive) cases with `jobs` worker processes
+    and writes their top k results to outfh (as TSV rows or JSON lines),
+    in the order they complete. Each result is identified by the index
+    (qid) of its query. Prints the throughput and latency percentiles.
+    """
+    start_time = time.perf_counter()
+    ordered = group_queries(cases)
+    size = max(1, min(BATCH_CHUNK, -(-len(ordered) // jobs)))
+    chunks = [ordered[i:i + size] for i in range(0, len(ordered), size)]
+    evaluate = functools.partial(evaluate_chunk, k=k)
+
+    if output_format == "tsv":
+        outfh.write("qid\tquery\tmatch\trank\tdocid\tscore\turl\n")
+
+    latencies = []
+    pool = multiprocessing.get_context('fork').Pool(jobs) if jobs > 1 else None
+    try:
+        for answers in (pool.imap_unordered(evaluate, chunks) if pool else map(evaluate, chunks)):
+            for i, result, total_results, latency in answers:
+                query, disjunctive = cases[i]
+                match = "any" if disjunctive else "all"
+                rows = queryproc.format_results_json(result)
+                if output_format == "tsv":
+                    query = " ".join(query.split())
+                    for row in rows:
+                        outfh.write(f"{i}\t{query}\t{match}\t{row['rank']}\t{row['docid']}"
+                            f"\t{row['score']:.6f}\t{row['url']}\n")
+                else:
+                    outfh.write(json.dumps({"qid": i, "query": query, "match": match, "total": total_results,
+                        "time_ms": round(latency * 1000, 3), "results": rows}) + "\n")
+                latencies.append(latency)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    outfh.flush()
+
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+    def _percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    print(f"{len(latencies)} queries in {elapsed:.2f} s ({len(latencies) / elapsed:.1f} queries/s)"
+        f" with {jobs} jobs", file=sys.stderr)
+    print(f"Latency: p50 {_percentile(0.50):.2f} ms, p90 {_percentile(0.90):.2f} ms,"
+        f" p99 {_percentile(0.99):.2f} ms, max {_percentile(1.0):.2f} ms", file=sys.stderr)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 1:
+    disjunctive = False
+    cache_mb = DEFAULT_CACHE_MB
+    persist_cache = False
+    postings_cache_mb = DEFAULT_POSTINGS_CACHE_MB
+    intersection_cache_mb = DEFAULT_INTERSECTION_CACHE_MB
+    query_log = False
+    warmup_secs = DEFAULT_WARMUP_SECS
+    warmup_mb = DEFAULT_WARMUP_MB
+    workers = 0
+    batch_filename = None
+    output_filename = None
+    output_format = "tsv"
+    batch_k = DEFAULT_BATCH_K
+    jobs = os.cpu_count() or 1
+    try:
+        arg = 1
+        while arg < len(sys.argv):
+            if sys.argv[arg] == "--any":
+                # match any query term
+                disjunctive = True
+                arg += 1
+            elif sys.argv[arg] == "--cache":
+                # memory budget of the result cache (0 disables it)
+                cache_mb = float(sys.argv[arg + 1])
+                assert cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--persist-cache":
+                # keep the result cache across restarts
+                persist_cache = True
+                arg += 1
+            elif sys.argv[arg] == "--postings-cache":
+                # memory budget of the decoded postings cache
+                postings_cache_mb = float(sys.argv[arg + 1])
+                assert postings_cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--intersection-cache":
+                # memory budget of the intersection cache (0 disables it)
+                intersection_cache_mb = float(sys.argv[arg + 1])
+                assert intersection_cache_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--query-log":
+                # record queries and warm up the caches from them at startup
+                query_log = True
+                arg += 1
+            elif sys.argv[arg] == "--warmup":
+                # time budget of the cache warm-up
+                warmup_secs = float(sys.argv[arg + 1])
+                assert warmup_secs >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--warmup-mb":
+                # memory budget of the postings loaded by the cache warm-up
+                warmup_mb = float(sys.argv[arg + 1])
+                assert warmup_mb >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--workers":
+                # number of worker processes for broad queries (0 disables them)
+                workers = int(sys.argv[arg + 1])
+                assert workers >= 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--batch":
+                # evaluate the queries of the file ("-" for stdin) and exit
+                batch_filename = sys.argv[arg + 1]
+                arg += 2
+            elif sys.argv[arg] == "--output":
+                # file of the batch results (stdout by default)
+                output_filename = sys.argv[arg + 1]
+                arg += 2
+            elif sys.argv[arg] == "--format":
+                # format of the batch results
+                output_format = sys.argv[arg + 1]
+                assert output_format in ("tsv", "jsonl"), USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "-k":
+                # number of results per query of the batch
+                batch_k = int(sys.argv[arg + 1])
+                assert batch_k > 0, USAGE_MSG
+                arg += 2
+            elif sys.argv[arg] == "--jobs":
+                # number of worker processes of the batch
+                jobs = int(sys.argv[arg + 1])
+                assert jobs > 0, USAGE_MSG
+                arg += 2
+            else:
+                raise ValueError(USAGE_MSG)
+    except Exception as e:
         print(USAGE_MSG)
         sys.exit(1)
 
     initialize(
         docinfo_filename=DOCINFO_NAME,
         mergeinfo_filename=MERGEINFO_NAME,
-        buckets_dir=BUCKETS_DIR
+        buckets_dir=BUCKETS_DIR,
+        segments_dir=SEGMENTS_DIR
     )
+    set_postings_cache_budget(int(postings_cache_mb * 1024 * 1024))
+
+    # the workers are forked before any other thread is started
+    # (batch jobs evaluate each query serially instead)
+    if workers > 1 and (batch_filename is None or jobs == 1):
+        enable_parallel(workers)
+
+    if cache_mb > 0:
+        queryproc.enable_result_cache(int(cache_mb * 1024 * 1024), RESULT_CACHE_NAME if persist_cache else None)
+        if persist_cache:
+            atexit.register(queryproc.save_result_cache)
+
+    if intersection_cache_mb > 0:
+        queryproc.enable_intersection_cache(int(intersection_cache_mb * 1024 * 1024))
+
+    if batch_filename is not None:
+        if batch_filename == "-":
+            cases = read_batch(sys.stdin, disjunctive)
+        else:
+            with open(batch_filename, 'r', encoding='utf-8', errors='replace') as batchfh:
+                cases = read_batch(batchfh, disjunctive)
+        if output_filename is None:
+            run_batch(cases, sys.stdout, output_format, batch_k, jobs)
+        else:
+            with open(output_filename, 'w', encoding='utf-8') as outfh:
+                run_batch(cases, outfh, output_format, batch_k, jobs)
+        sys.exit(0)
+
+    if query_log:
+        queryproc.enable_query_log(QUERY_LOG_NAME)
+        CacheWarmer(QUERY_LOG_NAME, warmup_secs,
+            int(min(warmup_mb, postings_cache_mb) * 1024 * 1024)).start()
 
-    run_server()
+    run_server(disjunctive)
@@ -0,0 +1,120 @@
+# stresstest.py
+#
+# checks that queries evaluated by many threads at once
+# return the same results as when they are evaluated serially
+#
+# usage: python stresstest.py [-t threads] [-r rounds] [path/to/queries]
+
+import sys
+import time
+import random
+import threading
+from lib.reader import initialize, set_postings_cache_budget, clear_postings_cache
+from lib.indexfiles import *
+import lib.queryproc as queryproc
+
+USAGE_MSG = "usage: python stresstest.py [-t threads] [-r rounds] [path/to/queries]"
+
+QUERIES_NAME = "rsrc/queries.txt"
+
+# small postings cache so that the threads keep reading
+# (and evicting) postings lists concurrently
+STRESS_POSTINGS_CACHE_BYTES = 1024 * 1024
+
+# number of results compared per query
+STRESS_K = 20
+
+
+def run_queries(cases):
+    """Returns the (docids, total) results of each (query, disjunctive) case.
+    """
+    results = []
+    for query, disjunctive in cases:
+        result, total = queryproc.process_query(query, STRESS_K, disjunctive=disjunctive)
+        results.append(([docid for docid, _ in result], total))
+    return results
+
+
+def stress(cases, num_threads, rounds):
+    """Evaluates the cases serially, then `rounds` times per thread in a
+    random order with `num_threads` threads at once. Returns the time (ms)
+    of the concurrent evaluation along with the results that differ from the
+    serial results as (case, result, expected) tuples and the exceptions raised.
+    """
+    expected = run_queries(cases)
+    clear_postings_cache()
+
+    mismatches = []
+    errors = []
+    lock = threading.Lock()
+
+    def _worker(seed):
+        order = list(range(len(cases))) * rounds
+        random.Random(seed).shuffle(order)
+        try:
+            for i in order:
+                result = run_queries([cases[i]])[0]
+                if result != expected[i]:
+                    with lock:
+                        mismatches.append((cases[i], result, expected[i]))
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=_worker, args=(seed,)) for seed in range(num_threads)]
+    start_time = time.time_ns()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = (time.time_ns() - start_time) / 1_000_000
+
+    return elapsed, mismatches, errors
+
+
+if __name__ == "__main__":
+    argc = len(sys.argv)
+    num_threads = 8
+    rounds = 3
+    queries_filename = QUERIES_NAME
+
+    try:
+        arg = 1
+        while arg < argc and sys.argv[arg] in ("-t", "-r"):
+            value = int(sys.argv[arg + 1])
+            assert value > 0, USAGE_MSG
+            if sys.argv[arg] == "-t":
+                num_threads = value
+            else:
+                rounds = value
+            arg += 2
+        if arg < argc:
+            queries_filename = sys.argv[arg]
+            arg += 1
+        assert arg == argc, USAGE_MSG
+    except Exception as e:
+        print(USAGE_MSG)
+        sys.exit(1)
+
+    initialize(
+        docinfo_filename=DOCINFO_NAME,
+        mergeinfo_filename=MERGEINFO_NAME,
+        buckets_dir=BUCKETS_DIR
+    )
+    set_postings_cache_budget(STRESS_POSTINGS_CACHE_BYTES)
+
+    with open(queries_filename, 'r', encoding='utf-8') as queriesfh:
+        queries = [line.strip() for line in queriesfh if line.strip()]
+    cases = [(query, disjunctive) for query in queries for disjunctive in (False, True)]
+
+    elapsed, mismatches, errors = stress(cases, num_threads, rounds)
+
+    print(f"{num_threads * rounds * len(cases)} queries with {num_threads} threads in {elapsed:.2f} ms")
+    for (query, disjunctive), result, expected in mismatches[:10]:
+        print(f"MISMATCH {query!r} ({'any' if disjunctive else 'all'}): "
+            f"{result[1]} results {result[0][:5]} instead of {expected[1]} results {expected[0][:5]}")
+    for error in errors[:10]:
+        print(f"ERROR {error!r}")
+    print(f"{len(mismatches)} mismatches, {len(errors)} errors")
+
+    sys.exit(1 if mismatches or errors else 0)
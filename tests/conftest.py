@@ -0,0 +1,126 @@
+# tests/conftest.py
+#
+# fixture indexes built by makeindex.py from small generated collections
+#
+# run the tests from the root of the repository (lib/stopwords.py reads
+# rsrc/stopwords.txt from the working directory): python -m pytest
+
+import os
+import sys
+import json
+import random
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import reader
+from lib.indexfiles import *
+
+NUM_PAGES = 90
+NUM_BASE_PAGES = 60 # pages of the index that the others are added to (see test_ingestion.py)
+NUM_SHARDS = 3
+
+WORDS = ("machine learning computer science uci ics graph binary tree python notes quantum computing"
+    " policy academic data management research study lab algorithm notation student course").split()
+VOCABULARY = WORDS + [f"w{i}" for i in range(200)]
+
+
+def make_pages(num_pages, seed=1):
+    """Returns the (url, html) of generated pages, which mostly use a few
+    common words (so that queries match many of them) and link each other.
+    """
+    rng = random.Random(seed)
+    pages = []
+    for i in range(num_pages):
+        body = " ".join(rng.choice(WORDS) if rng.random() < 0.4 else rng.choice(VOCABULARY)
+            for _ in range(rng.randint(20, 200)))
+        links = "".join(f'<a href="https://site{rng.randrange(num_pages)}.edu/">link</a>' for _ in range(3))
+        title = " ".join(rng.sample(WORDS, 3))
+        pages.append((f"https://site{i}.edu/", f"<html><head><title>{title}</title></head>"
+            f"<body><h1>{rng.choice(WORDS)}</h1><p>{body}</p>{links}</body></html>"))
+    return pages
+
+
+def build_index(root, pages, *args):
+    """Builds the index of the pages in the directory `root`
+    with makeindex.py (and its arguments).
+    """
+    pagedir = os.path.join(root, "pages")
+    os.makedirs(pagedir)
+    for i, (url, html) in enumerate(pages):
+        with open(os.path.join(pagedir, f"{i}.json"), "w") as fh:
+            json.dump({"url": url, "content": html}, fh)
+    os.symlink(os.path.join(ROOT, "rsrc"), os.path.join(root, "rsrc"))
+    return run_script(root, "makeindex.py", *args, "pages")
+
+
+def run_script(root, script, *args):
+    """Runs the script of the repository (i.e. compute.py) on the index
+    built in `root`.
+    """
+    subprocess.run([sys.executable, os.path.join(ROOT, script), *args], cwd=root,
+        check=True, stdout=subprocess.DEVNULL)
+    return root
+
+
+def open_index(root, shard=None, segments=False):
+    """Opens the index built in `root` (or one of its shards, or with its segments)."""
+    def path(name):
+        return os.path.join(root, name if shard is None else shard_path(shard, name))
+    return reader.Index(path(DOCINFO_NAME), path(MERGEINFO_NAME), path(BUCKETS_DIR),
+        reader.DEFAULT_POSTINGS_CACHE_BYTES, path(SEGMENTS_DIR) if segments else None)
+
+
+def use_index(monkeypatch, index):
+    """Makes the opened index the current index of the reader
+    (until the end of the test).
+    """
+    monkeypatch.setattr(reader, "_CURRENT", index)
+    monkeypatch.setattr(reader, "_initialized", True)
+
+
+@pytest.fixture(scope="session")
+def pages():
+    return make_pages(NUM_PAGES)
+
+
+@pytest.fixture(scope="session")
+def single_root(tmp_path_factory, pages):
+    return build_index(str(tmp_path_factory.mktemp("single")), pages)
+
+
+@pytest.fixture(scope="session")
+def sharded_root(tmp_path_factory, pages):
+    return build_index(str(tmp_path_factory.mktemp("sharded")), pages, "--shards", str(NUM_SHARDS))
+
+
+@pytest.fixture(scope="session")
+def base_root(tmp_path_factory, pages):
+    return build_index(str(tmp_path_factory.mktemp("base")), pages[:NUM_BASE_PAGES])
+
+
+@pytest.fixture
+def single_index(monkeypatch, single_root):
+    """The index of every page, as the current index of the reader."""
+    index = open_index(single_root)
+    use_index(monkeypatch, index)
+    yield index
+    index.close()
+
+
+@pytest.fixture(scope="session")
+def computed_root(tmp_path_factory, pages):
+    """The index of every page with its PageRank and HITS scores (see compute.py)."""
+    return run_script(build_index(str(tmp_path_factory.mktemp("computed")), pages), "compute.py")
+
+
+@pytest.fixture(scope="session")
+def computed_sharded_root(tmp_path_factory, pages):
+    """The shards of every page with the PageRank and HITS scores of the whole
+    collection (see compute.py --shards).
+    """
+    root = build_index(str(tmp_path_factory.mktemp("computed_sharded")), pages, "--shards", str(NUM_SHARDS))
+    return run_script(root, "compute.py", "--shards")
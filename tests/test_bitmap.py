@@ -0,0 +1,108 @@
+# tests/test_bitmap.py
+#
+# bitmap postings lists (see lib/bitmap.py) against the postings they
+# store, and intersections of the bitmaps against plain intersections
+
+import random
+
+import pytest
+
+from lib import reader
+from lib.bitmap import sbitmap_rd, spostings_rd, spostings_repr, and_bits, iter_bits
+from lib.posting import Posting
+from lib.structs import BufferCursor
+from lib.queryproc import prepare_query, postings_set, postings_bitmaps
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python w150 notes"]
+
+
+def fields(postings):
+    return [(posting.docid, posting.tf, posting.fields) for posting in postings]
+
+
+def make_postings(docids, seed=1):
+    rng = random.Random(seed)
+    return [Posting(docid, rng.randint(1, 50), rng.randrange(4), rng.randrange(256)) for docid in sorted(docids)]
+
+
+def read_bitmap(postings):
+    """Returns the postings stored as a bitmap and read back as BitmapPostings."""
+    cursor = BufferCursor(spostings_repr(postings, bitmap=True))
+    cursor.read(4) # num_postings
+    bitmap, _ = sbitmap_rd(cursor, len(postings))
+    return bitmap
+
+
+@pytest.fixture(scope="module")
+def postings():
+    # an array container, a bitmap container (more than 4096 docids)
+    # and a container past an empty one
+    rng = random.Random(2)
+    docids = (set(rng.sample(range(1, 1 << 16), 500)) | set(rng.sample(range(1 << 16, 2 << 16), 6000))
+        | set(rng.sample(range(3 << 16, 4 << 16), 20)))
+    return make_postings(docids)
+
+
+def test_bitmap_stores_the_postings(postings):
+    stored = spostings_repr(postings, bitmap=True)
+    decoded, size = spostings_rd(BufferCursor(stored))
+    assert size == len(stored)
+    assert fields(decoded) == fields(postings)
+
+
+def test_bitmap_finds_postings_by_docid(postings):
+    bitmap = read_bitmap(postings)
+    assert len(bitmap) == len(postings)
+    by_docid = {posting.docid: posting for posting in postings}
+    rng = random.Random(3)
+    for docid in rng.sample(sorted(by_docid), 200) + rng.sample(range(4 << 16), 200):
+        posting = bitmap.posting(docid)
+        if docid in by_docid:
+            assert fields([posting]) == fields([by_docid[docid]])
+            assert bitmap.rank(docid) == postings.index(by_docid[docid])
+        else:
+            assert posting is None
+    for lo, hi in [(0, 1 << 20), (1000, 70000), (65536, 131072), (131072, 3 << 16), (200000, 200001)]:
+        assert fields(bitmap.postings_range(lo, hi)) == fields([p for p in postings if lo <= p.docid < hi])
+
+
+def test_and_bits_intersects(postings):
+    other = make_postings(random.Random(4).sample(range(1, 3 << 16), 9000), seed=2)
+    bits = and_bits(read_bitmap(postings).bits, read_bitmap(other).bits)
+    assert list(iter_bits(bits)) == sorted({p.docid for p in postings} & {p.docid for p in other})
+
+
+def plain_intersection(tokenset):
+    """Returns the {docid: {token: (docid, tf, fields)}} of the documents
+    that contain every token, from their decoded postings lists.
+    """
+    lists = {token: {posting.docid: posting for posting in reader.get_postings(token)} for token in tokenset}
+    docids = set.intersection(*(set(postings) for postings in lists.values()))
+    return {docid: {token: fields([lists[token][docid]])[0] for token in tokenset} for docid in docids}
+
+
+def as_fields(docid_postings):
+    return {docid: {token: fields([posting])[0] for token, posting in vec.items()}
+        for docid, vec in docid_postings.items()}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_index_bitmaps_store_the_postings(single_index, query):
+    for token in prepare_query(query):
+        bitmap = reader.get_bitmap_postings(token)
+        assert bitmap is not None # every query term is dense
+        assert fields(bitmap.postings()) == fields(reader.get_postings(token))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_bitmap_intersection_matches_plain(single_index, query):
+    tokenset = set(prepare_query(query))
+    expected = plain_intersection(tokenset)
+    docid_postings, token_postings = postings_set(tokenset)
+    assert as_fields(docid_postings) == expected
+    assert all(len(postings) == len(expected) for postings in token_postings.values())
+    # with the first token looked up in its postings list instead
+    bitmaps = {token: reader.get_bitmap_postings(token) for token in tokenset}
+    bitmaps[sorted(tokenset)[0]] = None
+    docid_postings, _ = postings_bitmaps(tokenset, bitmaps)
+    assert as_fields(docid_postings) == expected
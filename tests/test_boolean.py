@@ -0,0 +1,91 @@
+# tests/test_boolean.py
+#
+# boolean queries against the exhaustive evaluation of a single index
+# and phrases against the biwords they are matched with
+
+import pytest
+
+from lib.reader import get_postings, has_biwords
+from lib.tokenize import biword
+from lib.queryproc import prepare_query, evaluate_query, evaluate_boolean
+from conftest import build_index, open_index, use_index
+
+
+@pytest.fixture(scope="module")
+def biwords_root(tmp_path_factory, pages):
+    return build_index(str(tmp_path_factory.mktemp("biwords")), pages, "--biwords")
+
+
+def exhaustive(query, disjunctive=False):
+    """Returns every result of the query, scored by a single index
+    without the high tier or top-k retrieval.
+    """
+    return evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+
+
+def docids(query):
+    """Returns the docids of the documents that contain the (single) term."""
+    token, = prepare_query(query)
+    return {posting.docid for posting in get_postings(token)}
+
+
+def assert_same_results(results, expected):
+    """Asserts that the results have the same total and score the same
+    documents the same (documents of equal scores may be ranked in any order).
+    """
+    (ranked, total), (expected_ranked, expected_total) = results, expected
+    assert total == expected_total
+    scores = dict(ranked)
+    assert scores == pytest.approx(dict(expected_ranked))
+    assert [score for _, score in ranked] == sorted(scores.values(), reverse=True)
+
+
+@pytest.mark.parametrize("terms", [("machine", "learning"), ("data", "research", "student"), ("quantum", "w7")])
+def test_and_matches_conjunctive(single_index, terms):
+    assert_same_results(evaluate_boolean(" AND ".join(terms)), exhaustive(" ".join(terms)))
+    # terms next to each other are AND-ed
+    assert_same_results(evaluate_boolean("(" + " ".join(terms) + ")"), exhaustive(" ".join(terms)))
+
+
+@pytest.mark.parametrize("terms", [("machine", "learning"), ("quantum", "w7", "w42")])
+def test_or_matches_disjunctive(single_index, terms):
+    ranked, total = evaluate_boolean(" OR ".join(terms))
+    expected_ranked, _ = exhaustive(" ".join(terms), disjunctive=True)
+    # the disjunctive total is estimated, the boolean one is exact
+    assert total == len(set().union(*(docids(term) for term in terms)))
+    assert_same_results((ranked, total), (expected_ranked, total))
+
+
+def test_not_and_parentheses(single_index):
+    ranked, total = evaluate_boolean("(machine OR quantum) learning NOT python")
+    expected = (docids("machine") | docids("quantum")) & docids("learning") - docids("python")
+    assert expected
+    assert total == len(expected)
+    assert {docid for docid, _ in ranked} == expected
+    assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+
+
+def test_pagination(single_index):
+    ranked, total = evaluate_boolean("machine OR learning")
+    page, page_total = evaluate_boolean("machine OR learning", k=5, offset=5)
+    assert page_total == total
+    assert page == ranked[5:10]
+
+
+def test_phrase_matches_its_terms(single_index):
+    # without biwords, a phrase is the conjunction of its terms
+    assert_same_results(evaluate_boolean('"machine tree"'), exhaustive("machine tree"))
+
+
+def test_phrase_requires_indexed_biwords(monkeypatch, biwords_root):
+    index = open_index(biwords_root)
+    use_index(monkeypatch, index)
+    try:
+        assert has_biwords()
+        ranked, total = evaluate_boolean('"machine tree"')
+        adjacent = {posting.docid for posting in get_postings(biword(*prepare_query("machine tree")))}
+        assert adjacent and adjacent < docids("machine") & docids("tree")
+        assert total == len(adjacent)
+        assert {docid for docid, _ in ranked} == adjacent
+    finally:
+        index.close()
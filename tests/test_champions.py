@@ -0,0 +1,67 @@
+# tests/test_champions.py
+#
+# queries answered from the high tier (see makeindex.py --champions)
+# against the exhaustive evaluation of the full postings lists
+
+import pytest
+
+from lib import reader
+from lib.writer import champion_score
+from lib.queryproc import prepare_query, evaluate_query, postings_set
+from conftest import build_index, run_script, open_index, use_index
+
+CHAMPIONS = 20
+K = 5
+
+QUERIES = ["machine learning", "data research", "student course", "python notes", "quantum computing",
+    "graph", "algorithm notation", "science", "policy academic", "binary tree"]
+
+
+@pytest.fixture(scope="module")
+def champions_root(tmp_path_factory, pages):
+    root = build_index(str(tmp_path_factory.mktemp("champions")), pages, "--champions", str(CHAMPIONS))
+    return run_script(root, "compute.py") # the high tier ranks by static quality
+
+
+@pytest.fixture
+def champions_index(monkeypatch, champions_root):
+    index = open_index(champions_root)
+    use_index(monkeypatch, index)
+    yield index
+    index.close()
+
+
+def test_high_tier_holds_the_top_postings(champions_index):
+    for query in QUERIES:
+        for token in prepare_query(query):
+            postings = reader.get_postings(token)
+            champions, doc_freq = reader.get_champion_postings(token)
+            assert doc_freq == len(postings)
+            assert len(champions) == min(CHAMPIONS, len(postings))
+            scores = sorted((champion_score(posting, reader.get_document(posting.docid))
+                for posting in postings), reverse=True)
+            assert sorted((champion_score(posting, reader.get_document(posting.docid))
+                for posting in champions), reverse=True) == pytest.approx(scores[:len(champions)])
+
+
+def test_high_tier_recall(champions_index):
+    recalls = []
+    for query in QUERIES:
+        frequencies = prepare_query(query)
+        exhaustive, total = evaluate_query(frequencies, k=None, tiered=False)
+        tiered, _ = evaluate_query(frequencies, k=K, tiered=True)
+        expected = {docid for docid, _ in exhaustive[:K]}
+        # the results of the high tier are documents that match the query
+        assert {docid for docid, _ in tiered} <= {docid for docid, _ in exhaustive}
+        assert len(tiered) == min(K, total)
+        recalls.append(len({docid for docid, _ in tiered} & expected) / len(expected))
+    # the high tier mostly finds the top results (see tierreport.py)
+    assert sum(recalls) / len(recalls) >= 0.5
+
+
+def test_high_tier_falls_back_to_full_lists(champions_index):
+    frequencies = prepare_query("python notes")
+    # too few documents match every term in the high tier
+    assert len(postings_set(frequencies.keys(), tiered=True)[0]) < K
+    exhaustive, total = evaluate_query(frequencies, k=None, tiered=False)
+    assert evaluate_query(frequencies, k=K, tiered=True) == (exhaustive[:K], total)
@@ -0,0 +1,56 @@
+# tests/test_concurrency.py
+#
+# postings and results read by many threads at once (see lib/reader.py)
+# against those read serially
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import reader
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import WORDS, NUM_PAGES
+
+NUM_THREADS = 8
+ROUNDS = 4
+
+# small enough for the threads to keep reading (and evicting) postings lists
+POSTINGS_CACHE_BYTES = 16 * 1024
+
+WORDS_READ = WORDS[:12] + ["w1", "w7", "w42", "w150"]
+QUERIES = ["machine learning", "data research student", "quantum w7", "python notes", "w42"]
+
+
+def read_postings(token):
+    return [(posting.docid, posting.tf, posting.fields) for posting in reader.get_postings(token)]
+
+
+def read_range(token):
+    lo, hi = NUM_PAGES // 3, 2 * NUM_PAGES // 3
+    return [(posting.docid, posting.tf, posting.fields) for posting in reader.get_postings_range(token, lo, hi)]
+
+
+def run_query(query, disjunctive):
+    return evaluate_query(prepare_query(query), k=10, disjunctive=disjunctive, tiered=False)
+
+
+def test_threads_read_like_serial(single_index):
+    tokens = sorted(set().union(*(prepare_query(word) for word in WORDS_READ)))
+    cases = ([(read_postings, (token,)) for token in tokens]
+        + [(read_range, (token,)) for token in tokens]
+        + [(run_query, (query, disjunctive)) for query in QUERIES for disjunctive in (False, True)])
+
+    single_index.postings_cache.resize(POSTINGS_CACHE_BYTES)
+    expected = [read(*args) for read, args in cases]
+    assert all(expected)
+    single_index.postings_cache.clear()
+
+    def worker(seed):
+        order = list(range(len(cases))) * ROUNDS
+        random.Random(seed).shuffle(order)
+        return [(i, cases[i][0](*cases[i][1])) for i in order]
+
+    with ThreadPoolExecutor(NUM_THREADS) as executor:
+        for results in executor.map(worker, range(NUM_THREADS)):
+            for i, result in results:
+                assert result == expected[i], cases[i]
+    assert single_index.postings_cache.stats()['evictions'] > 0
@@ -0,0 +1,88 @@
+# tests/test_deadline.py
+#
+# queries evaluated within a deadline (see lib/deadline.py) against
+# the exhaustive evaluation: the same results if the deadline is not hit,
+# and the results of the work done until then if it is
+
+import pytest
+
+from lib import parallel
+from lib import queryproc
+from lib import reader
+from lib import wand
+from lib.deadline import query_deadline
+from lib.parallel import docid_ranges
+from lib.queryproc import prepare_query, evaluate_query, process_query, score_range, combine_scores
+from conftest import NUM_PAGES
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "computer"]
+
+
+def run(query, disjunctive, k=None):
+    return evaluate_query(prepare_query(query), k=k, disjunctive=disjunctive, tiered=False)
+
+
+@pytest.fixture
+def small_steps(monkeypatch, single_index):
+    """Checks the deadline every few steps, and scores conjunctive queries
+    in several docid ranges (like queries with a deadline on a large index).
+    """
+    monkeypatch.setattr(queryproc, "deadline_range_postings", 1)
+    monkeypatch.setattr(parallel, "BLOCK_DOCIDS", NUM_PAGES // 6)
+    monkeypatch.setattr(wand, "CHECK_STEPS", 5)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_results_within_the_deadline_are_exhaustive(small_steps, query, disjunctive):
+    expected = run(query, disjunctive)
+    with query_deadline(60000) as deadline:
+        ranked, total = run(query, disjunctive)
+    assert not deadline.partial
+    assert total == expected[1]
+    assert dict(ranked) == pytest.approx(dict(expected[0]))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_conjunctive_results_past_the_deadline_are_the_first_range(small_steps, query):
+    frequencies = prepare_query(query)
+    expected, expected_total = run(query, False)
+    with query_deadline(60000) as deadline:
+        deadline.at = 0 # passed (the first range is always scored)
+        ranked, total = run(query, False)
+    assert deadline.partial
+
+    # every match of the first range, scored over the matches of that range
+    cost = sum(reader.get_term_stats(token)[0] for token in frequencies)
+    lo, hi = docid_ranges(reader.get_num_documents(), cost)[0]
+    assert {docid for docid, _ in ranked} == {docid for docid, _ in expected if lo <= docid < hi}
+    scores = combine_scores(score_range(frequencies, reader.get_index_version(), None, lo, hi))
+    assert dict(ranked) == pytest.approx(scores)
+    assert [score for _, score in ranked] == sorted(scores.values(), reverse=True)
+    assert total == pytest.approx(expected_total, rel=0.5) # estimated from the range
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_disjunctive_results_past_the_deadline_are_partial(small_steps, query):
+    expected, _ = run(query, True)
+    with query_deadline(60000) as deadline:
+        deadline.at = 0 # passed (WAND stops at its first check)
+        ranked, total = run(query, True)
+    assert deadline.partial
+    assert ranked and len(ranked) < len(expected)
+    assert {docid for docid, _ in ranked} < {docid for docid, _ in expected}
+    assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+    assert total >= len(ranked)
+
+
+def test_partial_results_are_not_cached(monkeypatch, small_steps):
+    monkeypatch.setattr(queryproc, "_RESULT_CACHE", None)
+    queryproc.enable_result_cache(1 << 20)
+    with query_deadline(60000) as deadline:
+        deadline.at = 0
+        partial, _ = process_query("machine learning", 10, tiered=False)
+    assert deadline.partial
+    ranked, total = process_query("machine learning", 10, tiered=False)
+    expected, expected_total = run("machine learning", False, k=10)
+    assert (ranked, total) == (expected, expected_total)
+    assert ranked != partial
@@ -0,0 +1,82 @@
+# tests/test_impacts.py
+#
+# an impact-scored index (see writer.write_impacts) against the tfidf
+# of its postings and against exact scoring of the same collection
+
+import pytest
+
+from lib import reader
+from lib.params import importance
+from lib.wand import wand_topk
+from lib.writer import term_idf, quantize_impact, IMPACT_LEVELS
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import build_index, open_index, use_index
+
+QUERIES = ["machine learning", "data research student", "quantum w7 w42", "python w150"]
+
+
+@pytest.fixture(scope="module")
+def impacts_root(tmp_path_factory, pages):
+    return build_index(str(tmp_path_factory.mktemp("impacts")), pages, "--impacts")
+
+
+@pytest.fixture
+def impacts_index(monkeypatch, impacts_root):
+    index = open_index(impacts_root)
+    use_index(monkeypatch, index)
+    yield index
+    index.close()
+
+
+def query_idfs(query):
+    return {token: term_idf(reader.get_term_stats(token)[0], reader.get_num_nonempty_documents())
+        for token in prepare_query(query)}
+
+
+def tfidf(posting, idf):
+    return posting.tf / reader.get_document(posting.docid).total_tokens * idf * importance[posting.fields['important']]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_impacts_quantize_the_tfidf(impacts_index, query):
+    assert reader.has_impacts()
+    scale = reader.get_impact_unit() * IMPACT_LEVELS
+    for token, idf in query_idfs(query).items():
+        postings = reader.get_postings(token)
+        assert [posting.fields['impact'] for posting in postings] == [
+            quantize_impact(tfidf(posting, idf), scale) for posting in postings]
+        assert max(posting.fields['impact'] for posting in postings) <= reader.get_max_impact(token)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_wand_matches_exhaustive_impact_sums(impacts_index, query, k):
+    idfs = query_idfs(query)
+    sums = {}
+    for token in idfs:
+        for posting in reader.get_postings(token):
+            sums[posting.docid] = sums.get(posting.docid, 0) + posting.fields['impact']
+    expected = sorted(sums.values(), reverse=True)[:k]
+    results, _ = wand_topk(idfs, k)
+    assert [score for score, _, _ in results] == expected
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_scores_are_close_to_exact_scores(impacts_index, single_root, query, disjunctive):
+    def evaluate(index):
+        with reader._pinned(index):
+            ranked, total = evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+            return {reader.get_document(docid).url: score for docid, score in ranked}, total
+
+    exact = open_index(single_root)
+    try:
+        expected_scores, expected_total = evaluate(exact)
+    finally:
+        exact.close()
+    scores, total = evaluate(impacts_index)
+    assert total == expected_total
+    assert scores.keys() == expected_scores.keys()
+    # each term's tfidf is rounded up by less than an impact unit, which
+    # only shifts the scores a little (they also depend on the vector norms)
+    assert scores == pytest.approx(expected_scores, rel=0.05)
@@ -0,0 +1,117 @@
+# tests/test_ingestion.py
+#
+# documents added to an index (see reader.add_document) against a single
+# index built from every page
+#
+# the added documents are scored with the idfs of the index when they were
+# added and have no static quality, so only the matches are compared
+
+import os
+import shutil
+
+import pytest
+
+import search
+from lib import reader
+from lib.indexfiles import SEGMENTS_DIR
+from lib.segment import load_segments
+from lib.queryproc import prepare_query, evaluate_query, evaluate_boolean
+from conftest import NUM_BASE_PAGES, open_index, use_index
+
+# small enough for the added documents to be flushed to a few segments
+FLUSH_BYTES = 16 * 1024
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "w42"]
+BOOLEAN_QUERIES = ["machine OR quantum", "(machine OR quantum) learning NOT python"]
+
+
+def matches(index, query, boolean=False):
+    """Returns the URLs of the documents that match the query and its total."""
+    with reader._pinned(index):
+        if boolean:
+            ranked, total = evaluate_boolean(query)
+        else:
+            ranked, total = evaluate_query(prepare_query(query), k=None, tiered=False)
+        return {reader.get_document(docid).url for docid, _ in ranked}, total
+
+
+@pytest.fixture
+def ingested(monkeypatch, tmp_path, base_root, pages):
+    """The index of the first pages, to which the others were added,
+    as the current index of the reader.
+    """
+    root = shutil.copytree(base_root, tmp_path / "index", symlinks=True)
+    index = open_index(root, segments=True)
+    use_index(monkeypatch, index)
+    monkeypatch.setattr(reader, "_FLUSH_BYTES", None)
+    reader.enable_ingestion(FLUSH_BYTES)
+
+    response = search.app.test_client().post("/api/documents", json={"documents": [
+        {"url": url, "content": html} for url, html in pages[NUM_BASE_PAGES:]]})
+    assert response.status_code == 200
+    documents = response.get_json()["documents"]
+    assert all("docid" in document for document in documents), documents
+    yield root, index
+    index.close()
+
+
+def test_adds_documents(ingested, pages):
+    _, index = ingested
+    assert index.segments[0].frozen # flushed
+    with reader._pinned(index):
+        assert reader.get_num_documents() == len(pages)
+        # an indexed URL (of the index or of a segment) is not added again
+        for url, _ in (pages[0], pages[-1]):
+            assert reader.add_document(url, {"machine": (1, False)}, 1) is None
+
+
+@pytest.mark.parametrize("query, boolean", [(query, False) for query in QUERIES]
+    + [(query, True) for query in BOOLEAN_QUERIES])
+def test_matches_single_index(ingested, single_root, pages, query, boolean):
+    _, index = ingested
+    single = open_index(single_root)
+    try:
+        urls, total = matches(single, query, boolean)
+        assert urls - {url for url, _ in pages[:NUM_BASE_PAGES]} # some added documents match
+        assert matches(index, query, boolean) == (urls, total)
+    finally:
+        single.close()
+
+
+def test_reopened_segments(ingested, single_root):
+    root, _ = ingested
+    reader.flush_segment()
+    reopened = open_index(root, segments=True)
+    single = open_index(single_root)
+    try:
+        for query in QUERIES:
+            assert matches(reopened, query) == matches(single, query)
+    finally:
+        reopened.close()
+        single.close()
+
+
+def test_outdated_segments_of_a_rebuilt_index(ingested, tmp_path, single_root, pages, capsys):
+    root, _ = ingested
+    reader.flush_segment()
+    segments_dir = os.path.join(root, SEGMENTS_DIR)
+    num_segments = len(os.listdir(segments_dir))
+
+    # the index rebuilt from every page has the documents of the segments
+    rebuilt = shutil.copytree(single_root, tmp_path / "rebuilt", symlinks=True)
+    shutil.copytree(segments_dir, os.path.join(rebuilt, SEGMENTS_DIR))
+    index = open_index(rebuilt, segments=True)
+    single = open_index(single_root)
+    try:
+        assert index.segments == ()
+        assert capsys.readouterr().err.count("Dropped outdated segment") == num_segments
+        for query in QUERIES:
+            assert matches(index, query) == matches(single, query)
+    finally:
+        index.close()
+        single.close()
+
+    # an index rebuilt without them would lose them
+    urls = {url for url, _ in pages[:NUM_BASE_PAGES + 1]}
+    with pytest.raises(ValueError, match="not in the index"):
+        load_segments(segments_dir, NUM_BASE_PAGES + 1, urls)
@@ -0,0 +1,89 @@
+# tests/test_intersectioncache.py
+#
+# the intersection cache (see lib/intersectioncache.py) and conjunctive
+# queries matched from it against queries matched without it
+
+import pytest
+
+from lib import queryproc
+from lib import reader
+from lib.intersectioncache import IntersectionCache
+from lib.queryproc import prepare_query, evaluate_query, postings_set, pair_candidates
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python w150 notes",
+    "learning machine", "student data"]
+DOCIDS = list(range(10))
+
+
+def entry_nbytes(cache):
+    return cache.stats()['bytes'] // cache.stats()['entries']
+
+
+def test_cheap_entries_are_evicted_first():
+    probe = IntersectionCache(1 << 20, 1)
+    probe.put(("a", "b"), DOCIDS, 1, 1)
+    cache = IntersectionCache(2 * entry_nbytes(probe) + 1, 1)
+    cache.put(("a", "b"), DOCIDS, 1000, 1)
+    cache.put(("a", "c"), DOCIDS, 10, 1)
+    cache.put(("a", "d"), DOCIDS, 500, 1)
+    assert cache.get([("a", "c")], 1) is None
+    assert cache.get([("a", "b")], 1)[0] == ("a", "b")
+    assert cache.get([("a", "d")], 1)[0] == ("a", "d")
+    assert cache.stats()['evictions'] == 1
+
+
+def test_smallest_intersection_is_used():
+    cache = IntersectionCache(1 << 20, 1)
+    cache.put(("a", "b"), DOCIDS, 10, 1)
+    cache.put(("b", "c"), DOCIDS[:3], 10, 1)
+    key, docids = cache.get([("a", "b"), ("a", "c"), ("b", "c")], 1)
+    assert key == ("b", "c") and list(docids) == DOCIDS[:3]
+
+
+def test_entries_of_older_versions_are_dropped():
+    cache = IntersectionCache(1 << 20, 1)
+    cache.put(("a", "b"), DOCIDS, 10, 1)
+    assert cache.get([("a", "b")], 2) is None
+    cache.put(("a", "b"), DOCIDS, 10, 1) # intersected on the older version
+    assert cache.get([("a", "b")], 2) is None
+
+
+def fields(docid_postings):
+    return {docid: {token: (posting.docid, posting.tf, posting.fields) for token, posting in vec.items()}
+        for docid, vec in docid_postings.items()}
+
+
+@pytest.fixture
+def intersection_cache(monkeypatch, single_index):
+    monkeypatch.setattr(queryproc, "_INTERSECTION_CACHE", None)
+    queryproc.enable_intersection_cache(1 << 20)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_pairs_are_intersected_like_the_postings_lists(intersection_cache, query):
+    tokenset = set(prepare_query(query))
+    lists = {token: {posting.docid for posting in reader.get_postings(token)} for token in tokenset}
+    # with each pair of dense and sparse lists (a sparse list is read as postings)
+    for sparse in [(), tuple(sorted(tokenset)[:1]), tuple(tokenset)]:
+        queryproc._INTERSECTION_CACHE.clear()
+        bitmaps = {token: None if token in sparse else reader.get_bitmap_postings(token) for token in tokenset}
+        docids, found = pair_candidates(tokenset, bitmaps)
+        first, second = sorted(tokenset, key=lambda token: reader.get_term_stats(token)[0])[:2]
+        assert docids == sorted(lists[first] & lists[second])
+        for token, postings in found.items():
+            assert [posting.docid for posting in postings] == docids
+        # and from the cache
+        cached, found = pair_candidates(tokenset, bitmaps)
+        assert list(cached) == docids and not found
+
+
+def test_queries_match_like_without_the_cache(monkeypatch, single_index):
+    def run():
+        return ([fields(postings_set(set(prepare_query(query)))[0]) for query in QUERIES],
+            [evaluate_query(prepare_query(query), k=None, tiered=False) for query in QUERIES])
+
+    monkeypatch.setattr(queryproc, "_INTERSECTION_CACHE", None)
+    expected = run()
+    queryproc.enable_intersection_cache(1 << 20)
+    assert run() == run() == expected
+    assert queryproc.get_intersection_cache_stats()['hits'] > 0
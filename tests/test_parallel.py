@@ -0,0 +1,62 @@
+# tests/test_parallel.py
+#
+# conjunctive queries scored over docid ranges by worker processes
+# (see lib/parallel.py) against the serial evaluation
+
+import pytest
+
+from lib import parallel
+from lib import queryproc
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import NUM_PAGES
+
+NUM_WORKERS = 3
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python w150 notes", "computer"]
+
+
+def run(query):
+    return evaluate_query(prepare_query(query), k=None, tiered=False)
+
+
+@pytest.fixture
+def workers(monkeypatch, single_index):
+    """Worker processes that score every query in NUM_WORKERS ranges
+    (the ranges are not aligned to the rank blocks of the small index).
+    """
+    monkeypatch.setattr(parallel, "parallel_postings_per_worker", 1)
+    monkeypatch.setattr(parallel, "BLOCK_DOCIDS", NUM_PAGES // NUM_WORKERS // 2)
+    monkeypatch.setattr(parallel, "_POOL", None)
+    parallel.enable_parallel(NUM_WORKERS)
+    pool = parallel._POOL
+    yield pool
+    pool.terminate()
+    pool.join()
+
+
+def test_ranges_cover_the_docids(workers):
+    ranges = parallel.docid_ranges(NUM_PAGES, NUM_WORKERS)
+    assert len(ranges) == NUM_WORKERS
+    assert ranges[0][0] <= 1 and ranges[-1][1] > NUM_PAGES
+    assert all(hi == lo for (_, hi), (lo, _) in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_parallel_matches_serial(monkeypatch, workers, query):
+    parts = []
+    map_ranges = parallel.map_ranges
+    def record(func, args, ranges):
+        parts.append(ranges)
+        return map_ranges(func, args, ranges)
+    monkeypatch.setattr(queryproc, "map_ranges", record)
+
+    ranked, total = run(query)
+    assert parts and len(parts[0]) == NUM_WORKERS # scored by the workers
+
+    monkeypatch.setattr(parallel, "_POOL", None)
+    expected, expected_total = run(query)
+    monkeypatch.setattr(parallel, "_POOL", workers)
+
+    assert total == expected_total
+    assert dict(ranked) == pytest.approx(dict(expected))
+    assert [docid for docid, _ in ranked] == [docid for docid, _ in expected]
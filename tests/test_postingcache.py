@@ -0,0 +1,71 @@
+# tests/test_postingcache.py
+#
+# the postings cache (see lib/postingcache.py): TinyLFU admission, SLRU
+# eviction, and results read through a small cache against an unbounded one
+
+import pytest
+
+from lib.postingcache import PostingCache
+from lib.queryproc import prepare_query, evaluate_query
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python notes", "w42"]
+
+
+def test_hot_entries_survive_a_scan():
+    cache = PostingCache(10 * 100)
+    for key in range(5):
+        cache.put(key, key, 100)
+        cache.get(key) # promoted to the protected segment
+    for key in range(100, 200): # one-off keys
+        if cache.get(key) is None:
+            cache.put(key, key, 100)
+    assert all(cache.get(key) == key for key in range(5))
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_infrequent_keys_are_not_admitted():
+    cache = PostingCache(2 * 100)
+    for key in ("a", "b"):
+        cache.put(key, key, 100)
+        for _ in range(3):
+            cache.get(key)
+    cache.get("c")
+    cache.put("c", "c", 100) # less frequent than every victim
+    assert cache.get("c") is None
+    assert cache.stats()['rejections'] == 1
+    for _ in range(5):
+        cache.get("c")
+    cache.put("c", "c", 100) # now more frequent than a victim
+    assert cache.get("c") == "c"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_too_large_are_rejected():
+    cache = PostingCache(100)
+    cache.put("a", "a", 101)
+    assert cache.get("a") is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_resize_evicts():
+    cache = PostingCache(10 * 100)
+    for key in range(10):
+        cache.put(key, key, 100)
+    cache.resize(3 * 100)
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['bytes'] <= 3 * 100
+
+
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_small_cache_gives_the_same_results(single_index, disjunctive):
+    def run():
+        return [evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+            for query in QUERIES]
+
+    single_index.postings_cache.resize(1 << 30)
+    expected = run()
+    single_index.postings_cache.clear()
+    single_index.postings_cache.resize(8 * 1024)
+    assert run() == run() == expected
+    stats = single_index.postings_cache.stats()
+    assert stats['evictions'] + stats['rejections'] > 0
@@ -0,0 +1,74 @@
+# tests/test_reload.py
+#
+# reloading the index (see reader.reload_index) once reorder.py has
+# rewritten it, against the index it was rewritten from
+
+import os
+import shutil
+
+import pytest
+
+from lib import reader
+from lib.indexfiles import *
+from lib.writer import write_summary
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import run_script, open_index, use_index
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python notes"]
+REWRITTEN = [DOCINFO_NAME, DOCLINKS_NAME, SUMMARY_NAME]
+
+
+def exhaustive(query):
+    """Returns the (url, score) of every result of the query."""
+    ranked, total = evaluate_query(prepare_query(query), k=None, tiered=False)
+    return {reader.get_document(docid).url: score for docid, score in ranked}, total
+
+
+@pytest.fixture
+def root(tmp_path, computed_root):
+    root = shutil.copytree(computed_root, tmp_path / "index", symlinks=True)
+    with open(os.path.join(root, SUMMARY_NAME), 'wb') as summaryfh:
+        for docid in range(1, 11):
+            write_summary(docid, f"summary {docid}", summaryfh)
+    return str(root)
+
+
+def test_reorder_replaces_the_files(root):
+    # files opened before the reorder keep their contents
+    handles = [open(os.path.join(root, name), 'rb') for name in REWRITTEN]
+    try:
+        before = [fh.read() for fh in handles]
+        run_script(root, "reorder.py")
+        for fh, contents in zip(handles, before):
+            fh.seek(0)
+            assert fh.read() == contents
+    finally:
+        for fh in handles:
+            fh.close()
+    assert not [name for name in os.listdir(os.path.join(root, INDEX_DIR)) if name.endswith(".tmp")]
+
+
+def test_reload_swaps_in_the_reordered_index(monkeypatch, root):
+    index = open_index(root)
+    index.load_summary(os.path.join(root, SUMMARY_NAME))
+    use_index(monkeypatch, index)
+    summaries = {reader.get_document(docid).url: reader.get_summary(docid) for docid in range(1, 11)}
+    expected = [exhaustive(query) for query in QUERIES]
+    assert not reader.reload_index(warmup_secs=0) # not modified
+
+    run_script(root, "reorder.py")
+    with reader.pinned_index():
+        assert reader.reload_index(warmup_secs=0)
+        # queries in flight keep reading the index they started on
+        assert [exhaustive(query) for query in QUERIES] == expected
+    assert index._closed
+    assert reader.is_quality_ordered()
+    for query, (scores, total) in zip(QUERIES, expected):
+        reloaded_scores, reloaded_total = exhaustive(query)
+        assert reloaded_total == total
+        assert reloaded_scores == pytest.approx(scores)
+    for docid in range(1, reader.get_num_documents() + 1):
+        url = reader.get_document(docid).url
+        if url in summaries:
+            assert reader.get_summary(docid) == summaries[url]
+    reader._CURRENT.close()
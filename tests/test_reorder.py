@@ -0,0 +1,77 @@
+# tests/test_reorder.py
+#
+# an index reordered by static quality (see reorder.py) against the
+# index it was reordered from, and early termination on it (see lib/wand.py)
+
+import shutil
+
+import pytest
+
+from lib import reader
+from lib.document import static_quality
+from lib.wand import conjunctive_topk
+from lib.writer import term_idf
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import run_script, open_index, use_index
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python notes", "graph"]
+
+
+@pytest.fixture(scope="module")
+def reordered_root(tmp_path_factory, computed_root):
+    root = shutil.copytree(computed_root, tmp_path_factory.mktemp("reordered") / "index", symlinks=True)
+    return run_script(root, "reorder.py")
+
+
+@pytest.fixture
+def reordered_index(monkeypatch, reordered_root):
+    index = open_index(reordered_root)
+    use_index(monkeypatch, index)
+    yield index
+    index.close()
+
+
+def exhaustive(index, query):
+    """Returns the (url, score) of every result of the query."""
+    with reader._pinned(index):
+        ranked, total = evaluate_query(prepare_query(query), k=None, tiered=False)
+        return {reader.get_document(docid).url: score for docid, score in ranked}, total
+
+
+def test_docids_by_static_quality(reordered_index):
+    assert reader.is_quality_ordered()
+    qualities = [static_quality(reader.get_document(docid)) for docid in range(1, reader.get_num_documents() + 1)]
+    assert qualities == sorted(qualities, reverse=True)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_same_results_as_before(reordered_index, computed_root, query):
+    computed = open_index(computed_root)
+    try:
+        scores, total = exhaustive(reordered_index, query)
+        expected_scores, expected_total = exhaustive(computed, query)
+    finally:
+        computed.close()
+    assert total == expected_total
+    assert scores == pytest.approx(expected_scores)
+
+
+def query_idfs(query):
+    return {token: term_idf(reader.get_term_stats(token)[0], reader.get_num_nonempty_documents())
+        for token in prepare_query(query)}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_early_termination_finds_the_top_k(reordered_index, query):
+    idfs = query_idfs(query)
+    every, _, stop_docid = conjunctive_topk(idfs, reader.get_num_documents())
+    assert stop_docid is None
+    results, _, _ = conjunctive_topk(idfs, 3)
+    assert [score for score, _, _ in results] == pytest.approx([score for score, _, _ in every[:3]])
+
+
+def test_early_termination_stops(reordered_index):
+    idfs = query_idfs("graph")
+    _, num_matched, stop_docid = conjunctive_topk(idfs, 1)
+    assert stop_docid is not None
+    assert num_matched < reader.get_term_stats(*idfs)[0]
@@ -0,0 +1,80 @@
+# tests/test_resultcache.py
+#
+# the result cache (see lib/resultcache.py) and cached evaluation against
+# the evaluation of the index
+
+import pytest
+
+from lib import queryproc
+from lib.resultcache import ResultCache
+from lib.queryproc import prepare_query, evaluate_query, process_query
+
+KEY = (0, (("machin", 1), ("learn", 1)))
+RESULTS = [(docid, 1.0 / docid) for docid in range(1, 21)]
+
+
+def test_smaller_depths_are_served_from_a_deeper_entry():
+    cache = ResultCache(1 << 20, 1)
+    cache.put(KEY, 20, RESULTS, 100, 1)
+    assert cache.get(KEY, 5, 1) == (RESULTS[:5], 100)
+    assert cache.get(KEY, 20, 1) == (RESULTS, 100)
+    assert cache.get(KEY, 30, 1) is None # more results may match
+    # a shallower evaluation does not replace the deeper entry
+    cache.put(KEY, 5, RESULTS[:5], 100, 1)
+    assert cache.get(KEY, 20, 1) == (RESULTS, 100)
+
+
+def test_complete_entries_serve_any_depth():
+    cache = ResultCache(1 << 20, 1)
+    cache.put(KEY, 50, RESULTS, 20, 1)
+    assert cache.get(KEY, 100, 1) == (RESULTS, 20)
+
+
+def test_entries_of_older_versions_are_dropped():
+    cache = ResultCache(1 << 20, 1)
+    cache.put(KEY, 20, RESULTS, 100, 1)
+    assert cache.get(KEY, 5, 2) is None
+    cache.put(KEY, 20, RESULTS, 100, 1) # evaluated on the older version
+    assert cache.get(KEY, 5, 2) is None
+
+
+def test_saved_cache_is_loaded(tmp_path):
+    filename = str(tmp_path / "resultcache")
+    cache = ResultCache(1 << 20, 1, filename)
+    cache.put(KEY, 20, RESULTS, 100, 1)
+    cache.save()
+    assert ResultCache(1 << 20, 1, filename).get(KEY, 20, 1) == (RESULTS, 100)
+    assert ResultCache(1 << 20, 2, filename).get(KEY, 20, 2) is None # outdated file
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:len(data) // 2], # truncated
+    lambda data: data[:14] + b"\xff" * 4 + data[18:], # corrupt number of terms
+    lambda data: data + b"\x00", # trailing bytes
+])
+def test_damaged_file_is_ignored(tmp_path, damage):
+    filename = str(tmp_path / "resultcache")
+    cache = ResultCache(1 << 20, 1, filename)
+    cache.put(KEY, 20, RESULTS, 100, 1)
+    cache.save()
+    with open(filename, "rb") as fh:
+        data = fh.read()
+    with open(filename, "wb") as fh:
+        fh.write(damage(data))
+    cache = ResultCache(1 << 20, 1, filename)
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_cached_results_match_the_index(monkeypatch, single_index, disjunctive):
+    monkeypatch.setattr(queryproc, "_RESULT_CACHE", None)
+    queryproc.enable_result_cache(1 << 20)
+    for query in ["machine learning", "data research student", "quantum w7"]:
+        expected, total = evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+        # every page size and page, in an order that hits deeper entries
+        for k, offset in [(20, 0), (5, 0), (5, 10), (10, 10), (50, 0), (3, 40)]:
+            ranked, cached_total = process_query(query, k, offset, disjunctive=disjunctive, tiered=False)
+            assert [docid for docid, _ in ranked] == [docid for docid, _ in expected[offset:offset + k]]
+            if not disjunctive:
+                assert cached_total == total
+    assert queryproc.get_result_cache_stats()['hits'] > 0
@@ -0,0 +1,19 @@
+# tests/test_search.py
+#
+# the web interface of search.py
+
+import search
+
+
+def test_all_results_are_paginated(single_index):
+    client = search.app.test_client()
+    response = client.post("/", data={"query": "machine learning", "num_results": "all", "page": "2"})
+    assert response.status_code == 200
+    assert b"Page 2 of" in response.data
+
+
+def test_invalid_page_falls_back_to_first(single_index):
+    client = search.app.test_client()
+    response = client.post("/", data={"query": "machine learning", "num_results": "all", "page": "two"})
+    assert response.status_code == 200
+    assert b"Page 1 of" in response.data
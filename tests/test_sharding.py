@@ -0,0 +1,110 @@
+# tests/test_sharding.py
+#
+# queries over the shards of the index (see lib/coordinator.py) against
+# the exhaustive evaluation of a single index of the same pages, both as
+# built by makeindex.py and with the scores of compute.py
+
+import threading
+
+import pytest
+
+import search
+from lib import reader
+from lib.coordinator import Coordinator
+from lib.queryproc import prepare_query, evaluate_query
+from conftest import NUM_SHARDS, open_index, use_index
+
+
+class LocalCoordinator(Coordinator):
+    """Coordinator that sends the requests of each shard to the routes of
+    search.py with the index of the shard, in this process.
+    """
+    def __init__(self, indexes):
+        super().__init__([f"http://shard{shard}" for shard in range(len(indexes))], timeout=5)
+        self.indexes = indexes
+        self._client = search.app.test_client()
+        self._lock = threading.Lock() # the shards take turns at being the current index
+
+    def _post(self, shard, path, body):
+        with self._lock:
+            reader._CURRENT = self.indexes[shard]
+            response = self._client.post(path, json=body)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+
+
+@pytest.fixture(params=["makeindex", "compute"])
+def roots(request):
+    """The roots of the shards and of the single index of the pages, as built
+    by makeindex.py or with the PageRank and HITS scores of compute.py.
+    """
+    if request.param == "makeindex":
+        return request.getfixturevalue("sharded_root"), request.getfixturevalue("single_root")
+    return request.getfixturevalue("computed_sharded_root"), request.getfixturevalue("computed_root")
+
+
+@pytest.fixture
+def single(roots):
+    index = open_index(roots[1])
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def coordinator(monkeypatch, roots):
+    indexes = [open_index(roots[0], shard) for shard in range(NUM_SHARDS)]
+    use_index(monkeypatch, indexes[0])
+    yield LocalCoordinator(indexes)
+    for index in indexes:
+        index.close()
+
+
+def exhaustive(index, query, disjunctive):
+    """Returns the (url, score) of every result of the query and its total,
+    evaluated by a single index without the high tier or top-k retrieval.
+    """
+    with reader._pinned(index):
+        ranked, total = evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+        matched = len(set().union(*(
+            {posting.docid for posting in reader.get_postings(token)} for token in prepare_query(query))))
+        return [(reader.get_document(docid).url, score) for docid, score in ranked], total, matched
+
+
+@pytest.mark.parametrize("query", ["machine learning", "data research student", "quantum w7", "w42"])
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_matches_single_index(coordinator, single, query, disjunctive):
+    expected, total, matched = exhaustive(single, query, disjunctive)
+    results, shard_total, partial = coordinator.search(query, k=1000, disjunctive=disjunctive)
+    assert expected and not partial
+    # the shards count their matches exactly (a single index estimates disjunctive ones)
+    assert shard_total == (matched if disjunctive else total)
+    scores = {result["url"]: result["score"] for result in results}
+    assert len(scores) == len(results)
+    assert scores == pytest.approx(dict(expected))
+    assert [result["score"] for result in results] == sorted(scores.values(), reverse=True)
+
+
+def test_static_qualities_match_single_index(coordinator, single):
+    def qualities(documents):
+        return {(document.url, name): getattr(document, name) for document in documents if not document.empty
+            for name in ("pr_quality", "hub_quality", "auth_quality")}
+    shards = {}
+    for index in coordinator.indexes:
+        shards.update(qualities(index.docinfo))
+    assert shards == pytest.approx(qualities(single.docinfo))
+
+
+def test_pagination(coordinator):
+    results, total, _ = coordinator.search("machine learning", k=20)
+    page, page_total, _ = coordinator.search("machine learning", k=5, offset=5)
+    assert page_total == total
+    assert [result["score"] for result in page] == pytest.approx([result["score"] for result in results[5:10]])
+
+
+def test_no_matches(coordinator):
+    assert coordinator.search("zzzunmatched", k=10) == ([], 0, False)
+
+
+def test_boolean_query_is_rejected(coordinator):
+    with pytest.raises(ValueError):
+        coordinator.search("machine AND learning", k=10)
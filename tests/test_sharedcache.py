@@ -0,0 +1,89 @@
+# tests/test_sharedcache.py
+#
+# bitmap postings lists shared between forked processes (see
+# lib/sharedcache.py) against the postings lists decoded by each process
+
+import multiprocessing
+
+import pytest
+
+from lib import reader
+from lib.sharedcache import SharedPostingCache, remove_shared_caches, shared_cache_prefix
+from lib.queryproc import prepare_query, evaluate_query
+
+QUERIES = ["machine learning", "data research student", "quantum w7", "python w150 notes"]
+
+
+def fields(postings):
+    return [(posting.docid, posting.tf, posting.fields) for posting in postings]
+
+
+def read_lists(tokens):
+    """Returns the postings of the bitmaps of the tokens read from
+    the shared cache (or None for a bitmap kept privately).
+    """
+    bitmaps = {token: reader.get_bitmap_postings(token) for token in tokens}
+    return {token: fields(bitmap.postings()) if isinstance(bitmap.bits, memoryview) else None
+        for token, bitmap in bitmaps.items()}
+
+
+def run_queries(disjunctive):
+    return [evaluate_query(prepare_query(query), k=None, disjunctive=disjunctive, tiered=False)
+        for query in QUERIES]
+
+
+def test_arena_is_shared_between_processes(tmp_path):
+    lock = multiprocessing.get_context('fork').Lock()
+    path = str(tmp_path / "arena")
+    cache = SharedPostingCache(1 << 16, path, lock)
+    assert bytes(cache.put(b"a", b"12", b"34")) == b"1234"
+
+    def child(conn):
+        other = SharedPostingCache(1 << 16, path, lock)
+        conn.send((bytes(other.get(b"a")), other.get(b"b")))
+        other.put(b"b", b"5678")
+        other.close()
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.get_context('fork').Process(target=child, args=(child_conn,))
+    process.start()
+    assert parent_conn.recv() == (b"1234", None)
+    process.join()
+    assert bytes(cache.get(b"b")) == b"5678"
+    # a value that does not fit is not shared
+    assert cache.put(b"c", bytes(1 << 17)) is None
+    cache.close()
+
+
+@pytest.fixture
+def shared_cache(monkeypatch, single_index):
+    monkeypatch.setattr(reader, "_SHARED_CACHE", None)
+    expected = run_queries(False), run_queries(True)
+    single_index.postings_cache.clear()
+    reader.enable_shared_postings_cache(1 << 24)
+    yield expected
+    single_index.close() # before its arena is removed
+    remove_shared_caches(shared_cache_prefix())
+
+
+def test_forked_processes_read_the_shared_bitmaps(single_index, shared_cache):
+    tokens = sorted(set().union(*(prepare_query(query) for query in QUERIES)))
+    shared = read_lists(tokens) # shared by this process
+    assert shared == {token: fields(reader.get_postings(token)) for token in tokens}
+
+    def child(conn):
+        single_index.postings_cache.clear()
+        before = reader.get_shared_postings_cache_stats() # inherited counts
+        lists = read_lists(tokens)
+        after = reader.get_shared_postings_cache_stats()
+        conn.send((lists, {stat: after[stat] - before[stat] for stat in ('hits', 'misses')},
+            run_queries(False), run_queries(True)))
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.get_context('fork').Process(target=child, args=(child_conn,))
+    process.start()
+    lists, stats, conjunctive, disjunctive = parent_conn.recv()
+    process.join()
+    assert lists == shared
+    assert stats == {'hits': len(tokens), 'misses': 0} # none decoded by the child
+    assert (conjunctive, disjunctive) == shared_cache
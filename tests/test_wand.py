@@ -0,0 +1,63 @@
+# tests/test_wand.py
+#
+# top-k retrieval with WAND (see lib/wand.py) against scoring
+# every document that contains any of the terms
+
+import pytest
+
+from lib import reader
+from lib.params import importance
+from lib.wand import wand_topk
+from lib.writer import term_idf
+from lib.queryproc import prepare_query, evaluate_query
+
+QUERIES = ["machine learning", "data research student", "quantum w7 w42", "python w150"]
+
+
+def query_idfs(query):
+    return {token: term_idf(reader.get_term_stats(token)[0], reader.get_num_nonempty_documents())
+        for token in prepare_query(query)}
+
+
+def exhaustive_topk(idfs, k):
+    """Returns the top k (score, docid) of the documents that contain any
+    of the tokens by tfidf sum, scoring every posting of the tokens.
+    """
+    scores = {}
+    for token, idf in idfs.items():
+        for posting in reader.get_postings(token):
+            document = reader.get_document(posting.docid)
+            scores[posting.docid] = scores.get(posting.docid, 0.0) + (
+                posting.tf / document.total_tokens * idf * importance[posting.fields['important']])
+    return sorted(((score, docid) for docid, score in scores.items()), key=lambda item: (-item[0], item[1]))[:k]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_wand_matches_exhaustive(single_index, query, k):
+    idfs = query_idfs(query)
+    results, _ = wand_topk(idfs, k)
+    expected = exhaustive_topk(idfs, k)
+    assert [score for score, _, _ in results] == pytest.approx([score for score, _ in expected])
+    # the documents of a score are the same unless they tie with the k-th
+    kth = expected[-1][0]
+    assert ({docid for score, docid, _ in results if score > kth + 1e-12}
+        == {docid for score, docid in expected if score > kth + 1e-12})
+    for _, docid, matched in results:
+        assert set(matched) == {token for token in idfs
+            if docid in {posting.docid for posting in reader.get_postings(token)}}
+
+
+def test_wand_skips_documents(single_index):
+    idfs = query_idfs("quantum w7 w42")
+    num_matched = len(set().union(*({posting.docid for posting in reader.get_postings(token)} for token in idfs)))
+    _, num_scored = wand_topk(idfs, 1)
+    assert num_scored < num_matched
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_disjunctive_ranks_every_match(single_index, query):
+    frequencies = prepare_query(query)
+    ranked, _ = evaluate_query(frequencies, k=None, disjunctive=True, tiered=False)
+    matched = set().union(*({posting.docid for posting in reader.get_postings(token)} for token in frequencies))
+    assert {docid for docid, _ in ranked} == matched
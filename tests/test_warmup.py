@@ -0,0 +1,47 @@
+# tests/test_warmup.py
+#
+# warming up the caches from the query log (see lib/warmup.py)
+
+from lib import queryproc
+from lib import reader
+from lib.querylog import QueryLog
+from lib.warmup import CacheWarmer
+from lib.queryproc import prepare_query, evaluate_query, process_query
+
+QUERIES = ["machine learning", "data research student", "quantum w7"]
+
+
+def warm_up(tmp_path, max_bytes=1 << 30):
+    filename = str(tmp_path / "querylog")
+    log = QueryLog(filename)
+    for query in QUERIES:
+        log.record(query)
+    log.close()
+    warmer = CacheWarmer(filename, 60, max_bytes)
+    warmer.run()
+    return warmer.status()
+
+
+def test_dense_terms_are_warmed_as_bitmaps(monkeypatch, tmp_path, single_index):
+    monkeypatch.setattr(queryproc, "_RESULT_CACHE", None)
+    tokens = set().union(*(prepare_query(query) for query in QUERIES))
+    status = warm_up(tmp_path)
+    assert status['done'] and status['postings'] == len(tokens)
+    bitmaps = {token: reader.get_bitmap_postings(token) for token in tokens}
+    assert all(bitmap is not None for bitmap in bitmaps.values()) # every query term is dense
+    assert status['bytes'] == sum(bitmap.nbytes() for bitmap in bitmaps.values())
+    # the bitmaps are cached, the decoded postings lists are not
+    keys = single_index.postings_cache.hot_keys()
+    assert {('bitmap', token) for token in tokens} <= set(keys)
+    assert not tokens & {key for key in keys if isinstance(key, str)}
+
+
+def test_warmed_results_match_the_index(monkeypatch, tmp_path, single_index):
+    monkeypatch.setattr(queryproc, "_RESULT_CACHE", None)
+    queryproc.enable_result_cache(1 << 20)
+    status = warm_up(tmp_path)
+    assert status['queries'] == len(QUERIES)
+    for query in QUERIES:
+        expected, total = evaluate_query(prepare_query(query), k=10)
+        assert process_query(query, 10) == (expected, total)
+    assert queryproc.get_result_cache_stats()['hits'] == len(QUERIES)
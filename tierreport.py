@@ -0,0 +1,90 @@
+# tierreport.py
+#
+# reports the recall and latency of answering queries
+# from the high tier (champion lists) against the full postings lists
+#
+# usage: python tierreport.py [-k k] [path/to/queries]
+
+import sys
+import time
+from lib.reader import initialize, get_champions, clear_postings_cache
+from lib.indexfiles import *
+import lib.queryproc as queryproc
+
+USAGE_MSG = "usage: python tierreport.py [-k k] [path/to/queries]"
+
+QUERIES_NAME = "rsrc/queries.txt"
+
+
+def timed_query(query, k, tiered):
+    """Runs the query with cold caches and then with warm caches.
+    Returns the docids of the results along with both query times (ms).
+    """
+    clear_postings_cache()
+
+    times = []
+    for _ in range(2):
+        start_time = time.time_ns()
+        result, _ = queryproc.process_query(query, k, tiered=tiered)
+        end_time = time.time_ns()
+        times.append((end_time - start_time) / 1_000_000)
+    return [docid for docid, _ in result], times[0], times[1]
+
+
+def report(queries, k):
+    """Prints the recall@k of the high tier against the full postings lists
+    and the query times (cold / warm caches) of both for each query.
+    """
+    print(f"High tier size: {get_champions()} postings per token")
+    print(f"{'query':<40} {'full cold':>10} {'full warm':>10} {'tier cold':>10} {'tier warm':>10} {'recall@' + str(k):>10}")
+
+    totals = [0.0] * 5
+    for query in queries:
+        full, full_cold, full_warm = timed_query(query, k, tiered=False)
+        tier, tier_cold, tier_warm = timed_query(query, k, tiered=True)
+        recall = len(set(full) & set(tier)) / len(full) if full else 1.0
+
+        row = [full_cold, full_warm, tier_cold, tier_warm, recall]
+        for i, val in enumerate(row):
+            totals[i] += val
+        label = query if len(query) <= 40 else query[:37] + "..."
+        print(f"{label:<40} {full_cold:>10.2f} {full_warm:>10.2f} {tier_cold:>10.2f} {tier_warm:>10.2f} {recall:>10.2f}")
+
+    averages = [total / len(queries) for total in totals] if queries else totals
+    print(f"{'average':<40} " + " ".join(f"{val:>10.2f}" for val in averages))
+    print("(query times are in milliseconds)")
+
+
+if __name__ == "__main__":
+    argc = len(sys.argv)
+    k = 5
+    queries_filename = QUERIES_NAME
+
+    try:
+        arg = 1
+        if arg < argc and sys.argv[arg] == "-k":
+            k = int(sys.argv[arg + 1])
+            assert k > 0, USAGE_MSG
+            arg += 2
+        if arg < argc:
+            queries_filename = sys.argv[arg]
+            arg += 1
+        assert arg == argc, USAGE_MSG
+    except Exception as e:
+        print(USAGE_MSG)
+        sys.exit(1)
+
+    initialize(
+        docinfo_filename=DOCINFO_NAME,
+        mergeinfo_filename=MERGEINFO_NAME,
+        buckets_dir=BUCKETS_DIR
+    )
+
+    if not get_champions():
+        print("The index has no high tier. Rebuild it with: python makeindex.py --champions r path/to/pages")
+        sys.exit(1)
+
+    with open(queries_filename, 'r', encoding='utf-8') as queriesfh:
+        queries = [line.strip() for line in queriesfh if line.strip()]
+
+    report(queries, k)